@@ -28,24 +28,35 @@ sys.path.insert(0, src_dir)
 
 # Maintenant Python peut trouver nos modules dans src/
 from validation import validate_mac, validate_ip       # Fonctions de validation MAC/IP
-from config import load_config, get_dhcp_server       # Gestion du fichier YAML
-from dhcp import dhcp_add                             # Fonction pour ajouter via SSH
+from client import daemon_request, print_events       # Dialogue avec le démon (s'il tourne)
+import metrics                                        # Mesure du temps de chaque phase (--profile)
 
 
 def main():
+    # === OPTION --profile ===
+    # Chaque phase (config, clé, connexion, agent, redémarrage) est mesurée
+    # dans ce processus, sans passer par le démon, et un résumé est affiché à la fin
+    if "--profile" in sys.argv:
+        sys.argv.remove("--profile")
+        metrics.enable()
+
     # === VÉRIFICATION DES ARGUMENTS ===
     # sys.argv contient les arguments : [nom_script, arg1, arg2, ...]
-    # On veut exactement 3 éléments : script + MAC + IP
-    if len(sys.argv) != 3:
+    # On veut : script + MAC + IP, ou script + --auto + MAC + réseau
+    # (--auto : l'adresse est choisie parmi les adresses libres du réseau)
+    auto = len(sys.argv) > 1 and sys.argv[1] == "--auto"
+    if len(sys.argv) != (4 if auto else 3):
         print("Usage: add-dhcp-client.py <MAC> <IP>")
+        print("       add-dhcp-client.py --auto <MAC> <NETWORK>")
         print("Example: add-dhcp-client.py 00:1a:2b:3c:4d:5e 10.20.1.60")
+        print("Example: add-dhcp-client.py --auto 00:1a:2b:3c:4d:5e 10.20.1.0/24")
         sys.exit(1)  # Quitte le programme avec code d'erreur 1
     
     # sys.argv[0] = nom du script
-    # sys.argv[1] = premier argument (MAC)
-    # sys.argv[2] = deuxième argument (IP)
-    mac_input = sys.argv[1]
-    ip_input = sys.argv[2]
+    # sys.argv[1] = premier argument (MAC), ou --auto
+    # sys.argv[2] = deuxième argument (IP), ou la MAC avec --auto
+    mac_input = sys.argv[2] if auto else sys.argv[1]
+    ip_input = None if auto else sys.argv[2]
     
     # === VALIDATION DE L'ADRESSE MAC ===
     try:
@@ -58,77 +69,51 @@ def main():
         sys.exit(1)
     
     # === VALIDATION DE L'ADRESSE IP ===
-    try:
-        # validate_ip vérifie le format et les restrictions (pas multicast, etc.)
-        ip = validate_ip(ip_input)
-    except ValueError:
-        print("error: bad IP address", file=sys.stderr)
-        sys.exit(1)
+    if auto:
+        # Le réseau (ou l'IP de son serveur) est vérifié avec la configuration
+        params = {"mac": mac, "network": sys.argv[3]}
+    else:
+        try:
+            # validate_ip vérifie le format et les restrictions (pas multicast, etc.)
+            ip = validate_ip(ip_input)
+        except ValueError:
+            print("error: bad IP address", file=sys.stderr)
+            sys.exit(1)
+        params = {"mac": mac, "ip": ip}
     
-    # === CHARGEMENT DU FICHIER DE CONFIGURATION ===
+    # === ENVOI DE LA COMMANDE ===
     # Construit le chemin complet vers superviseur.yaml
     config_file = os.path.join(project_dir, "superviseur.yaml")
-    try:
-        # load_config lit le fichier YAML et retourne un dictionnaire
-        # create=False signifie "ne pas créer le fichier s'il n'existe pas"
-        cfg = load_config(config_file, create=False)
-    except SystemExit:
-        # load_config fait déjà sys.exit() en cas d'erreur
-        # donc on propage juste la sortie
-        sys.exit(1)
-    
-    # === IDENTIFICATION DU SERVEUR DHCP ===
-    # get_dhcp_server cherche quel serveur gère le réseau de cette IP
-    # Retourne (ip_serveur, réseau) ou None si pas trouvé
-    server_info = get_dhcp_server(ip, cfg)
-    if server_info is None:
-        print("Unable to identify DHCP server", file=sys.stderr)
-        sys.exit(1)
-    
-    # server_info est un tuple : (ip_serveur, réseau)
-    # On ne veut que l'IP du serveur (premier élément, index 0)
-    server_ip = server_info[0]
-    
-    # === AUTHENTIFICATION SSH ===
-    print("Connecting to DHCP server...")
-    # getpass.getpass() demande un mot de passe sans l'afficher
-    # L'utilisateur voit le prompt mais pas ce qu'il tape
-    passphrase = getpass.getpass("SSH key passphrase (press Enter if none): ")
-    
-    # Si l'utilisateur appuie juste sur Entrée, passphrase est une chaîne vide ""
-    # Dans ce cas, on met None (fabric comprend None = pas de passphrase)
-    if passphrase == "":
-        passphrase = None
-    
-    # os.path.expanduser("~") remplace ~ par le répertoire home de l'utilisateur
-    # Ex: ~/.ssh/dhcp_superv_key devient /home/sae203/.ssh/dhcp_superv_key
-    key_file = os.path.expanduser("~/.ssh/dhcp_superv_key")
-    
-    # === AJOUT DE LA RÉSERVATION DHCP ===
-    print(f"Adding DHCP reservation on server {server_ip}...")
-    
-    # Appel de la fonction dhcp_add qui fait tout le travail :
-    # - Se connecte en SSH au serveur
-    # - Vérifie les conflits
-    # - Ajoute ou met à jour la réservation
-    # - Redémarre dnsmasq
-    success = dhcp_add(
-        ip=ip,                    # L'IP à réserver
-        mac=mac,                  # La MAC qui aura cette IP
-        server=server_ip,         # Le serveur DHCP à modifier
-        cfg=cfg,                  # La configuration (contient l'utilisateur SSH, etc.)
-        key_filename=key_file,    # Le fichier de clé privée SSH
-        passphrase=passphrase     # La passphrase de la clé (ou None)
-    )
-    
+
+    # Si le démon (superviseur-daemon.py) tourne, c'est lui qui fait le travail :
+    # configuration, clé SSH et connexions sont déjà prêtes chez lui
+    events = daemon_request("add", params, config_file)
+
+    if events is None:
+        # === MODE DIRECT ===
+        # Pas de démon : on fait tout dans ce processus
+        # (import ici seulement : fabric et paramiko sont longs à charger)
+        from service import Supervisor
+
+        # getpass.getpass() demande un mot de passe sans l'afficher
+        # Il n'est appelé que si la clé est chiffrée et absente du ssh-agent
+        supervisor = Supervisor(
+            config_file,
+            ask_passphrase=lambda: getpass.getpass("SSH key passphrase (press Enter if none): "))
+
+        # run() fait tout le travail :
+        # - Cherche le serveur DHCP qui gère le réseau de cette IP
+        #   (avec --auto : choisit la première adresse libre du réseau)
+        # - Se connecte en SSH au serveur
+        # - Vérifie les conflits
+        # - Ajoute ou met à jour la réservation
+        # - Redémarre dnsmasq
+        events = supervisor.run("add", params)
+
     # === AFFICHAGE DU RÉSULTAT ===
-    if success:
-        # f-string : permet d'insérer des variables dans la chaîne avec {variable}
-        print(f"Success: Added DHCP reservation {mac} → {ip} on server {server_ip}")
-        sys.exit(0)  # Code 0 = succès
-    else:
-        # dhcp_add a déjà affiché le message d'erreur spécifique
-        sys.exit(1)  # Code 1 = échec
+    # Les messages (succès ou erreur) sont affichés au fur et à mesure
+    # Code 0 = succès, code 1 = échec
+    sys.exit(print_events(events))
 
 
 # === POINT D'ENTRÉE DU PROGRAMME ===
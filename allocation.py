@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+allocation.py :
+Attribution automatique d'adresses libres dans un réseau de dhcp-servers
+Un bit par adresse du réseau (1 = réservée ou interdite) ; un curseur
+avance dans la table de bits, et chaque attribution coûte O(1) en moyenne
+(les octets pleins ne sont parcourus qu'une fois)
+"""
+
+import re
+import threading
+from ipaddress import IPv4Network
+
+from reservations import ip_to_int, int_to_ip
+
+
+# Premier octet de la table qui a encore un bit à 0 (une adresse libre)
+_NOT_FULL = re.compile(b"[^\xff]")
+
+
+class SubnetAllocator:
+    """
+    Table d'occupation d'un réseau
+    Les adresses données par take() restent "en attente" jusqu'à confirm()
+    ou release() : une table reconstruite les garde (voir hold())
+    """
+
+    def __init__(self, network, reserved=(), excluded=()):
+        network = IPv4Network(network)
+        self.network = str(network)
+        self.first = int(network.network_address)
+        self.size = network.num_addresses
+        self.bits = bytearray((self.size + 7) // 8)
+        # Adresses données mais pas encore écrites sur le serveur
+        self.pending = set()
+        # Empreinte de la table de réservations d'où vient l'occupation
+        self.sha256 = None
+        self._cursor = 0
+        self._lock = threading.Lock()
+
+        # Bits de bourrage au-delà de la dernière adresse (réseaux de moins de 8 adresses)
+        for offset in range(self.size, len(self.bits) * 8):
+            self._set(offset)
+
+        # Adresse du réseau et de diffusion
+        if self.size > 2:
+            self._set(0)
+            self._set(self.size - 1)
+
+        for start, end in excluded:
+            self._set_range(start - self.first, end - self.first)
+
+        for address in reserved:
+            offset = address - self.first
+            if 0 <= offset < self.size:
+                self._set(offset)
+
+    def _set(self, offset):
+        self.bits[offset >> 3] |= 1 << (offset & 7)
+
+    def _clear(self, offset):
+        self.bits[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+
+    def _set_range(self, low, high):
+        """
+        Marque les adresses low..high (décalages, bornes comprises) d'un coup
+        """
+        low, high = max(low, 0), min(high, self.size - 1)
+        if low > high:
+            return
+        # Octets entiers au milieu, bit par bit aux extrémités
+        first_full, last_full = (low + 7) >> 3, (high + 1) >> 3
+        if first_full < last_full:
+            self.bits[first_full:last_full] = b"\xff" * (last_full - first_full)
+            for offset in range(low, first_full << 3):
+                self._set(offset)
+            for offset in range(last_full << 3, high + 1):
+                self._set(offset)
+        else:
+            for offset in range(low, high + 1):
+                self._set(offset)
+
+    def _offset(self, ip):
+        offset = ip_to_int(ip) - self.first
+        if not 0 <= offset < self.size:
+            raise ValueError(f"{ip} is not in {self.network}")
+        return offset
+
+    def __contains__(self, ip):
+        try:
+            self._offset(ip)
+        except ValueError:
+            return False
+        return True
+
+    def take(self, count=1):
+        """
+        Donne jusqu'à count adresses libres (moins si le réseau est plein)
+        et les marque aussitôt : deux appels simultanés n'ont jamais la même
+        """
+        taken = []
+        with self._lock:
+            while len(taken) < count:
+                match = _NOT_FULL.search(self.bits, self._cursor >> 3)
+                if match is None:
+                    break
+                position = match.start()
+                byte = self.bits[position]
+                # Bit à 0 le plus faible de l'octet
+                offset = (position << 3) + (((byte + 1) & ~byte).bit_length() - 1)
+                self._set(offset)
+                self._cursor = offset
+                ip = int_to_ip(self.first + offset)
+                self.pending.add(ip)
+                taken.append(ip)
+        return taken
+
+    def confirm(self, ips):
+        """
+        Les adresses sont désormais dans la table du serveur (ou prises par
+        quelqu'un d'autre) : elles restent marquées
+        """
+        with self._lock:
+            self.pending.difference_update(ips)
+
+    def release(self, ips):
+        """
+        Rend des adresses données par take() mais finalement pas réservées
+        """
+        with self._lock:
+            for ip in ips:
+                self.pending.discard(ip)
+                offset = self._offset(ip)
+                self._clear(offset)
+                self._cursor = min(self._cursor, offset)
+
+    def hold(self, ips):
+        """
+        Marque des adresses en attente (reprises d'une table précédente)
+        """
+        with self._lock:
+            for ip in ips:
+                if ip in self:
+                    self._set(self._offset(ip))
+                    self.pending.add(ip)
+
+
+def build_allocator(cfg, server, table):
+    """
+    Table d'occupation du réseau d'un serveur de dhcp-servers, construite à
+    partir de sa table de réservations (CompactTable)
+    Sont exclues : les adresses des serveurs DHCP et les plages dynamiques
+    (dhcp-ranges) du serveur
+    """
+    excluded = [(ip_to_int(ip), ip_to_int(ip)) for ip in cfg["dhcp-servers"]]
+    for start, end in cfg.get("dhcp-ranges", {}).get(server, []):
+        excluded.append((ip_to_int(start), ip_to_int(end)))
+    return SubnetAllocator(cfg["dhcp-servers"][server], table.ip_numbers(), excluded)
@@ -0,0 +1,632 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+api.py :
+API HTTP/JSON locale du démon (superviseur-daemon.py --http)
+Les écritures passent par une file d'attente par serveur : les demandes
+en attente partent ensemble en un seul appel à l'agent (un seul
+redémarrage de dnsmasq), et un serveur lent ne retient que sa propre file
+Les lectures sont servies depuis le cache des tables, revérifié auprès
+du serveur au plus toutes les api_cache_ttl secondes
+"""
+
+import hmac
+import json
+import asyncio
+import functools
+from urllib.parse import urlsplit, parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor
+
+from validation import validate_mac, validate_ip, validate_macs, validate_ips
+from config import get_dhcp_server, get_dhcp_servers
+from dhcp import write_reservations, preview_reservations, get_reservations, find_mac_server
+from location import get_location_index
+from journal import get_journal, ResyncRequired
+from reservations import ReservationTable
+import metrics
+
+
+# Âge maximal (en secondes) d'une table servie sans revérification
+API_CACHE_TTL = 5
+
+# Taille maximale d'un corps de requête
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+# Nombre maximal d'en-têtes par requête
+MAX_HEADERS = 100
+
+# Délai (en secondes) pour recevoir une requête complète
+REQUEST_TIMEOUT = 30
+
+# Nombre maximal d'entrées du journal par réponse
+MAX_JOURNAL_ENTRIES = 1000
+
+# Nombre maximal d'opérations regroupées en un seul appel à l'agent
+MAX_BATCH_OPS = 10000
+
+# Statuts de l'agent qui modifient le fichier
+CHANGES = ("added", "updated", "deleted")
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    410: "Gone",
+    411: "Length Required",
+    413: "Payload Too Large",
+    422: "Unprocessable Entity",
+    500: "Internal Server Error",
+    502: "Bad Gateway",
+}
+
+
+class HttpError(Exception):
+    """
+    Erreur renvoyée telle quelle au client
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ServerWriter:
+    """
+    File d'attente des écritures d'un serveur
+    Tout ce qui attend pendant un appel à l'agent part au suivant, ensemble
+    """
+
+    def __init__(self, api, server):
+        self.api = api
+        self.server = server
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self._run())
+
+    async def submit(self, ops):
+        """
+        Met des opérations dans la file et attend leur résultat :
+        {"results": [...], "changed": bool, "reloaded": bool}
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((ops, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            count = len(batch[0][0])
+            while not self.queue.empty() and count < MAX_BATCH_OPS:
+                item = self.queue.get_nowait()
+                batch.append(item)
+                count += len(item[0])
+
+            ops = [op for item_ops, _ in batch for op in item_ops]
+            try:
+                response = await self.api.call(write_reservations, ops, self.server,
+                                               self.api.cfg(), self.api.supervisor.key_filename,
+                                               self.api.supervisor.passphrase())
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # Chaque demande reçoit ses propres résultats
+            start = 0
+            for item_ops, future in batch:
+                results = response["results"][start:start + len(item_ops)]
+                start += len(item_ops)
+                changed = any(result["status"] in CHANGES for result in results)
+                if not future.done():
+                    future.set_result({"results": results, "changed": changed,
+                                       "reloaded": response["reloaded"] or not changed})
+
+
+class Api:
+    """
+    Opérations de l'API au-dessus du superviseur (service.Supervisor)
+    """
+
+    def __init__(self, supervisor):
+        self.supervisor = supervisor
+        # Une lecture et une écriture au plus par serveur à la fois : assez
+        # de threads pour que tous les serveurs avancent en même temps
+        servers = len(supervisor.config()["dhcp-servers"])
+        self.executor = ThreadPoolExecutor(max_workers=2 * servers + 16)
+        # Les attributions attendent la file d'écriture de leur serveur, qui
+        # a besoin d'un thread de self.executor : elles ont leurs propres
+        # threads, sinon assez d'attributions simultanées bloqueraient tout
+        self.allocate_executor = ThreadPoolExecutor(max_workers=2 * servers + 16)
+        # serveur -> ServerWriter
+        self._writers = {}
+        # (serveur, hors ligne) -> lecture en cours, partagée par tous ceux qui l'attendent
+        self._reads = {}
+
+    def cfg(self):
+        """
+        Configuration, avec le même délai pour la connexion et les commandes
+        """
+        cfg = self.supervisor.config()
+        timeout = cfg.get("ssh_timeout", 30)
+        return dict(cfg, ssh_timeout=timeout, ssh_command_timeout=timeout)
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Exécute une fonction bloquante (SSH) dans un thread
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def writer(self, server):
+        if server not in self._writers:
+            self._writers[server] = ServerWriter(self, server)
+        return self._writers[server]
+
+    async def read_table(self, server, offline=False):
+        """
+        Retourne (CompactTable, état) d'un serveur
+        Les demandes simultanées pour un même serveur partagent la même lecture
+        """
+        key = (server, offline)
+        future = self._reads.get(key)
+        if future is None:
+            cfg = self.cfg()
+            future = asyncio.ensure_future(self.call(
+                get_reservations, server, cfg, self.supervisor.key_filename,
+                self.supervisor.passphrase(), offline=offline,
+                max_age=cfg.get("api_cache_ttl", API_CACHE_TTL)))
+            self._reads[key] = future
+            future.add_done_callback(lambda _: self._reads.pop(key, None))
+        # shield : un client qui s'en va n'annule pas la lecture des autres
+        return await asyncio.shield(future)
+
+    # === OPÉRATIONS ===
+
+    async def add(self, body):
+        mac, ip = _read_entry(body)
+        server_info = get_dhcp_server(ip, self.cfg())
+        if server_info is None:
+            raise HttpError(422, "unable to identify DHCP server")
+        server = server_info[0]
+
+        outcome = await self._write(server, [{"op": "upsert", "mac": mac, "ip": ip}])
+        result = outcome["results"][0]
+        payload = dict(result, ok=False, mac=mac, ip=ip, server=server)
+
+        if result["status"] == "conflict":
+            return 409, dict(payload, error="IP address already in use")
+        if not outcome["reloaded"]:
+            return 502, dict(payload, error="cannot restart dnsmasq")
+        return 200, dict(payload, ok=True)
+
+    async def remove(self, mac_input):
+        try:
+            mac = validate_mac(mac_input)
+        except ValueError:
+            raise HttpError(400, "bad MAC address")
+
+        cfg = self.cfg()
+        servers = list(cfg["dhcp-servers"].keys())
+        payload = {"ok": False, "mac": mac, "server": None}
+
+        # L'index local sait peut-être déjà où se trouve la MAC ;
+        # la suppression ne se fait que si elle y a toujours la même IP
+        outcome = None
+        hint = get_location_index(cfg).lookup(mac)
+        if hint is not None and hint[0] in servers:
+            try:
+                outcome = await self.writer(hint[0]).submit([{"op": "delete", "mac": mac, "ip": hint[1]}])
+                payload["server"] = hint[0]
+                if outcome["results"][0]["status"] != "deleted":
+                    outcome = None
+            except Exception:
+                # serveur injoignable : on cherche ailleurs
+                outcome = None
+
+        if outcome is None:
+            try:
+                hit = await self.call(find_mac_server, mac, servers, cfg,
+                                      key_filename=self.supervisor.key_filename,
+                                      passphrase=self.supervisor.passphrase(),
+                                      jobs=cfg.get("jobs", 8), timeout=cfg["ssh_timeout"])
+            except Exception as e:
+                raise HttpError(502, str(e))
+            if hit is None:
+                return 404, dict(payload, server=None, status="not_found", error="MAC address not found")
+            payload["server"] = hit[0]
+            outcome = await self._write(hit[0], [{"op": "delete", "mac": mac, "ip": hit[1]}])
+
+        result = outcome["results"][0]
+        payload.update(result)
+        if result["status"] == "not_found":
+            return 404, dict(payload, error="MAC address not found")
+        if result["status"] == "mismatch":
+            return 409, dict(payload, error=f"{mac} is now reserved for {result['current']}")
+        if not outcome["reloaded"]:
+            return 502, dict(payload, error="cannot restart dnsmasq")
+        return 200, dict(payload, ok=True)
+
+    async def batch(self, body):
+        entries = body.get("entries")
+        if not isinstance(entries, list):
+            raise HttpError(400, "entries: must be a list of {\"mac\", \"ip\"}")
+        dry_run = bool(body.get("dry_run", False))
+
+        # Mêmes règles que import-dhcp-clients.py ; colonnes validées d'un coup
+        given = [entry if isinstance(entry, dict) else {} for entry in entries]
+        mac_ok, macs = validate_macs([str(entry.get("mac", "")) for entry in given])
+        ip_ok, ips = validate_ips([str(entry.get("ip", "")) for entry in given])
+
+        rows = []
+        valid = []
+        accepted = ReservationTable()
+        for n, entry in enumerate(given):
+            row = {"mac": entry.get("mac"), "ip": entry.get("ip"), "server": None, "status": "error"}
+            rows.append(row)
+            if entry is not entries[n]:
+                row["error"] = "expected an object {\"mac\", \"ip\"}"
+                continue
+            if not mac_ok[n]:
+                row["error"] = "bad MAC address"
+                continue
+            if not ip_ok[n]:
+                row["error"] = "bad IP address"
+                continue
+            mac, ip = macs[n], ips[n]
+            row["mac"], row["ip"] = mac, ip
+            if mac in accepted:
+                row["error"] = f"duplicate MAC (already in this batch with {accepted.ip_of(mac)})"
+                continue
+            if accepted.macs_of(ip):
+                row["error"] = f"duplicate IP (already in this batch for {accepted.macs_of(ip)[0]})"
+                continue
+            accepted.upsert(mac, ip)
+            valid.append(row)
+
+        by_server = {}
+        for row, server_info in zip(valid, get_dhcp_servers([row["ip"] for row in valid], self.cfg())):
+            if server_info is None:
+                row["error"] = "unable to identify DHCP server"
+                continue
+            row["server"] = server_info[0]
+            by_server.setdefault(server_info[0], []).append(row)
+
+        # Tous les serveurs en même temps, un seul lot par serveur
+        await asyncio.gather(*(self._batch_server(server, server_rows, dry_run)
+                               for server, server_rows in by_server.items()))
+
+        ok = all(row["status"] not in ("error", "conflict") for row in rows)
+        return 200, {"ok": ok, "dry_run": dry_run, "results": rows}
+
+    async def _batch_server(self, server, rows, dry_run):
+        try:
+            if dry_run:
+                results = await self.call(preview_reservations, [(row["mac"], row["ip"]) for row in rows],
+                                          server, self.cfg(), self.supervisor.key_filename,
+                                          self.supervisor.passphrase())
+                reloaded = True
+            else:
+                outcome = await self.writer(server).submit(
+                    [{"op": "upsert", "mac": row["mac"], "ip": row["ip"]} for row in rows])
+                results, reloaded = outcome["results"], outcome["reloaded"]
+        except Exception as e:
+            for row in rows:
+                row["error"] = f"server {server} failed: {e}"
+            return
+
+        for row, result in zip(rows, results):
+            row.update(result)
+            if result["status"] == "conflict":
+                row["error"] = f"IP address already in use by {result['owner']}"
+            elif result["status"] in CHANGES and not reloaded:
+                row["status"] = "error"
+                row["error"] = "cannot restart dnsmasq"
+
+    async def allocate(self, body):
+        """
+        Attribue une adresse libre du réseau "network" à chaque MAC de "macs"
+        Les écritures passent par la file du serveur, comme les autres
+        """
+        macs = body.get("macs")
+        if not isinstance(macs, list) or not macs:
+            raise HttpError(400, "macs: must be a non-empty list of MAC addresses")
+        mac_ok, normalized = validate_macs([str(mac) for mac in macs])
+        if not all(mac_ok):
+            raise HttpError(400, f"bad MAC address: {macs[mac_ok.index(False)]}")
+        if len(set(normalized)) != len(normalized):
+            raise HttpError(400, "duplicate MAC address in macs")
+        network = body.get("network")
+        if not isinstance(network, str) or self.supervisor.servers_for(network, allow_server_ip=True) is None:
+            raise HttpError(404, "cannot identify DHCP server")
+
+        loop = asyncio.get_running_loop()
+
+        async def submit(server, ops):
+            return await self.writer(server).submit(ops)
+
+        def write(server, ops):
+            # Appelé depuis un thread : on attend la file du serveur dans la boucle
+            return asyncio.run_coroutine_threadsafe(submit(server, ops), loop).result()
+
+        results = await loop.run_in_executor(
+            self.allocate_executor, functools.partial(self.supervisor.allocate, normalized, network, write=write))
+        return 200, {"ok": all(result["ok"] for result in results), "results": results}
+
+    async def list(self, query):
+        servers, offline = self._targets(query, allow_server_ip=True)
+        tables = await asyncio.gather(*(self.read_table(server, offline) for server in servers),
+                                      return_exceptions=True)
+
+        items = []
+        for server, fetched in zip(servers, tables):
+            item = {"server": server}
+            if isinstance(fetched, Exception):
+                item["error"] = str(fetched) or type(fetched).__name__
+            else:
+                table, state = fetched
+                item.update(state, entries=table.entries())
+            items.append(item)
+        return 200, {"ok": all("error" not in item for item in items), "servers": items}
+
+    async def check(self, query):
+        servers, offline = self._targets(query)
+        tables = await asyncio.gather(*(self.read_table(server, offline) for server in servers),
+                                      return_exceptions=True)
+
+        items = []
+        for server, fetched in zip(servers, tables):
+            item = {"server": server}
+            if isinstance(fetched, Exception):
+                item["error"] = str(fetched) or type(fetched).__name__
+            else:
+                table, state = fetched
+                item.update(state, duplicate_macs=table.duplicate_macs(),
+                            duplicate_ips=table.duplicate_ips())
+            items.append(item)
+        return 200, {"ok": all("error" not in item for item in items), "servers": items}
+
+    def get_metrics(self, query):
+        """
+        GET /metrics : mesures du démon (lancé avec --profile ou SUPERVISEUR_PROFILE=1)
+        en JSON, ou au format texte de Prometheus avec ?format=prometheus
+        """
+        if query.get("format", ["json"])[0] == "prometheus":
+            return 200, metrics.prometheus_text()
+        return 200, dict(ok=True, enabled=metrics.enabled(), **metrics.snapshot())
+
+    def journal_page(self, since, server, limit):
+        """
+        Retourne (entrées de numéro supérieur à since, au plus limit ;
+        numéro de la dernière entrée parcourue ; reste-t-il des entrées)
+        """
+        entries = []
+        last = since
+        for entry in get_journal(self.cfg()).read(since):
+            if server is not None and entry["server"] != server:
+                last = entry["seq"]
+                continue
+            if len(entries) == limit:
+                return entries, last, True
+            entries.append(entry)
+            last = entry["seq"]
+        return entries, last, False
+
+    async def journal(self, query):
+        """
+        GET /journal?since=N : modifications faites depuis l'entrée N, pour
+        qu'un miroir se mette à jour sans tout relire ; il rappelle avec
+        since=last tant que more est vrai
+        410 avec resync=true si ces entrées ont été compactées : le miroir
+        repart de since=0 ; 500 si le journal est illisible
+        """
+        try:
+            since = int(query.get("since", ["0"])[0])
+            limit = min(int(query.get("limit", [str(MAX_JOURNAL_ENTRIES)])[0]), MAX_JOURNAL_ENTRIES)
+        except ValueError:
+            raise HttpError(400, "since and limit must be integers")
+        if since < 0 or limit < 1:
+            raise HttpError(400, "since must be >= 0 and limit >= 1")
+
+        server = None
+        if query.get("target"):
+            servers, _ = self._targets(query, allow_server_ip=True)
+            server = servers[0]
+
+        try:
+            entries, last, more = await self.call(self.journal_page, since, server, limit)
+        except ResyncRequired as e:
+            return 410, {"ok": False, "error": str(e), "resync": True, "horizon": e.horizon}
+        except OSError as e:
+            # Répertoire du journal illisible ou abîmé
+            return 500, {"ok": False, "error": f"cannot read change journal: {e}"}
+        return 200, {"ok": True, "entries": entries, "last": last, "more": more}
+
+    def _targets(self, query, allow_server_ip=False):
+        target = query.get("target", [None])[0]
+        offline = query.get("offline", ["0"])[0] in ("1", "true", "yes")
+        servers = self.supervisor.servers_for(target, allow_server_ip)
+        if servers is None:
+            raise HttpError(404, "cannot identify DHCP server")
+        return servers, offline
+
+    async def _write(self, server, ops):
+        try:
+            return await self.writer(server).submit(ops)
+        except Exception as e:
+            raise HttpError(502, str(e) or type(e).__name__)
+
+    # === HTTP ===
+
+    async def dispatch(self, method, target, headers, body):
+        """
+        Retourne (statut HTTP, objet JSON) pour une requête
+        """
+        token = self.supervisor.config().get("api_token")
+        if token is not None:
+            given = headers.get("authorization", "")
+            if not hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+                raise HttpError(401, "missing or bad token")
+
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        query = parse_qs(url.query)
+
+        if path == "/health":
+            routes = {"GET": lambda: (200, {"ok": True})}
+        elif path == "/reservations":
+            routes = {"GET": lambda: self.list(query), "POST": lambda: self.add(_json(body))}
+        elif path == "/reservations/batch":
+            routes = {"POST": lambda: self.batch(_json(body))}
+        elif path == "/reservations/allocate":
+            routes = {"POST": lambda: self.allocate(_json(body))}
+        elif path.startswith("/reservations/"):
+            routes = {"DELETE": lambda: self.remove(unquote(path[len("/reservations/"):]))}
+        elif path == "/check":
+            routes = {"GET": lambda: self.check(query)}
+        elif path == "/metrics":
+            routes = {"GET": lambda: self.get_metrics(query)}
+        elif path == "/journal":
+            routes = {"GET": lambda: self.journal(query)}
+        else:
+            raise HttpError(404, f"no such endpoint: {path}")
+
+        if method not in routes:
+            raise HttpError(405, f"{method} not allowed on {path}")
+        result = routes[method]()
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    async def handle(self, reader, writer):
+        """
+        Une connexion HTTP/1.1 (plusieurs requêtes possibles : keep-alive)
+        """
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), REQUEST_TIMEOUT)
+                except HttpError as e:
+                    _respond(writer, e.status, {"ok": False, "error": str(e)}, keep_alive=False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+
+                method, target, version, headers, body = request
+                try:
+                    status, payload = await self.dispatch(method, target, headers, body)
+                except HttpError as e:
+                    status, payload = e.status, {"ok": False, "error": str(e)}
+                except Exception as e:
+                    # Configuration devenue invalide, fichier d'état illisible... :
+                    # le client reçoit quand même une réponse
+                    status, payload = 500, {"ok": False, "error": str(e) or type(e).__name__}
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                _respond(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            # Client parti, ou trop lent à envoyer sa requête
+            pass
+        finally:
+            writer.close()
+
+
+def _read_entry(body):
+    """
+    Retourne (mac, ip) validés d'un objet {"mac": ..., "ip": ...}
+    """
+    if not isinstance(body, dict):
+        raise HttpError(400, "expected an object {\"mac\", \"ip\"}")
+    try:
+        mac = validate_mac(str(body.get("mac", "")))
+    except ValueError:
+        raise HttpError(400, "bad MAC address")
+    try:
+        ip = validate_ip(str(body.get("ip", "")))
+    except ValueError:
+        raise HttpError(400, "bad IP address")
+    return mac, ip
+
+
+def _json(body):
+    """
+    Décode le corps JSON d'une requête (un objet)
+    """
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        raise HttpError(400, "body is not valid JSON")
+    if not isinstance(data, dict):
+        raise HttpError(400, "body must be a JSON object")
+    return data
+
+
+async def _read_request(reader):
+    """
+    Lit une requête HTTP : (méthode, cible, version, en-têtes, corps)
+    Retourne None si le client a fermé la connexion
+    """
+    try:
+        line = await reader.readline()
+    except ValueError:
+        raise HttpError(400, "request line too long")
+    if not line:
+        return None
+
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise HttpError(400, "bad request line")
+    method, target, version = parts
+
+    headers = {}
+    while True:
+        try:
+            line = await reader.readline()
+        except ValueError:
+            raise HttpError(400, "header too long")
+        if line in (b"\r\n", b"\n"):
+            break
+        if not line:
+            raise asyncio.IncompleteReadError(b"", None)
+        if len(headers) >= MAX_HEADERS:
+            raise HttpError(400, "too many headers")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if "transfer-encoding" in headers:
+        raise HttpError(411, "chunked bodies are not supported, send Content-Length")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HttpError(400, "bad Content-Length")
+    if length < 0:
+        raise HttpError(400, "bad Content-Length")
+    if length > MAX_BODY_SIZE:
+        raise HttpError(413, f"body larger than {MAX_BODY_SIZE} bytes")
+
+    body = await reader.readexactly(length) if length else b""
+    return method, target, version, headers, body
+
+
+def _respond(writer, status, payload, keep_alive):
+    """
+    Envoie une réponse JSON (ou texte brut si payload est une chaîne)
+    """
+    if isinstance(payload, str):
+        data, content_type = payload.encode(), "text/plain; version=0.0.4"
+    else:
+        data, content_type = json.dumps(payload).encode(), "application/json"
+    head = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(data)}"]
+    if not keep_alive:
+        head.append("Connection: close")
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
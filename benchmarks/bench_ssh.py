@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_ssh.py :
+Mesure dhcp_add, dhcp_list et check-dhcp de bout en bout, sans serveur réel
+Les sessions SSH de dhcp.py sont remplacées par une fausse connexion qui
+lance le vrai dhcp-agent.py sur un hosts.conf temporaire (avec un faux
+systemctl), en ajoutant la latence réseau et le coût de la poignée de main
+Pour chaque opération : durée, allers-retours, poignées de main et octets
+échangés. Les résultats sont enregistrés en JSON pour comparer les versions
+Avec --hosts-dir, l'agent range les réservations dans un répertoire
+dhcp-hostsdir (pas de redémarrage pour un ajout, SIGHUP sinon)
+Usage : python3 benchmarks/bench_ssh.py [--sizes 10,1000,100000] [--latency 0.02]
+                                        [--hosts-dir] [--compare ancien.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from os.path import dirname, abspath, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dhcp
+import cache
+import location
+from config import compile_config
+from service import Supervisor
+
+AGENT = join(ROOT, "dhcp-agent.py")
+SERVER = "10.0.0.1"
+NETWORK = "10.0.0.0/8"
+
+
+class Stats:
+    """
+    Compteurs cumulés de toutes les fausses connexions
+    """
+
+    def __init__(self):
+        self.round_trips = 0
+        self.handshakes = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def snapshot(self):
+        return dict(vars(self))
+
+
+class FakeChannel:
+    """
+    Canal d'une commande : la requête est envoyée à l'agent quand stdin est fermé
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.request = b""
+        self.stdout = self.stderr = b""
+        self.status = None
+
+    def settimeout(self, timeout):
+        pass
+
+    def exec_command(self, command):
+        pass
+
+    def sendall(self, data):
+        self.request += data
+
+    def shutdown_write(self):
+        bench = self.connection.bench
+        command = [sys.executable, AGENT, "--hosts-file", bench.hosts_file,
+                   "--lock-file", bench.hosts_file + ".lock", "--leases-file", bench.leases_file,
+                   "--reload-cmd", f"{bench.systemctl} restart dnsmasq"]
+        if bench.hosts_dir is not None:
+            command += ["--hosts-dir", bench.hosts_dir, "--hup-cmd", f"{bench.systemctl} reload dnsmasq"]
+        done = subprocess.run(command, input=self.request, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.stdout, self.stderr, self.status = done.stdout, done.stderr, done.returncode
+
+        stats = bench.stats
+        stats.round_trips += 1
+        stats.bytes_sent += len(self.request)
+        stats.bytes_received += len(self.stdout) + len(self.stderr)
+        # Un aller-retour, plus le temps de transfert si le débit est limité
+        delay = bench.latency
+        if bench.bandwidth:
+            delay += (len(self.request) + len(self.stdout)) / bench.bandwidth
+        time.sleep(delay)
+
+    def makefile(self, mode):
+        return io.BytesIO(self.stdout)
+
+    def makefile_stderr(self, mode):
+        return io.BytesIO(self.stderr)
+
+    def recv_exit_status(self):
+        return self.status
+
+    def close(self):
+        pass
+
+
+class FakeTransport:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def open_session(self):
+        return FakeChannel(self.connection)
+
+    def send_ignore(self):
+        pass
+
+
+class FakeConnection:
+    """
+    Remplace fabric.Connection dans dhcp.py : une poignée de main au
+    premier open(), puis des canaux sur la même session
+    """
+
+    bench = None
+
+    def __init__(self, host, user=None, connect_kwargs=None, connect_timeout=None):
+        self.host = host
+        self.is_connected = False
+        self.transport = None
+
+    def open(self):
+        if not self.is_connected:
+            self.bench.stats.handshakes += 1
+            time.sleep(self.bench.handshake)
+            self.transport = FakeTransport(self)
+            self.is_connected = True
+
+    def close(self):
+        self.is_connected = False
+        self.transport = None
+
+
+class Bench:
+    """
+    Un faux serveur : répertoire temporaire avec hosts.conf, dnsmasq.leases,
+    faux systemctl, configuration et répertoire d'état du superviseur
+    """
+
+    def __init__(self, size, latency, handshake, bandwidth, reload_delay, hosts_dir=False, reload_window=0):
+        self.size = size
+        self.latency = latency
+        self.handshake = handshake
+        self.bandwidth = bandwidth
+        self.stats = Stats()
+
+        self.directory = tempfile.mkdtemp(prefix="bench-ssh-")
+        self.hosts_file = join(self.directory, "hosts.conf")
+        self.leases_file = join(self.directory, "dnsmasq.leases")
+        self.state_dir = join(self.directory, "state")
+        self.config_path = join(self.directory, "superviseur.yaml")
+        self.hosts_dir = join(self.directory, "hosts.d") if hosts_dir else None
+
+        with open(self.hosts_file, "w") as f:
+            for n in range(size):
+                f.write(f"dhcp-host={make_mac(n)},{make_ip(n)}\n")
+        with open(self.leases_file, "w") as f:
+            for n in range(0, size, 2):
+                f.write(f"{int(time.time()) + 3600} {make_mac(n)} {make_ip(n)} * *\n")
+
+        if self.hosts_dir is not None:
+            self._migrate()
+
+        self.systemctl = join(self.directory, "systemctl")
+        with open(self.systemctl, "w") as f:
+            f.write(f"#!/bin/sh\nsleep {reload_delay}\nexit 0\n")
+        os.chmod(self.systemctl, 0o755)
+
+        with open(self.config_path, "w") as f:
+            f.write(f"user: bench\ndhcp_hosts_cfg: {self.hosts_file}\nstate_dir: {self.state_dir}\n"
+                    f"reload_window: {reload_window}\ndhcp-servers:\n  {SERVER}: {NETWORK}\n")
+        self.cfg = compile_config(self.config_path)
+        self.added = 0
+
+    def _migrate(self):
+        done = subprocess.run([sys.executable, AGENT, "--migrate", "--hosts-file", self.hosts_file,
+                               "--hosts-dir", self.hosts_dir, "--lock-file", self.hosts_file + ".lock",
+                               "--reload-cmd", "true"], stdout=subprocess.PIPE)
+        if done.returncode != 0:
+            raise RuntimeError(f"migration failed: {done.stdout}")
+
+    def cold(self):
+        """
+        Comme un nouveau processus sans cache : sessions fermées, cache local vidé
+        """
+        dhcp.close_sessions()
+        shutil.rmtree(self.state_dir, ignore_errors=True)
+        cache._caches.clear()
+        location._indexes.clear()
+
+    def warm(self):
+        """
+        Session ouverte et cache à jour (le démon, ou un script juste après un autre)
+        """
+        dhcp.dhcp_list(SERVER, self.cfg)
+
+    def dhcp_list(self):
+        dhcp.dhcp_list(SERVER, self.cfg)
+
+    def dhcp_add(self):
+        # Une nouvelle MAC à chaque fois, hors des réservations générées
+        self.added += 1
+        n = (1 << 22) + self.added
+        if not dhcp.dhcp_add(make_ip(n), make_mac(n), SERVER, self.cfg):
+            raise RuntimeError("dhcp_add failed")
+
+    def check(self, leases=False):
+        supervisor = Supervisor(self.config_path, key_filename="")
+        events = list(supervisor.run("check", {"leases": leases}))
+        if events[-1] != {"exit": 0}:
+            raise RuntimeError(f"check failed: {events}")
+
+    def close(self):
+        dhcp.close_sessions()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def make_mac(n):
+    digits = f"{0x020000000000 + n:012x}"
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def make_ip(n):
+    n += 256
+    return f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+
+
+# Opérations mesurées : (nom, préparation, mesure)
+OPERATIONS = [
+    ("dhcp_list cold", Bench.cold, Bench.dhcp_list),
+    ("dhcp_list warm", Bench.warm, Bench.dhcp_list),
+    ("dhcp_add", Bench.warm, Bench.dhcp_add),
+    ("check cold", Bench.cold, Bench.check),
+    ("check warm", Bench.warm, Bench.check),
+    ("check --leases", Bench.warm, lambda bench: bench.check(leases=True)),
+]
+
+
+def measure(bench, prepare, operation, repeat):
+    durations = []
+    counters = []
+    for _ in range(repeat):
+        prepare(bench)
+        before = bench.stats.snapshot()
+        start = time.perf_counter()
+        operation(bench)
+        durations.append(time.perf_counter() - start)
+        after = bench.stats.snapshot()
+        counters.append({key: after[key] - before[key] for key in after})
+
+    result = {"runs": repeat,
+              "median": statistics.median(durations), "mean": statistics.mean(durations),
+              "min": min(durations), "max": max(durations)}
+    for key in counters[0]:
+        result[key] = statistics.mean(c[key] for c in counters)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_results(results, previous=None):
+    """
+    Tableau des résultats (avec le rapport à la mesure précédente si fournie)
+    """
+    old = {}
+    if previous is not None:
+        old = {(r["operation"], r["size"]): r for r in previous["results"]}
+
+    print(f"{'operation':<16}{'size':>9}{'median':>10}{'trips':>7}{'hands':>7}"
+          f"{'sent':>10}{'received':>11}{'vs old':>9}")
+    for r in results:
+        line = (f"{r['operation']:<16}{r['size']:>9}{r['median'] * 1000:>8.1f}ms"
+                f"{r['round_trips']:>7.1f}{r['handshakes']:>7.1f}"
+                f"{int(r['bytes_sent']):>10}{int(r['bytes_received']):>11}")
+        before = old.get((r["operation"], r["size"]))
+        if before is not None and before["median"]:
+            line += f"{r['median'] / before['median']:>8.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of dhcp.py against a local fake server")
+    parser.add_argument("--sizes", default="10,1000,100000",
+                        help="comma-separated numbers of reservations (default: 10,1000,100000)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per operation (default: 5)")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds per round trip (default: 0.02)")
+    parser.add_argument("--handshake", type=float, default=0.1,
+                        help="seconds per SSH handshake (default: 0.1)")
+    parser.add_argument("--bandwidth", type=float, default=0,
+                        help="bytes per second, 0 for unlimited (default: 0)")
+    parser.add_argument("--reload-delay", type=float, default=0,
+                        help="seconds taken by the fake 'systemctl restart' (default: 0)")
+    parser.add_argument("--reload-window", type=float, default=0,
+                        help="seconds the agent waits to group reloads (default: 0)")
+    parser.add_argument("--hosts-dir", action="store_true",
+                        help="store the reservations in a dhcp-hostsdir directory")
+    parser.add_argument("--output", help="JSON results file (default: benchmarks/results/<date>.json)")
+    parser.add_argument("--compare", help="previous JSON results file to compare with")
+    args = parser.parse_args()
+
+    # Les sessions de dhcp.py passent par la fausse connexion
+    dhcp.Connection = FakeConnection
+    dhcp._connect_kwargs = lambda key_filename=None, passphrase=None: {}
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        bench = Bench(size, args.latency, args.handshake, args.bandwidth, args.reload_delay, args.hosts_dir,
+                      args.reload_window)
+        FakeConnection.bench = bench
+        try:
+            for name, prepare, operation in OPERATIONS:
+                result = measure(bench, prepare, operation, args.repeat)
+                results.append(dict(operation=name, size=size, **result))
+                print(f"{name} ({size}): {result['median'] * 1000:.1f} ms", file=sys.stderr)
+        finally:
+            bench.close()
+
+    report = {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(),
+              "python": platform.python_version(),
+              "params": {"latency": args.latency, "handshake": args.handshake,
+                         "bandwidth": args.bandwidth, "reload_delay": args.reload_delay,
+                         "hosts_dir": args.hosts_dir, "reload_window": args.reload_window,
+                         "repeat": args.repeat},
+              "results": results}
+
+    output = args.output
+    if output is None:
+        os.makedirs(join(ROOT, "benchmarks", "results"), exist_ok=True)
+        output = join(ROOT, "benchmarks", "results", f"bench_ssh-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_results(results, previous)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_tables.py :
+Compare la mémoire et le temps de recherche des doublons d'une table de
+réservations en dictionnaires (ReservationTable) et en tableaux
+d'entiers (CompactTable)
+Usage : python3 benchmarks/bench_tables.py [nombre de réservations]
+"""
+
+import sys
+import time
+import random
+import tracemalloc
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from reservations import ReservationTable, CompactTable
+
+
+def make_entries(count):
+    """
+    Réservations d'audit : quelques doublons MAC et IP
+    """
+    rng = random.Random(203)
+    entries = []
+    for n in range(count):
+        digits = f"{rng.getrandbits(48):012x}"
+        mac = ":".join(digits[i:i + 2] for i in range(0, 12, 2))
+        ip = f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+        entries.append({"mac": mac, "ip": ip})
+    for n in range(0, count, 1000):
+        entries[n]["ip"] = entries[n + 1]["ip"] if n + 1 < count else entries[n]["ip"]
+    return entries
+
+
+def measure(name, build, entries):
+    tracemalloc.start()
+    start = time.perf_counter()
+    table = build(entries)
+    built = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    duplicates = len(table.duplicate_macs()) + len(table.duplicate_ips())
+    checked = time.perf_counter() - start
+    print(f"{name:>8}: {memory / 1e6:7.1f} MB, built in {built:.2f}s, "
+          f"duplicates in {checked:.2f}s ({duplicates} found)")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    entries = make_entries(count)
+    measure("dicts", ReservationTable.from_entries, entries)
+    measure("compact", CompactTable.from_entries, entries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_validation.py :
+Compare la validation adresse par adresse (ancienne version et
+validate_mac / validate_ip) et la validation de colonnes entières
+(validate_macs / validate_ips)
+Usage : python3 benchmarks/bench_validation.py [nombre de lignes]
+"""
+
+import sys
+import time
+import random
+from ipaddress import IPv4Address
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from validation import validate_mac, validate_ip, validate_macs, validate_ips
+
+
+def make_rows(count):
+    """
+    Lignes d'import réalistes : surtout des MACs normales, quelques autres
+    notations et environ 1 % de valeurs invalides
+    """
+    rng = random.Random(203)
+    macs, ips = [], []
+    for n in range(count):
+        digits = f"{rng.getrandbits(48):012x}"
+        form = rng.random()
+        if form < 0.85:
+            mac = ":".join(digits[i:i + 2] for i in range(0, 12, 2))
+        elif form < 0.92:
+            mac = "-".join(digits[i:i + 2] for i in range(0, 12, 2)).upper()
+        elif form < 0.97:
+            mac = ".".join(digits[i:i + 4] for i in range(0, 12, 4))
+        else:
+            mac = digits
+        ip = f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+        if n % 100 == 0:
+            mac, ip = mac[:-1] + "g", ip + ".1"
+        macs.append(mac)
+        ips.append(ip)
+    return macs, ips
+
+
+def legacy_validate_mac(mac_str):
+    # Ancienne version : un caractère à la fois, forme xx:xx:xx:xx:xx:xx seulement
+    mac = mac_str.lower()
+    parts = mac.split(':')
+    if len(parts) != 6:
+        raise ValueError("bad MAC address")
+    for part in parts:
+        if len(part) != 2:
+            raise ValueError("bad MAC address")
+        for char in part:
+            if char not in '0123456789abcdef':
+                raise ValueError("bad MAC address")
+    return mac
+
+
+def legacy_validate_ip(ip_str):
+    # Ancienne version : un objet IPv4Address par adresse
+    try:
+        ip = IPv4Address(ip_str)
+        if ip.is_multicast or ip.is_unspecified or ip.is_reserved or ip.is_loopback or ip.is_link_local:
+            raise ValueError("bad IP address")
+        return ip_str
+    except Exception:
+        raise ValueError("bad IP address")
+
+
+def legacy(macs, ips):
+    mask = []
+    for mac, ip in zip(macs, ips):
+        try:
+            legacy_validate_mac(mac)
+            legacy_validate_ip(ip)
+            mask.append(True)
+        except ValueError:
+            mask.append(False)
+    return mask
+
+
+def per_item(macs, ips):
+    mask = []
+    for mac, ip in zip(macs, ips):
+        try:
+            validate_mac(mac)
+            validate_ip(ip)
+            mask.append(True)
+        except ValueError:
+            mask.append(False)
+    return mask
+
+
+def bulk(macs, ips):
+    mac_mask, _ = validate_macs(macs)
+    ip_mask, _ = validate_ips(ips)
+    return [m and i for m, i in zip(mac_mask, ip_mask)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    macs, ips = make_rows(count)
+
+    timings = {}
+    for name, func in (("legacy", legacy), ("per item", per_item), ("bulk", bulk)):
+        start = time.perf_counter()
+        mask = func(macs, ips)
+        timings[name] = time.perf_counter() - start
+        print(f"{name:>8}: {timings[name]:.3f}s for {count} rows ({sum(mask)} valid)")
+
+    # L'ancienne version ne connaît que la forme xx:xx:xx:xx:xx:xx : elle refuse les autres
+    print(f"bulk speed-up: {timings['legacy'] / timings['bulk']:.1f}x vs legacy, "
+          f"{timings['per item'] / timings['bulk']:.1f}x vs per item")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+cache.py :
+Cache local des réservations de chaque serveur
+Les tables sont rangées par empreinte SHA-256 du fichier distant
+(objects/<sha256>.bin, format compact de CompactTable), et chaque serveur
+pointe vers la version qu'il avait à la dernière lecture (servers/<serveur>.json)
+Le fichier des baux de chaque serveur est gardé tel quel (leases/<serveur>.leases) :
+la lecture suivante ne demande que la suite
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+
+from config import get_state_dir
+from reservations import ReservationTable, CompactTable
+
+
+def _write_bytes(path, data):
+    """
+    Écrit un fichier de façon atomique
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=".cache.", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path, data):
+    """
+    Écrit un fichier JSON de façon atomique
+    """
+    _write_bytes(path, json.dumps(data).encode())
+
+
+def _read_json(path):
+    """
+    Lit un fichier JSON (None s'il n'existe pas ou est abîmé)
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ReservationCache:
+    """
+    Cache des tables de réservations, indexé par empreinte du fichier distant
+    """
+
+    def __init__(self, directory):
+        self.objects_dir = os.path.join(directory, "objects")
+        self.servers_dir = os.path.join(directory, "servers")
+        self.leases_dir = os.path.join(directory, "leases")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.servers_dir, exist_ok=True)
+        os.makedirs(self.leases_dir, exist_ok=True)
+        # Tables déjà lues dans ce processus : sha256 -> CompactTable
+        # (un processus qui dure, comme le démon, ne relit pas le fichier à chaque fois)
+        self._objects = {}
+
+    def _server_path(self, server):
+        return os.path.join(self.servers_dir, f"{server}.json")
+
+    def _object_path(self, sha256):
+        return os.path.join(self.objects_dir, f"{sha256}.bin")
+
+    def get_table(self, server):
+        """
+        Retourne (métadonnées, CompactTable) de la dernière lecture du serveur
+        ou (None, None) si le serveur n'a jamais été lu
+        Métadonnées : {"fingerprint": {...}, "fetched": date de la dernière vérification}
+        """
+        meta = _read_json(self._server_path(server))
+        if meta is None:
+            return None, None
+
+        sha256 = meta["fingerprint"]["sha256"]
+        table = self._objects.get(sha256)
+        if table is None:
+            try:
+                with open(self._object_path(sha256), "rb") as f:
+                    table = CompactTable.from_bytes(f.read())
+            except (OSError, ValueError):
+                # Absente, abîmée ou d'un ancien format : le serveur sera relu en entier
+                return None, None
+            self._objects[sha256] = table
+
+        return meta, table
+
+    def get(self, server):
+        """
+        Comme get_table(), mais avec la liste [{"mac": ..., "ip": ...}]
+        """
+        meta, table = self.get_table(server)
+        if meta is None:
+            return None, None
+        return meta, table.entries()
+
+    def put(self, server, fingerprint, table=None):
+        """
+        Enregistre la version lue sur le serveur (CompactTable)
+        Sans table, elle est déjà dans le cache (réponse "not_modified")
+        """
+        sha256 = fingerprint["sha256"]
+        if table is not None and not os.path.exists(self._object_path(sha256)):
+            _write_bytes(self._object_path(sha256), table.to_bytes())
+        if table is not None:
+            self._objects[sha256] = table
+
+        old = _read_json(self._server_path(server))
+        _write_json(self._server_path(server), {"fingerprint": fingerprint, "fetched": time.time()})
+
+        # L'ancienne version n'est plus utile si aucun autre serveur ne l'a
+        if old is not None and old["fingerprint"]["sha256"] != sha256:
+            self._prune(old["fingerprint"]["sha256"])
+
+    def _prune(self, sha256):
+        """
+        Supprime une version qui n'est plus référencée par aucun serveur
+        """
+        self._objects.pop(sha256, None)
+        for name in os.listdir(self.servers_dir):
+            meta = _read_json(os.path.join(self.servers_dir, name))
+            if meta is not None and meta["fingerprint"]["sha256"] == sha256:
+                return
+        # (objects/<sha256>.json : ancien format, avant les tables compactes)
+        for path in (self._object_path(sha256), os.path.join(self.objects_dir, f"{sha256}.json")):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def forget(self, server):
+        """
+        Oublie la version connue d'un serveur
+        """
+        old = _read_json(self._server_path(server))
+        try:
+            os.unlink(self._server_path(server))
+        except FileNotFoundError:
+            pass
+        if old is not None:
+            self._prune(old["fingerprint"]["sha256"])
+
+    def _leases_path(self, server):
+        return os.path.join(self.leases_dir, f"{server}.leases")
+
+    def get_leases(self, server):
+        """
+        Retourne (contenu, date de lecture) du dernier fichier de baux lu
+        sur le serveur, ou (None, None)
+        """
+        path = self._leases_path(server)
+        try:
+            with open(path, "rb") as f:
+                return f.read(), os.fstat(f.fileno()).st_mtime
+        except OSError:
+            return None, None
+
+    def put_leases(self, server, data=None):
+        """
+        Enregistre le fichier de baux lu sur le serveur
+        Sans data, il n'a pas changé : seule la date de lecture est mise à jour
+        """
+        if data is None:
+            os.utime(self._leases_path(server))
+        else:
+            _write_bytes(self._leases_path(server), data)
+
+    def apply(self, server, response, ops):
+        """
+        Répercute sur la table en cache les modifications que l'agent vient
+        de faire, pour ne pas avoir à tout relire à la prochaine lecture
+        Si le cache n'était pas à jour avant la modification, il est oublié
+        """
+        meta, entries = self.get(server)
+        if meta is None:
+            return
+        if meta["fingerprint"]["sha256"] != response["before"]:
+            self.forget(server)
+            return
+        if not response["changed"]:
+            return
+        if response.get("reshaped"):
+            # Ligne à plusieurs MACs ou sans IP modifiée : on relira la liste
+            self.forget(server)
+            return
+
+        # Même table et mêmes règles que l'agent : on obtient le même résultat
+        table = ReservationTable.from_entries(entries)
+        table.apply(ops)
+        self.put(server, response["fingerprint"], CompactTable.from_entries(table.entries()))
+
+
+# Un seul cache par répertoire dans le processus
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(cfg):
+    """
+    Retourne le cache des réservations du répertoire d'état de la configuration
+    """
+    directory = os.path.join(get_state_dir(cfg), "cache")
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = ReservationCache(directory)
+        return _caches[directory]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+client.py :
+Client du démon du superviseur (superviseur-daemon.py)
+Ne dépend que de la bibliothèque standard : un script qui passe par le
+démon n'importe ni fabric, ni paramiko, ni yaml, et ne demande rien
+"""
+
+import os
+import sys
+import json
+import socket
+
+import metrics
+
+
+# Socket du démon (modifiable avec la variable SUPERVISEUR_SOCKET)
+SOCKET_PATH = "~/.cache/superviseur-dhcp/daemon.sock"
+
+# Délai (en secondes) pour savoir si le démon accepte la commande
+CONNECT_TIMEOUT = 2
+
+
+def socket_path():
+    """
+    Retourne le chemin de la socket du démon
+    """
+    return os.path.expanduser(os.environ.get("SUPERVISEUR_SOCKET", SOCKET_PATH))
+
+
+def daemon_request(command, params, config_path):
+    """
+    Envoie une commande au démon
+    Retourne un itérateur des lignes à afficher ({"out"}, {"err"}, {"exit"}),
+    ou None si le démon ne tourne pas ou sert une autre configuration :
+    le script passe alors en mode direct
+    """
+    # SUPERVISEUR_NO_DAEMON=1 : toujours en mode direct
+    # (de même avec --profile : les phases sont mesurées dans ce processus)
+    if os.environ.get("SUPERVISEUR_NO_DAEMON") or metrics.enabled():
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(socket_path())
+        request = {"command": command, "params": params, "config": os.path.abspath(config_path)}
+        sock.sendall(json.dumps(request).encode() + b"\n")
+
+        reader = sock.makefile("rb")
+        header = json.loads(reader.readline())
+    except (OSError, ValueError):
+        sock.close()
+        return None
+
+    if not header.get("accepted"):
+        sock.close()
+        return None
+
+    # Commande acceptée : on attend la réponse aussi longtemps qu'il faut
+    sock.settimeout(None)
+    return _events(sock, reader)
+
+
+def _events(sock, reader):
+    """
+    Lit les lignes de réponse du démon
+    """
+    with sock, reader:
+        for line in reader:
+            yield json.loads(line)
+
+
+def print_events(events):
+    """
+    Affiche les lignes d'une commande (démon ou mode direct)
+    Retourne le code de sortie
+    """
+    for event in events:
+        if "out" in event:
+            print(event["out"], flush=True)
+        elif "err" in event:
+            print(event["err"], file=sys.stderr, flush=True)
+        elif "exit" in event:
+            return event["exit"]
+
+    print("error: connection to the supervisor daemon lost", file=sys.stderr)
+    return 1
@@ -8,30 +8,282 @@ Gestion du fichier YAML de configuration
 
 import sys
 import os
+import stat
+import socket
+import pickle
+import hashlib
+import tempfile
 import yaml
 from ipaddress import IPv4Address, IPv4Network
 
+import metrics
+
+# Chargeur YAML en C s'il est disponible (beaucoup plus rapide)
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Version du format compilé (à changer si sa structure change)
+COMPILED_VERSION = 2
+
+# Clés numériques : nom -> type accepté
+NUMBER_KEYS = {
+    "jobs": int,
+    "ssh_timeout": (int, float),
+    "ssh_command_timeout": (int, float),
+    "ssh_idle_timeout": (int, float),
+    "api_cache_ttl": (int, float),
+    "reload_window": (int, float),
+}
+
+# Clés numériques qui peuvent valoir 0 (reload_window : pas d'attente,
+# seules les modifications arrivées pendant un rechargement sont regroupées)
+ZERO_KEYS = ("reload_window",)
+
+# Fenêtre de regroupement des rechargements acceptée par dhcp-agent.py
+MAX_RELOAD_WINDOW = 30
+
+# Clés texte
+STRING_KEYS = ("user", "dhcp_hosts_cfg", "state_dir", "agent_cmd", "api_token")
+
+
+class ConfigError(Exception):
+    """
+    Configuration invalide (la liste des problèmes est dans errors)
+    """
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def validate_config(cfg):
+    """
+    Vérifie et normalise la configuration lue dans le YAML
+    Retourne la configuration normalisée, avec l'index des réseaux
+    Lève ConfigError avec tous les problèmes trouvés
+    """
+    errors = []
+
+    if not isinstance(cfg, dict):
+        raise ConfigError(["the file must contain a mapping of settings"])
+    cfg = dict(cfg)
+
+    for key in STRING_KEYS:
+        if key in cfg and not isinstance(cfg[key], str):
+            errors.append(f"{key}: must be a string")
+    if "user" not in cfg:
+        errors.append("user: missing")
+
+    for key, kind in NUMBER_KEYS.items():
+        if key in cfg:
+            value = cfg[key]
+            if (isinstance(value, bool) or not isinstance(value, kind)
+                    or value < 0 or (value == 0 and key not in ZERO_KEYS)):
+                errors.append(f"{key}: must be a positive number")
+    window = cfg.get("reload_window")
+    if isinstance(window, (int, float)) and not isinstance(window, bool) and window > MAX_RELOAD_WINDOW:
+        errors.append(f"reload_window: must be at most {MAX_RELOAD_WINDOW} seconds")
+
+    # dhcp-servers : {ip du serveur: réseau}
+    servers = cfg.get("dhcp-servers")
+    if servers is None:
+        servers = {}
+    if not isinstance(servers, dict):
+        errors.append("dhcp-servers: must be a mapping of server IP to network")
+        servers = {}
+
+    normalized = {}
+    for server_ip, network_str in servers.items():
+        try:
+            IPv4Address(str(server_ip))
+        except ValueError:
+            errors.append(f"dhcp-servers: bad server address {server_ip}")
+            continue
+        try:
+            IPv4Network(str(network_str))
+        except ValueError as e:
+            errors.append(f"dhcp-servers: {server_ip}: bad network {network_str}: {e}")
+            continue
+        normalized[str(server_ip)] = str(network_str)
+    cfg["dhcp-servers"] = normalized
+
+    # dhcp-ranges : {ip du serveur: [plages dynamiques de dnsmasq]}, écrites
+    # comme dans dnsmasq ("10.20.1.100,10.20.1.200,12h") ; l'attribution
+    # automatique (add-dhcp-client.py --auto) n'y prend jamais d'adresse
+    ranges = cfg.get("dhcp-ranges")
+    if ranges is None:
+        ranges = {}
+    if not isinstance(ranges, dict):
+        errors.append("dhcp-ranges: must be a mapping of server IP to a list of ranges")
+        ranges = {}
+
+    pools = {}
+    for server_ip, server_ranges in ranges.items():
+        server_ip = str(server_ip)
+        if server_ip not in normalized:
+            errors.append(f"dhcp-ranges: {server_ip} is not in dhcp-servers")
+            continue
+        if not isinstance(server_ranges, list):
+            server_ranges = [server_ranges]
+        for text in server_ranges:
+            try:
+                pool = parse_dhcp_range(str(text))
+            except ValueError as e:
+                errors.append(f"dhcp-ranges: {server_ip}: {e}")
+                continue
+            if pool is not None:
+                pools.setdefault(server_ip, []).append(pool)
+    cfg["dhcp-ranges"] = pools
+
+    if not errors:
+        try:
+            cfg["_subnet_index"] = SubnetIndex(normalized)
+        except ValueError as e:
+            errors.append(f"dhcp-servers: {e}")
+
+    if errors:
+        raise ConfigError(errors)
+    return cfg
+
+
+def parse_dhcp_range(text):
+    """
+    Lit une plage dnsmasq ([tag:...,][set:...,]début,fin[,masque][,bail])
+    Retourne (début, fin), ou None pour une plage sans adresses dynamiques
+    (static, proxy) ; lève ValueError si elle est invalide
+    """
+    fields = [field.strip() for field in text.split(",")]
+    if "static" in fields or "proxy" in fields:
+        return None
+
+    addresses = []
+    for field in fields:
+        try:
+            addresses.append(IPv4Address(field))
+        except ValueError:
+            pass
+    if len(addresses) < 2:
+        raise ValueError(f"bad range {text}")
+
+    start, end = addresses[0], addresses[1]
+    if start > end:
+        raise ValueError(f"bad range {text}: start after end")
+    return str(start), str(end)
+
+
+def _compiled_path(filename):
+    """
+    Fichier de la configuration compilée, à côté du YAML
+    """
+    return filename + ".compiled"
+
+
+def _load_compiled(filename):
+    """
+    Lit la configuration compilée enregistrée à côté du YAML
+    Retourne None si elle n'existe pas ou n'est pas utilisable
+    """
+    try:
+        with open(_compiled_path(filename), "rb") as f:
+            # On ne lit qu'un fichier écrit par nous, que personne d'autre ne peut modifier
+            st = os.fstat(f.fileno())
+            if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                return None
+            compiled = pickle.load(f)
+    except Exception:
+        return None
+
+    if not isinstance(compiled, dict) or compiled.get("version") != COMPILED_VERSION:
+        return None
+    return compiled
+
+
+def _save_compiled(filename, st, sha256, cfg):
+    """
+    Enregistre la configuration compilée à côté du YAML
+    (sans erreur si le répertoire n'est pas accessible en écriture)
+    """
+    compiled = {
+        "version": COMPILED_VERSION,
+        "source": {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": sha256},
+        "cfg": cfg,
+    }
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=".superviseur.", dir=os.path.dirname(os.path.abspath(filename)))
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, _compiled_path(filename))
+    except OSError:
+        pass
+
+
+def compile_config(filename):
+    """
+    Lit la configuration, en passant par sa version compilée quand le YAML
+    n'a pas changé : une seule lecture rapide au lieu d'une analyse YAML
+    Lève ConfigError si la configuration est invalide, OSError/yaml.YAMLError
+    si le fichier est illisible
+    """
+    with metrics.span("config.load"):
+        return _compile_config(filename)
+
+
+def _compile_config(filename):
+    st = os.stat(filename)
+
+    # Cas le plus courant : YAML inchangé (même date, même taille) depuis la dernière compilation
+    compiled = _load_compiled(filename)
+    if compiled is not None:
+        source = compiled["source"]
+        if source["mtime_ns"] == st.st_mtime_ns and source["size"] == st.st_size:
+            metrics.count("config.compiled_hits")
+            return compiled["cfg"]
+
+    with open(filename, "rb") as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    if compiled is not None and compiled["source"]["sha256"] == sha256:
+        # Fichier touché mais contenu identique : la version compilée reste bonne
+        cfg = compiled["cfg"]
+    else:
+        metrics.count("config.yaml_parses")
+        with metrics.span("config.parse_yaml"):
+            raw = yaml.load(data, Loader=SafeLoader)
+        # Si le fichier est vide, on part d'un dict vide
+        with metrics.span("config.validate"):
+            cfg = validate_config({} if raw is None else raw)
+        # Signalé à chaque modification du YAML (check-dhcp.py le redit à chaque vérification)
+        for line in nested_network_warnings(cfg):
+            print(line, file=sys.stderr)
+
+    _save_compiled(filename, st, sha256, cfg)
+    return cfg
+
+
+def config_error_lines(filename, error):
+    """
+    Retourne les messages d'erreur (un par ligne) d'une configuration illisible
+    """
+    if isinstance(error, ConfigError):
+        return [f"Error: invalid configuration file {filename}:"] + [f"  - {e}" for e in error.errors]
+    return [f"Error: cannot parse configuration file {filename}: {error}"]
+
 
 def load_config(filename, create):
     """
-    Charge le fichier YAML de configuration
+    Charge le fichier YAML de configuration (via sa version compilée si possible)
     Si le fichier n'existe pas et create=True, crée un fichier minimal
     """
     # Vérifier si le fichier existe
     if os.path.exists(filename):
         # Le fichier existe, on le lit
         try:
-            with open(filename, 'r') as f:
-                cfg = yaml.safe_load(f)
-            
-            # Si le fichier est vide, retourner un dict vide
-            if cfg is None:
-                cfg = {}
-            
-            return cfg
-            
+            return compile_config(filename)
+        
         except Exception as e:
-            print(f"Error: cannot parse configuration file {filename}: {e}", file=sys.stderr)
+            # Problèmes de contenu : on les affiche tous d'un coup
+            for line in config_error_lines(filename, e):
+                print(line, file=sys.stderr)
             sys.exit(1)
     
     else:
@@ -57,41 +309,131 @@ def load_config(filename, create):
             sys.exit(1)
 
 
-def get_dhcp_server(ip_or_network, cfg):
+def get_state_dir(cfg):
     """
-    Recherche le serveur DHCP qui gère une IP ou un réseau donné
-    Retourne (server_ip, network_str) ou None si pas trouvé
+    Retourne le répertoire des fichiers d'état locaux (index, caches...)
+    et le crée s'il n'existe pas encore
     """
-    # Récupérer la liste des serveurs DHCP
-    servers = cfg.get("dhcp-servers", {})
-    
-    # Si aucun serveur configuré
-    if not servers:
+    state_dir = os.path.expanduser(cfg.get("state_dir", "~/.cache/superviseur-dhcp"))
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+
+class SubnetIndex:
+    """
+    Index des réseaux de dhcp-servers pour retrouver le serveur d'une IP
+    Les réseaux sont rangés par longueur de préfixe : une recherche coûte
+    au plus un accès dictionnaire par longueur de préfixe utilisée, et
+    renvoie toujours le réseau le plus spécifique (réseaux imbriqués)
+    """
+
+    def __init__(self, servers):
+        # longueur de préfixe -> {adresse réseau (entier): (server_ip, network_str)}
+        self._by_prefix = {}
+        # texte du réseau tel qu'écrit dans la config -> (server_ip, network_str)
+        self._by_text = {}
+        # Réseaux imbriqués : [((server_ip, network_str) du plus grand, du plus petit)]
+        self.nested = []
+
+        networks = []
+        for server_ip, network_str in servers.items():
+            try:
+                network = IPv4Network(str(network_str))
+            except ValueError as e:
+                raise ValueError(f"server {server_ip}: bad network {network_str}: {e}")
+
+            table = self._by_prefix.setdefault(network.prefixlen, {})
+            key = int(network.network_address)
+            if key in table:
+                # Même réseau pour deux serveurs : impossible de choisir
+                raise ValueError(f"network {network} is used by {table[key][0]} and {server_ip}")
+
+            table[key] = (server_ip, network_str)
+            self._by_text[str(network_str)] = (server_ip, network_str)
+            networks.append((network, (server_ip, network_str)))
+
+        # Du préfixe le plus long (réseau le plus petit) au plus court
+        self._prefixes = sorted(self._by_prefix, reverse=True)
+        self._masks = [(0xFFFFFFFF << (32 - p)) & 0xFFFFFFFF for p in self._prefixes]
+
+        # Réseaux imbriqués : autorisés, mais signalés (nested_network_warnings())
+        networks.sort(key=lambda item: (int(item[0].network_address), item[0].prefixlen))
+        for n, (outer, outer_info) in enumerate(networks):
+            for inner, inner_info in networks[n + 1:]:
+                if int(inner.network_address) > int(outer.broadcast_address):
+                    break
+                self.nested.append((outer_info, inner_info))
+
+    def lookup_int(self, address):
+        """
+        Retourne (server_ip, network_str) pour une IP donnée sous forme d'entier
+        """
+        for prefix, mask in zip(self._prefixes, self._masks):
+            found = self._by_prefix[prefix].get(address & mask)
+            if found is not None:
+                return found
         return None
-    
-    # Parcourir tous les serveurs
-    for server_ip, network_str in servers.items():
+
+    def lookup(self, ip_or_network):
+        """
+        Retourne (server_ip, network_str) pour une IP ou un réseau de la config
+        ou None si aucun serveur ne correspond
+        """
         # Cas 1 : correspondance exacte de réseau
-        # Ex: on cherche "10.20.1.0/24" et c'est exactement ça dans la config
-        if network_str == ip_or_network:
-            return (server_ip, network_str)
-        
-        # Cas 2 : on a une IP et on cherche son réseau
+        found = self._by_text.get(ip_or_network)
+        if found is not None:
+            return found
+
+        # Cas 2 : on a une IP et on cherche son réseau le plus spécifique
+        # (inet_pton : conversion stricte et bien plus rapide que IPv4Address)
         try:
-            # Essayer de parser comme une adresse IP
-            ip = IPv4Address(ip_or_network)
-            
-            # Parser le réseau du serveur
-            network = IPv4Network(network_str)
-            
-            # Vérifier si l'IP appartient à ce réseau
-            if ip in network:
-                return (server_ip, network_str)
-                
-        except:
-            # Ce n'était pas une IP valide ou un réseau valide
-            # On continue avec le serveur suivant
-            continue
-    
-    # Aucun serveur trouvé pour cette IP/réseau
-    return None
+            address = int.from_bytes(socket.inet_pton(socket.AF_INET, ip_or_network), "big")
+        except (OSError, TypeError):
+            return None
+        return self.lookup_int(address)
+
+    def lookup_many(self, ips):
+        """
+        Recherche groupée : retourne un résultat par IP (None si pas trouvé)
+        """
+        return [self.lookup(ip) for ip in ips]
+
+
+def get_subnet_index(cfg):
+    """
+    Retourne l'index des réseaux de la configuration
+    (construit au chargement, ou à la première demande si cfg a été créé autrement)
+    """
+    index = cfg.get("_subnet_index")
+    if index is None:
+        with metrics.span("config.subnet_index"):
+            index = SubnetIndex(cfg.get("dhcp-servers") or {})
+        cfg["_subnet_index"] = index
+    return index
+
+
+def nested_network_warnings(cfg):
+    """
+    Avertissements pour les réseaux de dhcp-servers contenus dans un autre :
+    leurs adresses vont au serveur du plus petit réseau
+    """
+    return [f"Warning: network {inner} ({inner_server}) is inside {outer} ({outer_server}): "
+            f"its addresses are handled by {inner_server}"
+            for (outer_server, outer), (inner_server, inner) in get_subnet_index(cfg).nested]
+
+
+def get_dhcp_server(ip_or_network, cfg):
+    """
+    Recherche le serveur DHCP qui gère une IP ou un réseau donné
+    (le réseau le plus spécifique si plusieurs réseaux contiennent l'IP)
+    Retourne (server_ip, network_str) ou None si pas trouvé
+    """
+    return get_subnet_index(cfg).lookup(ip_or_network)
+
+
+def get_dhcp_servers(ips, cfg):
+    """
+    Comme get_dhcp_server, pour une liste d'IPs en un seul appel
+    Retourne une liste de (server_ip, network_str) ou None
+    """
+    return get_subnet_index(cfg).lookup_many(ips)
@@ -0,0 +1,885 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+dhcp-agent.py :
+Agent installé sur chaque serveur DHCP (avec reservations.py dans le même
+répertoire), appelé par dhcp-filter.sh (commande forcée SSH). Il lit sur stdin un lot d'opérations au format JSON,
+les applique en une seule passe sur le fichier des réservations et
+répond en JSON sur stdout.
+
+Requête :
+    {"version": 1,
+     "ops": [{"op": "check",  "mac": "00:1a:2b:3c:4d:5e", "ip": "10.20.1.60"},
+             {"op": "upsert", "mac": "00:1a:2b:3c:4d:5e", "ip": "10.20.1.60"},
+             {"op": "delete", "mac": "00:1a:2b:3c:4d:5e", "ip": "10.20.1.60"},
+             {"op": "list", "if_none_match": "<sha256 déjà connu>", "format": "lines"},
+             {"op": "stat"},
+             {"op": "leases", "offset": 4096, "prefix_sha256": "<sha256 des 4096 premiers octets>"},
+             {"op": "replace", "content": "<tout le fichier>", "base_sha256": "<sha256 de départ>"}],
+     "reload": true, "reload_window": 1.0}
+
+Réponse :
+    {"ok": true, "changed": true, "reloaded": true,
+     "reload": "restart", "reload_wait": 1.4, "coalesced": 3,
+     "before": "<sha256 avant>", "fingerprint": {"size": ..., "mtime": ..., "sha256": ...},
+     "timings": {"lock": ..., "read": ..., "apply": ..., "write": ..., "reload": ...},
+     "results": [...]}
+
+Les redémarrages sont regroupés : une modification attend reload_window
+secondes (au plus MAX_RELOAD_WINDOW) que d'autres arrivent, puis un seul
+rechargement de dnsmasq les rend toutes actives, quel que soit leur
+nombre ; chaque agent ne répond qu'une fois le sien fait. Le
+rechargement se fait hors du verrou des réservations (voir wait_reload()).
+"reload" indique comment la modification est devenue active (restart,
+sighup ou inotify), "reload_wait" au bout de combien de secondes et
+"coalesced" combien de lots ce rechargement a couverts
+
+Avec "format": "lines", la liste n'est pas dans la réponse : la réponse tient
+sur la première ligne et le fichier des réservations suit tel quel (contenu
+à la fin de la requête), pour être lu au fil de l'eau par le superviseur
+
+Avec --hosts-dir, les réservations sont rangées dans les fichiers d'un
+répertoire dhcp-hostsdir (un par dernier octet de MAC) au lieu du fichier
+unique : seuls les fichiers modifiés sont réécrits et dnsmasq n'est jamais
+redémarré. Il lit lui-même (inotify) les fichiers ajoutés ou modifiés ; une
+mise à jour ou une suppression demande en plus un SIGHUP (--hup-cmd), car
+dnsmasq ne retire pas seul une ligne déjà lue. La liste et les empreintes
+portent sur les lignes de tous les fichiers, dans l'ordre de leurs noms,
+écrites comme dans le fichier unique (dhcp-host=...)
+--migrate répartit une fois pour toutes le fichier unique dans le répertoire
+(voir migrate())
+
+Chaque nouvelle version du fichier unique est vérifiée par dnsmasq
+(--test-cmd) avant d'être mise en place, et la précédente est gardée dans
+hosts.conf~. L'opération replace (seule dans sa requête) remplace tout le
+fichier par le contenu rendu par le superviseur, si le fichier a toujours
+l'empreinte base_sha256 ; sinon, résultat "conflict" avec l'empreinte
+actuelle et rien n'est écrit
+
+L'opération leases renvoie le fichier des baux de dnsmasq : seulement la
+partie après offset si le début n'a pas changé (prefix_sha256), sinon tout
+le fichier. Résultat : {"start": décalage du texte, "size": taille totale,
+"data": texte (latin-1, pour garder les octets tels quels)}
+"""
+
+import os
+import re
+import sys
+import json
+import fcntl
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from time import monotonic, sleep
+from ipaddress import IPv4Address
+
+# reservations.py est installé dans le même répertoire que l'agent
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from reservations import ReservationTable, ShardedTable, SHARD_OTHER
+from reservations import shard_name, iter_config, iter_reservations, hostsfile_lines, hostsfile_render
+
+
+# Valeurs par défaut (modifiables en ligne de commande)
+HOSTS_FILE = "/etc/dnsmasq.d/hosts.conf"
+LOCK_FILE = "/run/lock/dhcp-agent.lock"
+RELOAD_CMD = "systemctl restart dnsmasq"
+HOSTS_DIR = "/etc/dnsmasq.hosts.d"
+# SIGHUP : dnsmasq relit le répertoire sans redémarrer
+HUP_CMD = "systemctl reload dnsmasq"
+# Vérification d'un nouveau fichier avant de le mettre en place ({} : son chemin)
+TEST_CMD = "dnsmasq --test --conf-file={}"
+LEASES_FILE = "/var/lib/misc/dnsmasq.leases"
+
+# Limites pour refuser les requêtes anormales
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+MAX_OPS = 1000000
+MAX_RELOAD_WINDOW = 30
+
+# Format attendu pour une MAC (déjà normalisée en minuscules par le client)
+MAC_RE = re.compile(r"^[0-9a-f]{2}(:[0-9a-f]{2}){5}$")
+
+# Formats de la liste : dans la réponse JSON ou à la suite de la réponse
+LIST_FORMATS = ("entries", "lines")
+
+# Empreinte SHA-256 en hexadécimal
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Champs de chaque opération : (obligatoires, facultatifs)
+OP_FIELDS = {
+    "check": ({"mac"}, {"ip"}),
+    "upsert": ({"mac", "ip"}, set()),
+    "delete": ({"mac"}, {"ip"}),
+    "list": (set(), {"if_none_match", "format"}),
+    "stat": (set(), set()),
+    "leases": (set(), {"offset", "prefix_sha256"}),
+    "replace": ({"content"}, {"base_sha256"}),
+}
+
+
+class RequestError(Exception):
+    """
+    Requête refusée (ne respecte pas le schéma)
+    """
+
+
+def check_mac(value):
+    """
+    Vérifie qu'une MAC respecte le format xx:xx:xx:xx:xx:xx
+    """
+    if not isinstance(value, str) or not MAC_RE.match(value):
+        raise RequestError(f"bad MAC address: {value!r}")
+    return value
+
+
+def check_ip(value):
+    """
+    Vérifie qu'une IP est une IPv4 valide (forme canonique)
+    """
+    try:
+        if str(IPv4Address(value)) == value:
+            return value
+    except ValueError:
+        pass
+    raise RequestError(f"bad IP address: {value!r}")
+
+
+def check_request(request):
+    """
+    Valide le schéma complet de la requête avant de toucher au fichier
+    Retourne (liste des opérations, reload demandé, fenêtre de regroupement)
+    """
+    if not isinstance(request, dict):
+        raise RequestError("request must be an object")
+
+    unknown = set(request) - {"version", "ops", "reload", "reload_window"}
+    if unknown:
+        raise RequestError(f"unknown fields: {', '.join(sorted(unknown))}")
+
+    if request.get("version") != 1:
+        raise RequestError("unsupported version")
+
+    ops = request.get("ops")
+    if not isinstance(ops, list) or len(ops) > MAX_OPS:
+        raise RequestError("ops must be a list")
+
+    reload = request.get("reload", False)
+    if not isinstance(reload, bool):
+        raise RequestError("reload must be a boolean")
+
+    window = request.get("reload_window", 0)
+    if (isinstance(window, bool) or not isinstance(window, (int, float))
+            or not 0 <= window <= MAX_RELOAD_WINDOW):
+        raise RequestError(f"reload_window must be between 0 and {MAX_RELOAD_WINDOW}")
+
+    for op in ops:
+        if not isinstance(op, dict) or op.get("op") not in OP_FIELDS:
+            raise RequestError(f"bad operation: {op!r}")
+
+        # Tous les champs obligatoires, aucun champ inconnu
+        required, optional = OP_FIELDS[op["op"]]
+        fields = set(op) - {"op"}
+        if not required <= fields or fields - required - optional:
+            raise RequestError(f"bad fields for {op['op']}: {', '.join(sorted(fields))}")
+
+        if "mac" in op:
+            check_mac(op["mac"])
+        if "ip" in op:
+            check_ip(op["ip"])
+        if "if_none_match" in op:
+            if not isinstance(op["if_none_match"], str) or not SHA256_RE.match(op["if_none_match"]):
+                raise RequestError("bad fingerprint")
+        if "offset" in op or "prefix_sha256" in op:
+            offset = op.get("offset")
+            if isinstance(offset, bool) or not isinstance(offset, int) or offset < 0:
+                raise RequestError("bad leases offset")
+            if not isinstance(op.get("prefix_sha256"), str) or not SHA256_RE.match(op["prefix_sha256"]):
+                raise RequestError("bad leases prefix fingerprint")
+        if "content" in op and not isinstance(op["content"], str):
+            raise RequestError("content must be a string")
+        if "base_sha256" in op:
+            if not isinstance(op["base_sha256"], str) or not SHA256_RE.match(op["base_sha256"]):
+                raise RequestError("bad base fingerprint")
+        if op.get("format", "entries") not in LIST_FORMATS:
+            raise RequestError(f"bad list format: {op['format']!r}")
+
+    if len(ops) > 1 and any(op["op"] == "replace" for op in ops):
+        raise RequestError("replace must be the only operation")
+
+    # Un seul fichier peut suivre la réponse
+    if sum(1 for op in ops if op.get("format") == "lines") > 1:
+        raise RequestError("only one list can use the lines format")
+
+    return ops, reload, window
+
+
+def fingerprint(data, mtime):
+    """
+    Empreinte du fichier : taille, date de modification et SHA-256
+    """
+    return {"size": len(data), "mtime": mtime, "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def _hashed_lines(f, digest):
+    """
+    Donne les lignes d'un fichier binaire en texte, en calculant son SHA-256 au passage
+    """
+    for line in f:
+        digest.update(line)
+        yield line.decode()
+
+
+def read_hosts(path, table=True):
+    """
+    Lit le fichier des réservations ligne par ligne (vide s'il n'existe pas encore)
+    Retourne (ReservationTable, empreinte) ; avec table=False, seule l'empreinte
+    est calculée (table None) et la mémoire utilisée ne dépend pas de la taille du fichier
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            lines = _hashed_lines(f, digest)
+            if table:
+                table = ReservationTable.from_lines(lines)
+            else:
+                table = None
+                for _ in lines:
+                    pass
+    except FileNotFoundError:
+        st = None
+        table = ReservationTable() if table else None
+
+    current = {"size": st.st_size if st else 0, "mtime": st.st_mtime if st else 0,
+               "sha256": digest.hexdigest()}
+    return table, current
+
+
+def hosts_dir_files(path):
+    """
+    Noms des fichiers du répertoire lus par dnsmasq, triés
+    (dnsmasq ignore les fichiers cachés, *~ et #...#, comme nos fichiers temporaires)
+    """
+    try:
+        names = os.listdir(path)
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names
+                  if not name.startswith(".") and not name.endswith("~")
+                  and not (name.startswith("#") and name.endswith("#"))
+                  and os.path.isfile(os.path.join(path, name)))
+
+
+def read_hosts_dir(path, table=True):
+    """
+    Comme read_hosts(), pour un répertoire dhcp-hostsdir
+    Retourne (ShardedTable, empreinte) ; l'empreinte est celle des lignes de
+    tous les fichiers mises bout à bout (dhcp-host=...), avec la date du
+    fichier le plus récent
+    """
+    digest = hashlib.sha256()
+    size = 0
+    mtime = 0
+    files = {}
+    for name in hosts_dir_files(path):
+        with open(os.path.join(path, name), "rb") as f:
+            mtime = max(mtime, os.fstat(f.fileno()).st_mtime)
+            lines = list(hostsfile_lines(line.decode() for line in f))
+        for line in lines:
+            data = line.encode()
+            digest.update(data)
+            size += len(data)
+        if table:
+            files[name] = lines
+
+    current = {"size": size, "mtime": mtime, "sha256": digest.hexdigest()}
+    if table:
+        table = ShardedTable({name: ReservationTable.from_lines(lines) for name, lines in files.items()})
+    else:
+        table = None
+    return table, current
+
+
+def open_hosts_dir(path):
+    """
+    Ouvre tous les fichiers du répertoire (sous le verrou : chacun garde son
+    contenu même s'il est remplacé pendant l'envoi)
+    """
+    return [open(os.path.join(path, name), "rb") for name in hosts_dir_files(path)]
+
+
+def _shard_ips(lines):
+    """
+    IPs réservées par des lignes d'un fichier de dhcp-hostsdir
+    """
+    return {ip for _, ip in iter_reservations(hostsfile_lines(lines))}
+
+
+def _put_shard(path, content):
+    if content:
+        write_hosts(path, content)
+    else:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def write_shards(path, contents):
+    """
+    Écrit les nouveaux contenus {nom: texte ("" : fichier supprimé)} des
+    fichiers du répertoire. Chaque fichier est remplacé de façon atomique,
+    mais pas le répertoire : une IP qui passe d'un fichier à un autre doit
+    être libérée avant d'être reprise, sinon un arrêt entre les deux
+    écritures la laisserait réservée deux fois. D'abord chaque fichier
+    sans les lignes qui réservent une IP qu'il n'avait pas, puis ces lignes :
+    un arrêt au milieu ne fait que retarder les nouvelles réservations
+    """
+    os.makedirs(path, mode=0o755, exist_ok=True)
+    later = {}
+    for name, content in contents.items():
+        file_path = os.path.join(path, name)
+        try:
+            with open(file_path) as f:
+                old = f.read()
+        except FileNotFoundError:
+            old = ""
+        if content == old:
+            continue
+
+        old_ips = _shard_ips(old.splitlines(True))
+        released = "".join(line for line in content.splitlines(True) if _shard_ips([line]) <= old_ips)
+        if released != old:
+            _put_shard(file_path, released)
+        if released != content:
+            later[file_path] = content
+
+    for file_path, content in later.items():
+        _put_shard(file_path, content)
+
+
+def write_hosts_dir(path, table):
+    """
+    Réécrit (ou supprime s'ils sont vides) les seuls fichiers modifiés
+    (dans l'ordre de write_shards())
+    Retourne l'empreinte du répertoire
+    """
+    write_shards(path, {name: table.render_shard(name) for name in table.changed_shards()})
+
+    mtime = max((os.stat(os.path.join(path, name)).st_mtime for name in hosts_dir_files(path)), default=0)
+    return fingerprint(table.render().encode(), mtime)
+
+
+def check_migrated(hosts_file):
+    """
+    En mode répertoire, le fichier unique ne doit plus contenir de réservation
+    (sinon dnsmasq verrait les deux)
+    """
+    try:
+        with open(hosts_file) as f:
+            for _, record in iter_config(f):
+                if record is not None:
+                    raise RequestError(f"{hosts_file} still has reservations: run dhcp-agent --migrate first")
+    except FileNotFoundError:
+        pass
+
+
+def split_shards(lines, kept=None):
+    """
+    Répartit des lignes de configuration entre les fichiers du répertoire :
+    chaque dhcp-host va dans le fichier de sa première MAC (sans "dhcp-host=")
+    Les autres lignes vont dans kept si fourni ; sinon un commentaire ou une
+    ligne vide suit la réservation qui vient après lui, et toute autre option
+    est refusée (un répertoire dhcp-hostsdir ne contient que des dhcp-host)
+    Retourne {nom du fichier: [lignes]}
+    """
+    shards = {}
+    pending = []
+    name = SHARD_OTHER
+    for line, record in iter_config(lines):
+        if record is None:
+            text = line.strip()
+            if kept is not None:
+                kept.append(line + "\n")
+            elif not text or text.startswith("#"):
+                pending.append(line + "\n")
+            else:
+                raise RequestError(f"not a dhcp-host line: {text[:80]}")
+            continue
+
+        owners = record.owners()
+        name = shard_name(owners[0]) if owners else SHARD_OTHER
+        text = line.strip() if line.strip().startswith("dhcp-host=") else record.render()
+        shards.setdefault(name, []).extend(pending)
+        shards[name].extend(hostsfile_render([text + "\n"]))
+        pending = []
+
+    if pending and shards:
+        shards[name].extend(pending)
+    return shards
+
+
+def migrate(hosts_file, hosts_dir, reload_cmd):
+    """
+    Passe du fichier unique au répertoire : chaque dhcp-host part dans le
+    fichier de sa première MAC, les autres lignes (commentaires, autres
+    options) restent dans le fichier unique, qui se termine par
+    dhcp-hostsdir=<répertoire>. dnsmasq est redémarré une dernière fois
+    pour lire la nouvelle configuration
+    Les fichiers du répertoire portant les mêmes noms sont remplacés ; tout
+    autre fichier du répertoire fait refuser la migration
+    """
+    kept = []
+    with open(hosts_file) as f:
+        shards = split_shards(f, kept)
+    if any(line.strip().partition("=")[0].strip() == "dhcp-hostsdir" for line in kept):
+        raise RequestError(f"{hosts_file} already uses dhcp-hostsdir")
+
+    others = set(hosts_dir_files(hosts_dir)) - set(shards)
+    if others:
+        raise RequestError(f"{hosts_dir} is not empty: {', '.join(sorted(others))}")
+
+    os.makedirs(hosts_dir, mode=0o755, exist_ok=True)
+    for name, lines in shards.items():
+        write_hosts(os.path.join(hosts_dir, name), "".join(lines))
+    write_hosts(hosts_file, "".join(kept) + f"dhcp-hostsdir={hosts_dir}\n", backup=True)
+
+    response = {"ok": True, "migrated": sum(len(lines) for lines in shards.values()),
+                "files": len(shards), "reloaded": False}
+    run_reload(reload_cmd, response)
+    return response
+
+
+def test_config(test_cmd, path):
+    """
+    Fait vérifier un fichier par dnsmasq (--test) avant de le mettre en place
+    ({} dans la commande est remplacé par le chemin)
+    Lève RequestError s'il est refusé ; sans dnsmasq installé, rien n'est vérifié
+    """
+    if not test_cmd:
+        return
+    try:
+        done = subprocess.run([part.replace("{}", path) for part in test_cmd.split()],
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    except FileNotFoundError:
+        return
+    if done.returncode != 0:
+        raise RequestError(f"dnsmasq refused the new file: {done.stdout.strip()[-500:]}")
+
+
+def replace_hosts_dir(path, content, test_cmd=None):
+    """
+    Remplace tout le contenu du répertoire (opération replace) : seuls les
+    fichiers dont le contenu change sont réécrits, ceux qui ne servent plus
+    sont supprimés, les adresses libérées avant d'être reprises (write_shards())
+    Retourne l'empreinte du répertoire
+    """
+    shards = split_shards(content.splitlines())
+
+    if test_cmd:
+        # dnsmasq vérifie l'ensemble, écrit comme un fichier de configuration
+        os.makedirs(path, mode=0o755, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".test.", dir=path)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.writelines(hostsfile_lines(line for lines in shards.values() for line in lines))
+            test_config(test_cmd, tmp_path)
+        finally:
+            os.unlink(tmp_path)
+
+    os.makedirs(path, mode=0o755, exist_ok=True)
+    contents = {name: "".join(lines) for name, lines in shards.items()}
+    for name in set(hosts_dir_files(path)) - set(shards):
+        contents[name] = ""
+    write_shards(path, contents)
+
+    return read_hosts_dir(path, table=False)[1]
+
+
+def replace_hosts(op, current, hosts_file, hosts_dir=None, test_cmd=None):
+    """
+    Opération replace : le superviseur envoie tout le nouveau fichier
+    Il n'est écrit que si le fichier est toujours celui sur lequel le
+    superviseur s'est basé (base_sha256), après vérification par dnsmasq,
+    en gardant la version précédente (hosts.conf~)
+    Retourne (résultat, nouvelle empreinte ou None si rien n'est écrit)
+    """
+    if "base_sha256" in op and op["base_sha256"] != current["sha256"]:
+        return {"op": "replace", "status": "conflict", "current": current["sha256"]}, None
+    if hashlib.sha256(op["content"].encode()).hexdigest() == current["sha256"]:
+        return {"op": "replace", "status": "unchanged"}, None
+
+    if hosts_dir:
+        new = replace_hosts_dir(hosts_dir, op["content"], test_cmd)
+    else:
+        new = write_hosts(hosts_file, op["content"], test_cmd, backup=True)
+    return {"op": "replace", "status": "replaced"}, new
+
+
+def read_leases(path, offset=0, prefix_sha256=None):
+    """
+    Lit le fichier des baux (vide s'il n'existe pas)
+    Si ses offset premiers octets ont l'empreinte prefix_sha256, seule la
+    suite est renvoyée ; sinon (fichier réécrit ou raccourci), tout le fichier
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b""
+
+    start = 0
+    if (prefix_sha256 is not None and offset <= len(data)
+            and hashlib.sha256(data[:offset]).hexdigest() == prefix_sha256):
+        start = offset
+    return {"start": start, "size": len(data), "data": data[start:].decode("latin-1")}
+
+
+def write_hosts(path, content, test_cmd=None, backup=False):
+    """
+    Écrit le fichier de façon atomique : fichier temporaire puis rename
+    (dnsmasq ne voit jamais un fichier à moitié écrit)
+    Avec test_cmd, dnsmasq vérifie le fichier temporaire avant le rename ;
+    avec backup, la version précédente est gardée dans <fichier>~ (nom que
+    dnsmasq ignore toujours)
+    Retourne l'empreinte du nouveau fichier
+    """
+    data = content.encode()
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=".hosts.", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            mtime = os.fstat(f.fileno()).st_mtime
+
+        # Garder les droits du fichier d'origine
+        try:
+            st = os.stat(path)
+            os.chmod(tmp_path, st.st_mode & 0o7777)
+            os.chown(tmp_path, st.st_uid, st.st_gid)
+        except FileNotFoundError:
+            st = None
+            os.chmod(tmp_path, 0o644)
+
+        test_config(test_cmd, tmp_path)
+
+        if backup and st is not None:
+            # Lien vers l'ancienne version : rien n'est recopié
+            backup_tmp = tmp_path + "~"
+            os.link(path, backup_tmp)
+            os.replace(backup_tmp, path + "~")
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    # Le rename n'est durable qu'une fois le répertoire écrit sur le disque
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+    return fingerprint(data, mtime)
+
+
+def needs_table(ops):
+    """
+    Indique si les opérations ont besoin de la table en mémoire
+    (sinon, le fichier est seulement haché puis renvoyé tel quel)
+    """
+    return any(op["op"] not in ("stat", "leases", "replace") and op.get("format") != "lines" for op in ops)
+
+
+def apply_ops(table, ops, current, leases_file=LEASES_FILE):
+    """
+    Applique les opérations dans l'ordre et retourne un résultat par opération
+    current : empreinte du fichier lu
+    table : None si needs_table(ops) est faux
+    """
+    changed = table is not None and table.changed
+    results = []
+    for op in ops:
+        kind = op["op"]
+
+        if kind == "check":
+            result = {"mac_ip": table.ip_of(op["mac"])}
+            if "ip" in op:
+                result["ip_owner"] = table.other_owner(op["ip"], op["mac"])
+        elif kind == "upsert":
+            result = table.upsert(op["mac"], op["ip"])
+        elif kind == "delete":
+            result = table.delete(op["mac"], op.get("ip"))
+        elif kind == "stat":
+            result = {"fingerprint": current}
+        elif kind == "leases":
+            result = read_leases(leases_file, op.get("offset", 0), op.get("prefix_sha256"))
+        elif not changed and op.get("if_none_match") == current["sha256"]:
+            # Le client a déjà cette version : inutile de tout renvoyer
+            result = {"not_modified": True}
+        elif op.get("format") == "lines":
+            # Le fichier suivra la réponse
+            result = {"lines": True}
+        else:
+            result = {"entries": table.entries()}
+
+        result["op"] = kind
+        results.append(result)
+
+    return results
+
+
+def run_reload(command, response):
+    """
+    Lance la commande de rechargement de dnsmasq et note le résultat dans la réponse
+    """
+    done = subprocess.run(command.split(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    if done.returncode == 0:
+        response["reloaded"] = True
+    else:
+        response["reload_error"] = done.stderr.strip() or f"exit code {done.returncode}"
+
+
+class ReloadState:
+    """
+    Fichier d'état des rechargements, partagé par les agents du serveur :
+    numéro de la dernière modification écrite ("requested"), de la dernière
+    rendue active ("done") ou dont le rechargement a échoué ("failed"), et
+    type de rechargement en attente ("restart" l'emporte sur "sighup")
+    Chaque accès se fait sous un verrou court sur le fichier lui-même
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def update(self, change):
+        """
+        Lit l'état, le modifie avec change(state) et l'enregistre
+        Retourne ce que renvoie change
+        """
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state = json.loads(f.read())
+            except ValueError:
+                state = {}
+            for key in ("requested", "done", "failed"):
+                state.setdefault(key, 0)
+            result = change(state)
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            return result
+
+    def request(self, kind):
+        """
+        Note une modification écrite qui attend un rechargement ; retourne son numéro
+        """
+        def change(state):
+            state["requested"] += 1
+            if state.get("kind") != "restart":
+                state["kind"] = kind
+            return state["requested"]
+        return self.update(change)
+
+
+def wait_reload(state_path, leader_path, kind, window, commands):
+    """
+    Attend que la modification soit active dans dnsmasq
+    Le premier agent qui prend le verrou de meneur attend window secondes
+    (les agents suivants écrivent pendant ce temps leurs modifications),
+    puis lance un seul rechargement pour toutes celles notées jusque-là ;
+    les autres agents trouvent ensuite leur numéro déjà traité et répondent
+    aussitôt. Un seul rechargement par fenêtre, quel que soit le nombre de
+    modifications
+    commands : {"restart": commande, "sighup": commande}
+    Retourne les champs à ajouter à la réponse
+    """
+    state = ReloadState(state_path)
+    number = state.request(kind)
+    start = monotonic()
+
+    with open(leader_path, "w") as leader:
+        fcntl.flock(leader, fcntl.LOCK_EX)
+
+        current = state.update(dict)
+        if current["done"] >= number or current["failed"] >= number:
+            # Rechargé (ou échoué) par un autre agent pendant que nous attendions
+            return _reload_outcome(current, number, start)
+
+        sleep(window)
+
+        def take(state):
+            # Tout ce qui est écrit à cet instant sera lu par ce rechargement
+            taken = (state["requested"], state.pop("kind", kind))
+            state["batch"] = state["requested"] - max(state["done"], state["failed"])
+            return taken
+        last, pending = state.update(take)
+
+        response = {"reloaded": False}
+        run_reload(commands[pending], response)
+
+        def finish(state):
+            if response["reloaded"]:
+                state["done"] = max(state["done"], last)
+            else:
+                state["failed"] = max(state["failed"], last)
+                state["error"] = response["reload_error"]
+            state["mode"] = pending
+            return dict(state)
+        return _reload_outcome(state.update(finish), number, start)
+
+
+def _reload_outcome(state, number, start):
+    """
+    Champs de la réponse pour la modification number, d'après l'état
+    """
+    outcome = {"reload": state.get("mode"), "reload_wait": monotonic() - start,
+               "coalesced": state.get("batch", 1)}
+    if state["done"] >= number:
+        outcome["reloaded"] = True
+    else:
+        outcome["reloaded"] = False
+        outcome["reload_error"] = state.get("error", "reload failed")
+    return outcome
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DHCP reservations agent")
+    parser.add_argument("--hosts-file", default=HOSTS_FILE)
+    parser.add_argument("--hosts-dir", help=f"use a dhcp-hostsdir directory (e.g. {HOSTS_DIR})")
+    parser.add_argument("--lock-file", default=LOCK_FILE)
+    parser.add_argument("--reload-cmd", default=RELOAD_CMD)
+    parser.add_argument("--hup-cmd", default=HUP_CMD)
+    parser.add_argument("--test-cmd", default=TEST_CMD, help="empty to skip the dnsmasq check")
+    parser.add_argument("--leases-file", default=LEASES_FILE)
+    parser.add_argument("--migrate", action="store_true",
+                        help="move the reservations of --hosts-file to --hosts-dir")
+    args = parser.parse_args()
+
+    # === MIGRATION VERS LE RÉPERTOIRE ===
+    if args.migrate:
+        with open(args.lock_file, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                response = migrate(args.hosts_file, args.hosts_dir or HOSTS_DIR, args.reload_cmd)
+            except (RequestError, OSError) as e:
+                response = {"ok": False, "error": str(e)}
+        json.dump(response, sys.stdout)
+        sys.stdout.write("\n")
+        sys.exit(0 if response["ok"] else 1)
+
+    # === LECTURE ET VALIDATION DE LA REQUÊTE ===
+    try:
+        raw = sys.stdin.read(MAX_REQUEST_SIZE + 1)
+        if len(raw) > MAX_REQUEST_SIZE:
+            raise RequestError("request too large")
+        try:
+            request = json.loads(raw)
+        except ValueError:
+            raise RequestError("request is not valid JSON")
+        ops, reload, window = check_request(request)
+        if args.hosts_dir:
+            check_migrated(args.hosts_file)
+    except RequestError as e:
+        json.dump({"ok": False, "error": str(e)}, sys.stdout)
+        sys.exit(1)
+
+    # === APPLICATION SOUS VERROU ===
+    # Durée de chaque phase (en secondes), renvoyée au superviseur
+    timings = {}
+    start = monotonic()
+
+    # Le verrou sérialise les agents lancés en même temps sur ce serveur
+    with open(args.lock_file, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        timings["lock"], start = monotonic() - start, monotonic()
+
+        if args.hosts_dir:
+            table, current = read_hosts_dir(args.hosts_dir, table=needs_table(ops))
+        else:
+            table, current = read_hosts(args.hosts_file, table=needs_table(ops))
+        timings["read"], start = monotonic() - start, monotonic()
+        try:
+            replaced = None
+            if ops and ops[0]["op"] == "replace":
+                result, replaced = replace_hosts(ops[0], current, args.hosts_file, args.hosts_dir, args.test_cmd)
+                results = [result]
+            else:
+                results = apply_ops(table, ops, current, args.leases_file)
+            changed = replaced is not None or (table is not None and table.changed)
+            timings["apply"], start = monotonic() - start, monotonic()
+
+            # Une seule écriture et un seul rechargement pour tout le lot
+            response = {"ok": True, "changed": changed, "reloaded": False,
+                        "before": current["sha256"], "fingerprint": current, "timings": timings}
+            if replaced is not None:
+                response["fingerprint"] = replaced
+            elif changed and args.hosts_dir:
+                response["fingerprint"] = write_hosts_dir(args.hosts_dir, table)
+                response["reshaped"] = table.reshaped
+            elif changed:
+                response["fingerprint"] = write_hosts(args.hosts_file, table.render(), args.test_cmd, backup=True)
+                response["reshaped"] = table.reshaped
+        except RequestError as e:
+            # Refusé par dnsmasq (ou contenu impossible à répartir) : rien n'a changé
+            json.dump({"ok": False, "error": str(e)}, sys.stdout)
+            sys.exit(1)
+
+        kind = None
+        if changed:
+            timings["write"], start = monotonic() - start, monotonic()
+            if reload and not args.hosts_dir:
+                # hosts.conf fait partie de la configuration : SIGHUP ne la relit pas
+                kind = "restart"
+            elif reload:
+                # Les ajouts sont lus par dnsmasq (inotify) ; les lignes
+                # modifiées ou retirées ne sont oubliées qu'après un SIGHUP
+                if replaced is not None or any(result.get("status") in ("updated", "deleted")
+                                               for result in results):
+                    kind = "sighup"
+                else:
+                    response["reloaded"] = True
+                    response["reload"] = "inotify"
+
+        # Les fichiers sont remplacés par rename : ouverts sous le verrou, ils
+        # gardent ce contenu même si un autre agent les réécrit pendant l'envoi
+        bodies = []
+        if any(result.get("lines") for result in results):
+            if args.hosts_dir:
+                bodies = open_hosts_dir(args.hosts_dir)
+            else:
+                try:
+                    bodies = [open(args.hosts_file, "rb")]
+                except FileNotFoundError:
+                    pass
+
+    # Hors du verrou : les autres agents écrivent pendant la fenêtre de regroupement
+    if kind is not None:
+        response.update(wait_reload(args.lock_file + ".reload", args.lock_file + ".leader", kind, window,
+                                    {"restart": args.reload_cmd, "sighup": args.hup_cmd}))
+        timings["reload"] = monotonic() - start
+
+    response["results"] = results
+    sys.stdout.write(json.dumps(response) + "\n")
+    sys.stdout.flush()
+    for body in bodies:
+        with body:
+            if args.hosts_dir:
+                # Mêmes lignes que dans le fichier unique (dhcp-host=...)
+                for line in hostsfile_lines(line.decode() for line in body):
+                    sys.stdout.buffer.write(line.encode())
+            else:
+                shutil.copyfileobj(body, sys.stdout.buffer)
+    sys.stdout.buffer.flush()
+
+if __name__ == "__main__":
+    main()
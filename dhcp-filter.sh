@@ -1,6 +1,17 @@
 #!/bin/bash
 
 #Cela permet d'ajouter un filtre ssh pour interdire toute commande non autoriser
+#Toutes les modifications passent par dhcp-agent, qui vérifie lui-même
+#le contenu de la requête (schéma JSON) reçue sur l'entrée standard
+
+# Emplacement de l'agent sur le serveur
+AGENT="/usr/local/sbin/dhcp-agent"
+
+# Répertoire dhcp-hostsdir des réservations (un fichier par dernier octet de MAC)
+# Vide : fichier unique /etc/dnsmasq.d/hosts.conf, dnsmasq redémarré à chaque modification
+# Renseigné : seuls les fichiers modifiés sont réécrits, dnsmasq n'est jamais redémarré
+# (lancer une fois "dhcp-agent --migrate" pour y déplacer les réservations existantes)
+HOSTS_DIR=""
 
 
 # Vérifier que SSH_ORIGINAL_COMMAND est défini
@@ -11,50 +22,28 @@ fi
 
 # Analyser la commande demandée
 case "$SSH_ORIGINAL_COMMAND" in
-    # Lire le fichier de configuration DHCP
-    "cat /etc/dnsmasq.d/hosts.conf")
-        exec $SSH_ORIGINAL_COMMAND
-        ;;
-    
-    # Redémarrer le service DHCP
-    "sudo systemctl restart dnsmasq")
-        exec $SSH_ORIGINAL_COMMAND
+    # Agent DHCP : lot d'opérations (check, upsert, delete, list) sur stdin
+    "dhcp-agent")
+        if [ -n "$HOSTS_DIR" ]; then
+            exec sudo "$AGENT" --hosts-dir "$HOSTS_DIR"
+        fi
+        exec sudo "$AGENT"
         ;;
-    
-    # Recharger le service DHCP
-    "sudo systemctl reload dnsmasq")
-        exec $SSH_ORIGINAL_COMMAND
+
+    # Migration du fichier unique vers HOSTS_DIR (une seule fois, redémarre dnsmasq)
+    "dhcp-agent --migrate")
+        if [ -z "$HOSTS_DIR" ]; then
+            echo "ERREUR: HOSTS_DIR n'est pas défini dans dhcp-filter.sh" >&2
+            exit 1
+        fi
+        exec sudo "$AGENT" --hosts-dir "$HOSTS_DIR" --migrate
         ;;
-    
+
     # Vérifier le statut du service
     "systemctl status dnsmasq")
         exec $SSH_ORIGINAL_COMMAND
         ;;
-    
-    # Chercher dans le fichier de config (grep avec paramètres)
-    grep\ *\ /etc/dnsmasq.d/hosts.conf)
-        exec $SSH_ORIGINAL_COMMAND
-        ;;
-    
-    # Ajouter une ligne au fichier (echo avec redirection)
-    echo\ *\ \>\>\ /etc/dnsmasq.d/hosts.conf)
-        exec $SSH_ORIGINAL_COMMAND
-        ;;
-    
-    # Supprimer/modifier une ligne du fichier (sed)
-    sed\ -i*\ /etc/dnsmasq.d/hosts.conf)
-        exec $SSH_ORIGINAL_COMMAND
-        ;;
-    
-    # Commandes de base autorisées
-    "ls /etc/dnsmasq.d/")
-        exec $SSH_ORIGINAL_COMMAND
-        ;;
-    
-    "test -f /etc/dnsmasq.d/hosts.conf")
-        exec $SSH_ORIGINAL_COMMAND
-        ;;
-    
+
     # Toute autre commande = REFUSÉE
     *)
         echo "ERREUR: Commande non autorisée: $SSH_ORIGINAL_COMMAND" >&2
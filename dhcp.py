@@ -2,286 +2,917 @@
 # -*- coding: utf-8 -*-
 
 """
-dhcp.py simplifié : 
+dhcp.py simplifié :
 Gestion des serveurs DHCP via SSH avec une approche plus directe
 """
 
+import os
 import sys
+import json
+import time
+import queue
+import random
+import hashlib
+import atexit
+import threading
 from fabric import Connection
-from paramiko import RSAKey
-from paramiko.ssh_exception import SSHException, NoValidConnectionsError
+from paramiko import Agent, RSAKey, ECDSAKey, Ed25519Key
+from paramiko.ssh_exception import SSHException, NoValidConnectionsError, PasswordRequiredException
 
+from location import get_location_index
+from cache import get_cache
+from journal import get_journal
+from reservations import ReservationTable, CompactTable, iter_reservations
+from leases import LeaseTable
+import metrics
 
-def ip_other_mac_exists(server_ip, ip, mac, cfg, key_filename=None, passphrase=None):
+
+# Durée (en secondes) au-delà de laquelle une session inutilisée est refermée
+IDLE_TIMEOUT = 300
+
+# Commande autorisée par dhcp-filter.sh sur les serveurs
+AGENT_CMD = "dhcp-agent"
+
+# Essais de replace_reservations quand un autre client écrit en même temps
+REPLACE_ATTEMPTS = 3
+
+# Secondes pendant lesquelles l'agent attend d'autres modifications avant
+# de recharger dnsmasq une seule fois pour toutes (reload_window)
+RELOAD_WINDOW = 1
+
+
+# Types de clés essayés, du plus courant au plus ancien
+KEY_CLASSES = (Ed25519Key, ECDSAKey, RSAKey)
+
+# Clés déjà déchiffrées : (chemin, mtime) -> clé en mémoire
+_key_cache = {}
+# Clés publiques (format "type base64") proposées par le ssh-agent, None = pas encore demandé
+_agent_keys = None
+_key_lock = threading.Lock()
+
+
+def _agent_public_keys():
     """
-    Vérifie si l'IP est déjà utilisée par une autre MAC
+    Retourne les clés publiques du ssh-agent en cours d'exécution
+    (ensemble vide s'il n'y a pas d'agent)
     """
-    # Préparation de la connexion SSH
-    user = cfg["user"]
-    connect_kwargs = {}
-    
-    # Chargement de la clé RSA si fournie
-    if key_filename:
-        try:
-            if passphrase:
-                pkey = RSAKey.from_private_key_file(key_filename, password=passphrase)
-            else:
-                pkey = RSAKey.from_private_key_file(key_filename)
-            connect_kwargs["pkey"] = pkey
-        except SSHException as e:
-            print(f"Erreur clé RSA: {e}", file=sys.stderr)
-            return False
-    
-    # Connexion et vérification
+    global _agent_keys
+
+    with _key_lock:
+        if _agent_keys is None:
+            keys = set()
+            if os.environ.get("SSH_AUTH_SOCK"):
+                try:
+                    with metrics.span("key.agent_lookup"):
+                        agent = Agent()
+                        for key in agent.get_keys():
+                            keys.add(f"{key.get_name()} {key.get_base64()}")
+                        agent.close()
+                except (SSHException, OSError):
+                    # Agent injoignable : on fera sans
+                    pass
+            _agent_keys = keys
+
+    return _agent_keys
+
+
+def key_in_agent(key_filename):
+    """
+    Vérifie si la clé (via son fichier .pub) est déjà chargée dans le ssh-agent
+    Sans fichier de clé, n'importe quelle clé de l'agent convient
+    """
+    agent_keys = _agent_public_keys()
+    if not agent_keys:
+        return False
+    if not key_filename:
+        return True
+
     try:
-        conn = Connection(host=server_ip, user=user, connect_kwargs=connect_kwargs)
-        
-        # Récupérer le chemin du fichier depuis la config
-        dhcp_file = cfg.get("dhcp_hosts_cfg", "/etc/dnsmasq.d/hosts.conf")
-        
-        # Lire toutes les lignes dhcp-host
-        cmd = f"grep '^dhcp-host=' {dhcp_file} || true"
-        result = conn.run(cmd, hide=True, warn=True)
-        
-        # Parcourir les lignes pour chercher des conflits
-        for line in result.stdout.splitlines():
-            if line.startswith("dhcp-host="):
-                # Extraire MAC et IP de la ligne
-                parts = line.replace("dhcp-host=", "").split(",")
-                if len(parts) == 2:
-                    existing_mac = parts[0].strip().lower()
-                    existing_ip = parts[1].strip()
-                    
-                    # Si même IP mais MAC différente = conflit
-                    if existing_ip == ip and existing_mac != mac.lower():
-                        conn.close()
-                        return True
-        
-        conn.close()
+        with open(os.path.expanduser(key_filename) + ".pub") as f:
+            fields = f.read().split()
+    except OSError:
         return False
-        
-    except Exception as e:
-        print(f"Erreur connexion: {e}", file=sys.stderr)
+
+    return len(fields) >= 2 and f"{fields[0]} {fields[1]}" in agent_keys
+
+
+def load_private_key(key_filename, passphrase=None):
+    """
+    Charge une clé privée (Ed25519, ECDSA ou RSA) et la garde en mémoire :
+    le déchiffrement (coûteux avec bcrypt) n'est fait qu'une fois par processus
+    Lève SSHException si la clé est illisible ou la passphrase fausse
+    """
+    path = os.path.expanduser(key_filename)
+    cache_key = (path, os.stat(path).st_mtime_ns)
+
+    with _key_lock:
+        pkey = _key_cache.get(cache_key)
+        if pkey is not None:
+            return pkey
+
+        error = None
+        with metrics.span("key.decrypt"):
+            for key_class in KEY_CLASSES:
+                try:
+                    pkey = key_class.from_private_key_file(path, password=passphrase)
+                    break
+                except PasswordRequiredException:
+                    # Inutile d'essayer les autres types : il manque la passphrase
+                    raise
+                except SSHException as e:
+                    # Mauvais type de clé (ou mauvaise passphrase) : on essaie le suivant
+                    error = e
+
+            if pkey is None:
+                raise error
+
+        _key_cache[cache_key] = pkey
+        return pkey
+
+
+def needs_passphrase(key_filename):
+    """
+    Indique s'il faut demander la passphrase à l'utilisateur :
+    inutile si le ssh-agent a la clé, si elle est déjà en mémoire
+    ou si elle n'est pas chiffrée
+    """
+    if key_in_agent(key_filename):
+        return False
+
+    try:
+        load_private_key(key_filename)
+        return False
+    except PasswordRequiredException:
+        return True
+    except (SSHException, OSError):
+        # Fichier absent ou illisible : l'erreur sera affichée à la connexion
         return False
 
 
-def mac_exists(server_ip, mac, cfg, key_filename=None, passphrase=None):
+def _connect_kwargs(key_filename=None, passphrase=None):
     """
-    Vérifie si la MAC existe déjà dans la config
+    Prépare les paramètres d'authentification pour fabric
+    Lève SSHException si la clé ne peut pas être lue
     """
-    # Préparation connexion
-    user = cfg["user"]
-    connect_kwargs = {}
-    
+    # On ne cherche pas les clés par défaut de ~/.ssh
+    connect_kwargs = {"look_for_keys": False, "allow_agent": True}
+
+    # La clé est dans le ssh-agent : pas de déchiffrement local
+    if key_in_agent(key_filename):
+        return connect_kwargs
+
+    # Sinon, clé déchiffrée une seule fois et partagée par toutes les sessions
     if key_filename:
         try:
-            if passphrase:
-                pkey = RSAKey.from_private_key_file(key_filename, password=passphrase)
+            connect_kwargs["pkey"] = load_private_key(key_filename, passphrase)
+        except OSError as e:
+            raise SSHException(str(e))
+
+    return connect_kwargs
+
+
+def _is_alive(conn):
+    """
+    Vérifie qu'une session SSH déjà ouverte répond encore
+    """
+    if not conn.is_connected:
+        return False
+
+    try:
+        # Paquet "ignore" : quasi gratuit, mais échoue si la socket est morte
+        conn.transport.send_ignore()
+        return True
+    except (SSHException, EOFError, OSError):
+        return False
+
+
+class SessionPool:
+    """
+    Garde une session SSH authentifiée par serveur (clé : hôte + utilisateur)
+    et la partage entre tous les appels d'un même processus
+    """
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        # (hôte, utilisateur) -> [Connection, date de dernière utilisation]
+        self._sessions = {}
+        # Le pool peut être utilisé depuis plusieurs threads
+        self._lock = threading.Lock()
+
+    def get(self, server, cfg, key_filename=None, passphrase=None):
+        """
+        Retourne la session du serveur, en la (re)créant si besoin
+        """
+        user = cfg["user"]
+        key = (server, user)
+        idle_timeout = cfg.get("ssh_idle_timeout", self.idle_timeout)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._sessions.get(key)
+
+            if entry is not None:
+                conn, last_used = entry
+                # Session trop ancienne ou coupée : on la jette
+                if now - last_used > idle_timeout or (conn.is_connected and not _is_alive(conn)):
+                    conn.close()
+                    entry = None
+
+            if entry is None:
+                metrics.count("ssh.sessions_created")
+                # La connexion réelle est faite au premier conn.run()
+                conn = Connection(
+                    host=server,
+                    user=user,
+                    connect_kwargs=_connect_kwargs(key_filename, passphrase),
+                    connect_timeout=cfg.get("ssh_timeout")
+                )
+                entry = [conn, now]
+                self._sessions[key] = entry
             else:
-                pkey = RSAKey.from_private_key_file(key_filename)
-            connect_kwargs["pkey"] = pkey
-        except SSHException as e:
-            print(f"Erreur clé RSA: {e}", file=sys.stderr)
-            return False
-    
-    # Connexion et recherche
+                metrics.count("ssh.sessions_reused")
+
+            entry[1] = now
+            return entry[0]
+
+    def discard(self, server, user):
+        """
+        Ferme et oublie la session d'un serveur
+        """
+        with self._lock:
+            entry = self._sessions.pop((server, user), None)
+        if entry is not None:
+            entry[0].close()
+
+    def close_all(self):
+        """
+        Ferme toutes les sessions ouvertes
+        """
+        with self._lock:
+            entries = list(self._sessions.values())
+            self._sessions.clear()
+        for conn, _ in entries:
+            conn.close()
+
+
+# Pool partagé par toutes les fonctions du module
+_pool = SessionPool()
+atexit.register(_pool.close_all)
+
+
+def get_session(server, cfg, key_filename=None, passphrase=None):
+    """
+    Retourne une session SSH réutilisable vers le serveur
+    (à passer en paramètre conn= des autres fonctions)
+    """
+    return _pool.get(server, cfg, key_filename, passphrase)
+
+
+def close_sessions():
+    """
+    Ferme toutes les sessions SSH du processus
+    """
+    _pool.close_all()
+
+
+class AgentError(Exception):
+    """
+    L'agent du serveur a refusé la requête ou a répondu n'importe quoi
+    """
+
+
+def _connect(conn):
+    """
+    Ouvre la session si elle ne l'est pas déjà (poignée de main et authentification)
+    """
+    if conn.is_connected:
+        return
+    metrics.count("ssh.handshakes")
+    with metrics.span("ssh.connect"):
+        conn.open()
+
+
+def _open_channel(conn):
+    """
+    Ouvre un canal sur la session
+    Si la session est tombée, se reconnecte une fois
+    (rien n'a encore été envoyé, on peut donc réessayer sans risque)
+    """
     try:
-        conn = Connection(host=server_ip, user=user, connect_kwargs=connect_kwargs)
-        
-        # Récupérer le chemin du fichier
-        dhcp_file = cfg.get("dhcp_hosts_cfg", "/etc/dnsmasq.d/hosts.conf")
-        
-        # Chercher la MAC (insensible à la casse)
-        mac_lower = mac.lower()
-        cmd = f"grep -i '^dhcp-host={mac_lower},' {dhcp_file} || true"
-        result = conn.run(cmd, hide=True, warn=True)
-        
-        # Si on trouve quelque chose, la MAC existe
-        exists = bool(result.stdout.strip())
-        
+        _connect(conn)
+        return conn.transport.open_session()
+    except (SSHException, EOFError, OSError):
+        metrics.count("ssh.reconnects")
         conn.close()
-        return exists
-        
+        _connect(conn)
+        return conn.transport.open_session()
+
+
+def _counted_lines(stdout):
+    """
+    Lignes du fichier qui suit la réponse, en comptant les octets reçus
+    """
+    received = 0
+    try:
+        for line in stdout:
+            received += len(line)
+            yield line.decode()
+    finally:
+        metrics.count("agent.bytes_received", received)
+
+
+def agent_call(conn, cfg, ops, reload=False, read_lines=None):
+    """
+    Envoie un lot d'opérations à dhcp-agent en un seul aller-retour
+    Retourne la réponse de l'agent (dictionnaire)
+    Si une opération list demande le format "lines", le fichier qui suit la
+    réponse est passé à read_lines (itérateur de lignes lues au fil de l'eau
+    sur le canal) et ce qu'elle retourne est rangé dans result["table"]
+    Lève AgentError si l'agent refuse la requête
+    """
+    with metrics.span("agent.call"):
+        return _agent_call(conn, cfg, ops, reload, read_lines)
+
+
+def _agent_call(conn, cfg, ops, reload, read_lines):
+    request = {"version": 1, "ops": ops, "reload": reload}
+    if reload:
+        request["reload_window"] = cfg.get("reload_window", RELOAD_WINDOW)
+    request = json.dumps(request).encode()
+    metrics.count("agent.commands")
+    metrics.count("agent.bytes_sent", len(request))
+
+    with metrics.span("ssh.open_channel"):
+        channel = _open_channel(conn)
+    try:
+        channel.settimeout(cfg.get("ssh_command_timeout"))
+        channel.exec_command(cfg.get("agent_cmd", AGENT_CMD))
+
+        # La requête part en entier, puis on signale la fin de stdin
+        channel.sendall(request)
+        channel.shutdown_write()
+
+        # La réponse tient sur la première ligne (attente : travail de l'agent + aller-retour)
+        stdout = channel.makefile("rb")
+        with metrics.span("agent.wait"):
+            header = stdout.readline()
+        metrics.count("agent.bytes_received", len(header))
+        try:
+            response = json.loads(header)
+        except ValueError:
+            response = None
+
+        if response is not None and response.get("ok"):
+            for result in response["results"]:
+                if result.get("lines") and read_lines is not None:
+                    lines = _counted_lines(stdout) if metrics.enabled() else (line.decode() for line in stdout)
+                    with metrics.span("agent.read_body"):
+                        result["table"] = read_lines(lines)
+
+        # Lire ce qui reste (rien, sauf erreur de l'agent)
+        stdout.read()
+        stderr = channel.makefile_stderr("rb").read()
+        channel.recv_exit_status()
+    finally:
+        channel.close()
+
+    # Durée de chaque phase sur le serveur (verrou, lecture, écriture, redémarrage)
+    if response is not None and metrics.enabled():
+        for phase, duration in response.get("timings", {}).items():
+            metrics.record(f"remote.{phase}", duration)
+
+    if response is None:
+        message = stderr.decode(errors="replace").strip() or "invalid response"
+        raise AgentError(message)
+
+    if not response.get("ok"):
+        raise AgentError(response.get("error", "request refused"))
+
+    return response
+
+
+def _session_or_none(server, cfg, key_filename, passphrase, conn):
+    """
+    Retourne la session fournie, ou celle du pool
+    Retourne None (après un message d'erreur) si la clé est illisible
+    """
+    if conn is not None:
+        return conn
+
+    try:
+        return get_session(server, cfg, key_filename, passphrase)
+    except SSHException as e:
+        print(f"Erreur clé SSH: {e}", file=sys.stderr)
+        return None
+
+
+def _remember(cfg, method, *args):
+    """
+    Met à jour l'index local MAC -> serveur
+    (une erreur sur l'index ne doit jamais faire échouer l'opération)
+    """
+    try:
+        getattr(get_location_index(cfg), method)(*args)
+    except OSError as e:
+        print(f"Warning: cannot update location index: {e}", file=sys.stderr)
+
+
+def _remember_changes(server, cfg, ops, response):
+    """
+    Répercute une modification sur le cache local des réservations
+    """
+    try:
+        get_cache(cfg).apply(server, response, ops)
+    except OSError as e:
+        print(f"Warning: cannot update reservation cache: {e}", file=sys.stderr)
+
+
+def _record_journal(server, cfg, ops, response):
+    """
+    Ajoute au journal local les modifications que l'agent vient de faire
+    """
+    try:
+        get_journal(cfg).record(server, ops, response)
+    except OSError as e:
+        print(f"Warning: cannot write change journal: {e}", file=sys.stderr)
+
+
+def _check(server_ip, ip, mac, cfg, key_filename, passphrase, conn):
+    """
+    Demande à l'agent l'état d'une MAC (et d'une IP si fournie)
+    Retourne le résultat de l'opération check (ou None en cas d'erreur)
+    """
+    conn = _session_or_none(server_ip, cfg, key_filename, passphrase, conn)
+    if conn is None:
+        return None
+
+    try:
+        op = {"op": "check", "mac": mac.lower()}
+        if ip is not None:
+            op["ip"] = ip
+        return agent_call(conn, cfg, [op])["results"][0]
+
+    except AgentError as e:
+        print(f"Erreur agent: {e}", file=sys.stderr)
+        return None
     except Exception as e:
         print(f"Erreur connexion: {e}", file=sys.stderr)
+        return None
+
+
+def ip_other_mac_exists(server_ip, ip, mac, cfg, key_filename=None, passphrase=None, conn=None):
+    """
+    Vérifie si l'IP est déjà utilisée par une autre MAC
+    """
+    result = _check(server_ip, ip, mac, cfg, key_filename, passphrase, conn)
+    return result is not None and result["ip_owner"] is not None
+
+
+def mac_exists(server_ip, mac, cfg, key_filename=None, passphrase=None, conn=None):
+    """
+    Vérifie si la MAC existe déjà dans la config
+    """
+    result = _check(server_ip, None, mac, cfg, key_filename, passphrase, conn)
+    return result is not None and result["mac_ip"] is not None
+
+
+def _report_reload(response):
+    """
+    Affiche l'erreur de redémarrage éventuelle
+    Retourne True si la modification est bien active
+    """
+    if response["changed"] and not response["reloaded"]:
+        print(f"error: Impossible de redémarrer dnsmasq", file=sys.stderr)
         return False
+    return True
+
+
+def write_reservations(ops, server, cfg, key_filename=None, passphrase=None, conn=None):
+    """
+    Envoie un lot d'opérations upsert/delete à l'agent (un seul redémarrage)
+    Met à jour le cache, l'index local et le journal, et retourne la réponse de l'agent
+    Lève une exception en cas d'erreur
+    """
+    if conn is None:
+        conn = get_session(server, cfg, key_filename, passphrase)
+
+    response = agent_call(conn, cfg, ops, reload=True)
+    _record_journal(server, cfg, ops, response)
+    _remember_changes(server, cfg, ops, response)
+    _remember_ops(server, cfg, ops, response["results"])
+    return response
+
+
+def _remember_ops(server, cfg, ops, results):
+    """
+    Répercute des opérations upsert/delete sur l'index local MAC -> serveur
+    """
+    seen = []
+    for op, result in zip(ops, results):
+        if op["op"] == "upsert" and result["status"] != "conflict":
+            seen.append({"mac": op["mac"], "ip": op["ip"]})
+        elif op["op"] == "delete" and result["status"] in ("deleted", "not_found"):
+            # La MAC n'est plus (ou n'a jamais été) là où l'index la croyait
+            _remember(cfg, "forget", op["mac"], server)
+    if seen:
+        _remember(cfg, "record", server, seen)
 
 
-def dhcp_add(ip, mac, server, cfg, key_filename=None, passphrase=None):
+def replace_reservations(ops, server, cfg, key_filename=None, passphrase=None, conn=None):
+    """
+    Comme write_reservations(), mais le nouveau fichier est construit ici :
+    le fichier complet est lu (toute la syntaxe dhcp-host), les opérations y
+    sont appliquées, puis il est renvoyé en une fois à l'agent, qui ne le met
+    en place que s'il n'a pas changé entre-temps (après vérification par
+    dnsmasq, en gardant la version précédente dans hosts.conf~)
+    Si un autre client a écrit entre la lecture et l'envoi, tout est refait
+    sur sa version (au plus REPLACE_ATTEMPTS fois, avec une attente
+    aléatoire croissante) : les opérations sont revérifiées sur le fichier
+    à jour, aucune modification n'est perdue. Si le fichier change encore,
+    les opérations sont envoyées telles quelles (write_reservations) :
+    l'agent les applique sous son verrou, sans risque d'être devancé
+    Retourne une réponse au format de write_reservations (un résultat par opération)
+    """
+    if conn is None:
+        conn = get_session(server, cfg, key_filename, passphrase)
+
+    for attempt in range(REPLACE_ATTEMPTS):
+        if attempt:
+            metrics.count("replace.rebases")
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+        read = agent_call(conn, cfg, [{"op": "list", "format": "lines"}], read_lines=ReservationTable.from_lines)
+        table = read["results"][0]["table"]
+        results = table.apply(ops)
+        if not table.changed:
+            read["results"] = results
+            return read
+
+        op = {"op": "replace", "content": table.render(), "base_sha256": read["fingerprint"]["sha256"]}
+        response = agent_call(conn, cfg, [op], reload=True)
+        if response["results"][0]["status"] != "conflict":
+            break
+    else:
+        metrics.count("replace.fallbacks")
+        return write_reservations(ops, server, cfg, conn=conn)
+    response["results"] = results
+    _record_journal(server, cfg, ops, response)
+
+    # La table envoyée est exactement celle du serveur
+    try:
+        get_cache(cfg).put(server, response["fingerprint"], CompactTable.from_pairs(table.pairs()))
+    except OSError as e:
+        print(f"Warning: cannot update reservation cache: {e}", file=sys.stderr)
+    _remember_ops(server, cfg, ops, results)
+    return response
+
+
+def add_reservation(mac, ip, server, cfg, key_filename=None, passphrase=None, conn=None):
+    """
+    Ajoute ou met à jour la réservation d'une MAC et retourne la réponse de l'agent
+    L'agent refuse l'ajout si l'IP est déjà utilisée par une autre MAC (statut "conflict")
+    Lève une exception en cas d'erreur
+    """
+    op = {"op": "upsert", "mac": mac.lower(), "ip": ip}
+    return write_reservations([op], server, cfg, key_filename, passphrase, conn)
+
+
+def dhcp_add(ip, mac, server, cfg, key_filename=None, passphrase=None, conn=None):
     """
     Ajoute ou met à jour une réservation DHCP
+    (vérification, écriture et redémarrage en un seul appel à l'agent)
     """
     # Normaliser la MAC en minuscules
     mac_lower = mac.lower()
-    
-    # Vérifier d'abord si l'IP est déjà utilisée par une autre MAC
-    if ip_other_mac_exists(server, ip, mac_lower, cfg, key_filename, passphrase):
-        print("error: IP address already in use.", file=sys.stderr)
+
+    conn = _session_or_none(server, cfg, key_filename, passphrase, conn)
+    if conn is None:
         return False
-    
-    # Préparation connexion
-    user = cfg["user"]
-    connect_kwargs = {}
-    
-    if key_filename:
-        try:
-            if passphrase:
-                pkey = RSAKey.from_private_key_file(key_filename, password=passphrase)
-            else:
-                pkey = RSAKey.from_private_key_file(key_filename)
-            connect_kwargs["pkey"] = pkey
-        except SSHException as e:
-            print(f"Erreur clé RSA: {e}", file=sys.stderr)
-            return False
-    
-    # Connexion et modification
+
     try:
-        conn = Connection(host=server, user=user, connect_kwargs=connect_kwargs)
-        
-        # Récupérer le chemin du fichier
-        dhcp_file = cfg.get("dhcp_hosts_cfg", "/etc/dnsmasq.d/hosts.conf")
-        
-        # Vérifier si la MAC existe déjà
-        if mac_exists(server, mac_lower, cfg, key_filename, passphrase):
-            # La MAC existe, on la remplace avec sed
-            sed_cmd = f"sudo sed -i 's|^dhcp-host={mac_lower},.*$|dhcp-host={mac_lower},{ip}|' {dhcp_file}"
-            result = conn.run(sed_cmd, hide=False, warn=True)
-            
-            if result.exited != 0:
-                print(f"error: Erreur lors de la mise à jour de {mac_lower}", file=sys.stderr)
-                conn.close()
-                return False
-        else:
-            # La MAC n'existe pas, on l'ajoute
-            echo_cmd = f"echo 'dhcp-host={mac_lower},{ip}' | sudo tee -a {dhcp_file}"
-            result = conn.run(echo_cmd, hide=False, warn=True)
-            
-            if result.exited != 0:
-                print(f"error: Erreur lors de l'ajout de {mac_lower}", file=sys.stderr)
-                conn.close()
-                return False
-        
-        # Redémarrer dnsmasq
-        result = conn.run("sudo systemctl restart dnsmasq", hide=False, warn=True)
-        if result.exited != 0:
-            print(f"error: Impossible de redémarrer dnsmasq", file=sys.stderr)
-            conn.close()
+        response = add_reservation(mac_lower, ip, server, cfg, conn=conn)
+
+        if response["results"][0]["status"] == "conflict":
+            print("error: IP address already in use.", file=sys.stderr)
             return False
-        
-        conn.close()
-        return True
-        
+
+        return _report_reload(response)
+
+    except AgentError as e:
+        print(f"error: Erreur lors de l'ajout de {mac_lower}: {e}", file=sys.stderr)
+        return False
     except Exception as e:
         print(f"Erreur connexion: {e}", file=sys.stderr)
         return False
 
 
-def dhcp_remove(mac, server, cfg, key_filename=None, passphrase=None):
+def remove_reservation(mac, server, cfg, expected_ip=None, key_filename=None, passphrase=None, conn=None):
+    """
+    Supprime la réservation d'une MAC et retourne la réponse de l'agent
+    Avec expected_ip, rien n'est supprimé si la MAC n'a plus cette IP
+    (statut "mismatch") : une information périmée ne supprime jamais rien
+    Lève une exception en cas d'erreur
+    """
+    op = {"op": "delete", "mac": mac.lower()}
+    if expected_ip is not None:
+        op["ip"] = expected_ip
+    return write_reservations([op], server, cfg, key_filename, passphrase, conn)
+
+
+def dhcp_remove(mac, server, cfg, key_filename=None, passphrase=None, conn=None, expected_ip=None):
     """
     Supprime une réservation DHCP
     """
     mac_lower = mac.lower()
-    
-    # Vérifier d'abord si la MAC existe
-    if not mac_exists(server, mac_lower, cfg, key_filename, passphrase):
-        print("MAC address not found", file=sys.stderr)
+
+    conn = _session_or_none(server, cfg, key_filename, passphrase, conn)
+    if conn is None:
         return False
-    
-    # Préparation connexion
-    user = cfg["user"]
-    connect_kwargs = {}
-    
-    if key_filename:
-        try:
-            if passphrase:
-                pkey = RSAKey.from_private_key_file(key_filename, password=passphrase)
-            else:
-                pkey = RSAKey.from_private_key_file(key_filename)
-            connect_kwargs["pkey"] = pkey
-        except SSHException as e:
-            print(f"Erreur clé RSA: {e}", file=sys.stderr)
-            return False
-    
-    # Connexion et suppression
+
     try:
-        conn = Connection(host=server, user=user, connect_kwargs=connect_kwargs)
-        
-        # Récupérer le chemin du fichier
-        dhcp_file = cfg.get("dhcp_hosts_cfg", "/etc/dnsmasq.d/hosts.conf")
-        
-        # Supprimer la ligne avec sed
-        sed_cmd = f"sudo sed -i '/^dhcp-host={mac_lower},/d' {dhcp_file}"
-        result = conn.run(sed_cmd, hide=False, warn=True)
-        
-        if result.exited != 0:
-            print(f"error: Erreur lors de la suppression de {mac_lower}", file=sys.stderr)
-            conn.close()
+        response = remove_reservation(mac_lower, server, cfg, expected_ip=expected_ip, conn=conn)
+        status = response["results"][0]["status"]
+
+        if status == "not_found":
+            print("MAC address not found", file=sys.stderr)
             return False
-        
-        # Redémarrer dnsmasq
-        result = conn.run("sudo systemctl restart dnsmasq", hide=False, warn=True)
-        if result.exited != 0:
-            print(f"error: Impossible de redémarrer dnsmasq", file=sys.stderr)
-            conn.close()
+        if status == "mismatch":
+            print(f"error: {mac_lower} is now reserved for {response['results'][0]['current']}",
+                  file=sys.stderr)
             return False
-        
-        conn.close()
-        return True
-        
+
+        return _report_reload(response)
+
+    except AgentError as e:
+        print(f"error: Erreur lors de la suppression de {mac_lower}: {e}", file=sys.stderr)
+        return False
     except Exception as e:
         print(f"Erreur connexion: {e}", file=sys.stderr)
         return False
 
 
-def dhcp_list(server, cfg, key_filename=None, passphrase=None):
+class CacheMiss(Exception):
+    """
+    Lecture hors ligne impossible : le serveur n'a jamais été lu
+    """
+
+
+def get_reservations(server, cfg, key_filename=None, passphrase=None, conn=None, offline=False,
+                     max_age=None):
+    """
+    Lit toutes les réservations DHCP d'un serveur, en passant par le cache local :
+    l'agent ne renvoie la liste que si le fichier a changé depuis la dernière lecture
+    Avec offline=True, aucune connexion : on sert la dernière version connue
+    Avec max_age, une version vérifiée il y a moins de max_age secondes est servie
+    sans connexion
+    Retourne (CompactTable, état) avec état = {"source": "server" ou "cache",
+    "stale": True si la version n'a pas pu être vérifiée, "age": secondes}
+    Lève une exception en cas d'erreur
+    """
+    cache = get_cache(cfg)
+    meta, cached = cache.get_table(server)
+
+    if offline:
+        if meta is None:
+            raise CacheMiss(f"no cached reservations for {server}")
+        metrics.count("list.offline")
+        state = {"source": "cache", "stale": True, "age": time.time() - meta["fetched"]}
+        return cached, state
+
+    if max_age is not None and meta is not None:
+        age = time.time() - meta["fetched"]
+        if age <= max_age:
+            metrics.count("list.fresh_cache")
+            return cached, {"source": "cache", "stale": False, "age": age}
+
+    if conn is None:
+        conn = get_session(server, cfg, key_filename, passphrase)
+
+    # Le fichier est lu et analysé au fil de l'eau, directement en table compacte
+    op = {"op": "list", "format": "lines"}
+    if meta is not None:
+        op["if_none_match"] = meta["fingerprint"]["sha256"]
+
+    response = agent_call(conn, cfg, [op],
+                          read_lines=lambda lines: CompactTable.from_pairs(iter_reservations(lines)))
+    result = response["results"][0]
+
+    if result.get("not_modified"):
+        # Quelques octets échangés : la version en cache est la bonne
+        metrics.count("list.not_modified")
+        cache.put(server, response["fingerprint"])
+        return cached, {"source": "cache", "stale": False, "age": 0}
+
+    metrics.count("list.full")
+    table = result["table"]
+    cache.put(server, response["fingerprint"], table)
+
+    # La liste complète sert à remettre l'index local à jour
+    _remember(cfg, "record_server", server, ({"mac": mac, "ip": ip} for mac, ip in table.pairs()))
+    return table, {"source": "server", "stale": False, "age": 0}
+
+
+def get_leases(server, cfg, key_filename=None, passphrase=None, conn=None, offline=False):
+    """
+    Lit les baux en cours d'un serveur (fichier dnsmasq.leases), en gardant
+    une copie locale : l'agent ne renvoie que ce qui a été ajouté depuis la
+    dernière lecture, ou tout le fichier s'il a été réécrit
+    Avec offline=True, aucune connexion : on sert la dernière version connue
+    Retourne (LeaseTable, état) avec état = {"stale", "age"} comme get_reservations
+    Lève une exception en cas d'erreur
+    """
+    cache = get_cache(cfg)
+    known, fetched = cache.get_leases(server)
+
+    if offline:
+        if known is None:
+            raise CacheMiss(f"no cached leases for {server}")
+        return LeaseTable.from_text(known.decode("latin-1")), {"stale": True, "age": time.time() - fetched}
+
+    if conn is None:
+        conn = get_session(server, cfg, key_filename, passphrase)
+
+    op = {"op": "leases"}
+    if known:
+        op["offset"] = len(known)
+        op["prefix_sha256"] = hashlib.sha256(known).hexdigest()
+
+    result = agent_call(conn, cfg, [op])["results"][0]
+    data = result["data"].encode("latin-1")
+    if result["start"]:
+        data = known[:result["start"]] + data
+    if len(data) != result["size"]:
+        raise AgentError(f"leases of {server} changed while reading")
+
+    cache.put_leases(server, data if data != known else None)
+    return LeaseTable.from_text(data.decode("latin-1")), {"stale": False, "age": 0}
+
+
+def read_reservations(server, cfg, key_filename=None, passphrase=None, conn=None, offline=False):
+    """
+    Lit toutes les réservations DHCP d'un serveur
+    Retourne une liste de dictionnaires [{"mac": "...", "ip": "..."}, ...]
+    Contrairement à dhcp_list, lève une exception en cas d'erreur
+    """
+    return get_reservations(server, cfg, key_filename, passphrase, conn, offline)[0].entries()
+
+
+def dhcp_list(server, cfg, key_filename=None, passphrase=None, conn=None):
     """
     Liste toutes les réservations DHCP d'un serveur
     """
-    # Préparation connexion
-    user = cfg["user"]
-    connect_kwargs = {}
-    
-    if key_filename:
-        try:
-            if passphrase:
-                pkey = RSAKey.from_private_key_file(key_filename, password=passphrase)
-            else:
-                pkey = RSAKey.from_private_key_file(key_filename)
-            connect_kwargs["pkey"] = pkey
-        except SSHException as e:
-            print(f"Erreur clé RSA: {e}", file=sys.stderr)
-            return []
-    
-    # Connexion et lecture
+    conn = _session_or_none(server, cfg, key_filename, passphrase, conn)
+    if conn is None:
+        return []
+
     try:
-        conn = Connection(host=server, user=user, connect_kwargs=connect_kwargs)
-        
-        # Récupérer le chemin du fichier
-        dhcp_file = cfg.get("dhcp_hosts_cfg", "/etc/dnsmasq.d/hosts.conf")
-        
-        # Lire toutes les lignes dhcp-host
-        cmd = f"grep '^dhcp-host=' {dhcp_file} || true"
-        result = conn.run(cmd, hide=True, warn=True)
-        
-        # Construire la liste des entrées
-        entries = []
-        for line in result.stdout.splitlines():
-            if line.startswith("dhcp-host="):
-                # Extraire MAC et IP
-                parts = line.replace("dhcp-host=", "").split(",")
-                if len(parts) == 2:
-                    mac_addr = parts[0].strip().lower()
-                    ip_addr = parts[1].strip()
-                    
-                    # Ajouter à la liste
-                    entries.append({
-                        "mac": mac_addr,
-                        "ip": ip_addr
-                    })
-        
-        conn.close()
-        return entries
-        
+        return read_reservations(server, cfg, conn=conn)
+
+    except AgentError as e:
+        print(f"Erreur agent: {e}", file=sys.stderr)
+        return []
     except Exception as e:
         print(f"Erreur connexion: {e}", file=sys.stderr)
         return []
+
+
+def preview_reservations(entries, server, cfg, key_filename=None, passphrase=None, conn=None):
+    """
+    Prévoit le résultat de l'ajout de plusieurs réservations, sans rien modifier
+    entries : liste de (mac, ip)
+    Retourne un résultat par entrée ({"status": ...})
+    Lève une exception en cas d'erreur
+    """
+    if conn is None:
+        conn = get_session(server, cfg, key_filename, passphrase)
+
+    ops = [{"op": "check", "mac": mac.lower(), "ip": ip} for mac, ip in entries]
+    response = agent_call(conn, cfg, ops)
+    return [_predicted_status(result, ip) for result, (_, ip) in zip(response["results"], entries)]
+
+
+def dhcp_add_many(entries, server, cfg, key_filename=None, passphrase=None, conn=None, dry_run=False):
+    """
+    Ajoute ou met à jour plusieurs réservations sur un même serveur
+    entries : liste de (mac, ip)
+    Le fichier est lu une fois, écrit une fois et dnsmasq redémarré une fois
+    Retourne un résultat par entrée ({"status": ...}), ou None en cas d'erreur
+    Avec dry_run=True, rien n'est modifié : on retourne le résultat prévu
+    """
+    conn = _session_or_none(server, cfg, key_filename, passphrase, conn)
+    if conn is None:
+        return None
+
+    try:
+        if dry_run:
+            return preview_reservations(entries, server, cfg, conn=conn)
+
+        ops = [{"op": "upsert", "mac": mac.lower(), "ip": ip} for mac, ip in entries]
+        response = write_reservations(ops, server, cfg, conn=conn)
+
+        if not _report_reload(response):
+            return None
+        return response["results"]
+
+    except AgentError as e:
+        print(f"Erreur agent: {e}", file=sys.stderr)
+        return None
+    except Exception as e:
+        print(f"Erreur connexion: {e}", file=sys.stderr)
+        return None
+
+
+def _predicted_status(result, ip):
+    """
+    Traduit le résultat d'un check en statut d'ajout prévu
+    """
+    if result["ip_owner"] is not None:
+        return {"status": "conflict", "owner": result["ip_owner"]}
+    if result["mac_ip"] is None:
+        return {"status": "added", "previous": None}
+    if result["mac_ip"] == ip:
+        return {"status": "unchanged"}
+    return {"status": "updated", "previous": result["mac_ip"]}
+
+
+class ServerTimeout(Exception):
+    """
+    Le serveur n'a pas répondu dans le délai imparti
+    """
+
+
+def fan_out(servers, func, jobs=8, timeout=None):
+    """
+    Appelle func(server) en parallèle sur plusieurs serveurs
+    (au plus jobs à la fois, timeout secondes maximum par serveur)
+    Générateur : donne (server, résultat, erreur) dans l'ordre de servers,
+    dès que le serveur concerné et tous ceux avant lui ont terminé
+    """
+    slots = threading.Semaphore(max(1, jobs))
+    tasks = []
+
+    def worker(task):
+        try:
+            task["result"] = func(task["server"])
+        except Exception as e:
+            task["error"] = e
+        finally:
+            task["end"] = time.monotonic()
+            slots.release()
+            task["done"].set()
+
+    def launcher():
+        # Démarre les serveurs au fur et à mesure que des places se libèrent
+        for task in tasks:
+            slots.acquire()
+            task["start"] = time.monotonic()
+            task["started"].set()
+            threading.Thread(target=worker, args=(task,), daemon=True).start()
+
+    for server in servers:
+        tasks.append({"server": server, "result": None, "error": None,
+                      "started": threading.Event(), "done": threading.Event()})
+
+    # Threads "daemon" : un serveur bloqué n'empêche pas le programme de se terminer
+    threading.Thread(target=launcher, daemon=True).start()
+
+    for task in tasks:
+        # Le délai ne compte qu'à partir du démarrage réel du serveur
+        task["started"].wait()
+        if timeout is None:
+            task["done"].wait()
+        else:
+            remaining = task["start"] + timeout - time.monotonic()
+            if not task["done"].wait(max(0, remaining)):
+                task["error"] = ServerTimeout(f"no answer after {timeout}s")
+
+        yield task["server"], task["result"], task["error"]
+
+
+def find_mac_server(mac, servers, cfg, key_filename=None, passphrase=None, jobs=8, timeout=None):
+    """
+    Cherche en parallèle le serveur qui possède la MAC
+    S'arrête dès qu'un serveur la trouve (sans attendre les autres)
+    Retourne (serveur, ip) ou None
+    """
+    mac_lower = mac.lower()
+    found = queue.Queue()
+
+    def probe(server):
+        conn = get_session(server, cfg, key_filename, passphrase)
+        result = agent_call(conn, cfg, [{"op": "check", "mac": mac_lower}])["results"][0]
+        if result["mac_ip"] is not None:
+            found.put((server, result["mac_ip"]))
+
+    def run():
+        # Les serveurs injoignables sont ignorés, comme une MAC absente
+        for _ in fan_out(servers, probe, jobs=jobs, timeout=timeout):
+            pass
+        found.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    hit = found.get()
+    if hit is not None:
+        _remember(cfg, "record", hit[0], [{"mac": mac_lower, "ip": hit[1]}])
+    return hit
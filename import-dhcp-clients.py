@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+import-dhcp-clients.py :
+Importe en masse des réservations DHCP depuis un fichier CSV ou JSONL
+Chaque serveur ne reçoit qu'un seul lot : une lecture, une écriture
+et un redémarrage de dnsmasq, quel que soit le nombre de lignes
+"""
+
+import sys
+import json
+import time
+import getpass
+import argparse
+from os.path import dirname, abspath, join, expanduser
+
+# 1. Déduire PROJECT_DIR
+PROJECT_DIR = dirname(dirname(abspath(__file__)))
+
+# 2. Ajouter src/ au PYTHONPATH
+SRC_DIR = join(PROJECT_DIR, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+# 3. Importer inventory, config et dhcp
+from inventory  import guess_format, read_rows, check_rows
+from config     import load_config, get_dhcp_servers
+from dhcp       import dhcp_add_many, needs_passphrase
+import metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="import-dhcp-clients",
+        description="Import DHCP reservations from a CSV (MAC,IP) or JSONL file")
+    parser.add_argument("file", help="CSV or JSONL file")
+    parser.add_argument("--format", choices=["csv", "jsonl"],
+                        help="file format (default: guessed from the extension)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="show what would change without modifying anything")
+    parser.add_argument("--report", help="write the per-row report to this JSONL file")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each phase and print a summary")
+    args = parser.parse_args()
+    if args.profile:
+        metrics.enable()
+
+    fmt = guess_format(args.file, args.format)
+
+    # 4. Charger le YAML
+    config_path = join(PROJECT_DIR, "superviseur.yaml")
+    try:
+        cfg = load_config(config_path, create=False)
+    except SystemExit:
+        sys.exit(1)
+
+    # 5. Lire le fichier d'import
+    try:
+        rows = read_rows(args.file, fmt)
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    start = time.monotonic()
+
+    # 6. Valider chaque ligne
+    # report[i] = résultat de la i-ème ligne du fichier, valid = indices des lignes valides
+    report, valid = check_rows(rows)
+
+    # 7. Ranger les lignes valides par serveur (une seule recherche groupée)
+    by_server = {}        # serveur -> liste d'indices dans report
+    servers_info = get_dhcp_servers([report[i]["ip"] for i in valid], cfg)
+    for i, server_info in zip(valid, servers_info):
+        if server_info is None:
+            report[i]["status"] = "error"
+            report[i]["error"] = "unable to identify DHCP server"
+            continue
+
+        report[i]["server"] = server_info[0]
+        by_server.setdefault(server_info[0], []).append(i)
+
+    # 8. Demander la passphrase SSH une seule fois (sauf si ssh-agent ou clé non chiffrée)
+    key_file   = expanduser("~/.ssh/dhcp_superv_key")
+    passphrase = None
+    if by_server and needs_passphrase(key_file):
+        passphrase = getpass.getpass(prompt="Passphrase for SSH key (enter if none): ") or None
+
+    # 9. Un seul lot par serveur
+    for server, indices in by_server.items():
+        entries = [(report[i]["mac"], report[i]["ip"]) for i in indices]
+        results = dhcp_add_many(entries, server, cfg, key_filename=key_file,
+                                passphrase=passphrase, dry_run=args.dry_run)
+
+        for n, i in enumerate(indices):
+            row = report[i]
+            if results is None:
+                row["status"] = "error"
+                row["error"] = f"server {server} failed"
+                continue
+            row["status"] = results[n]["status"]
+            if row["status"] == "conflict":
+                row["error"] = f"IP address already in use by {results[n]['owner']}"
+
+    elapsed = time.monotonic() - start
+
+    # 10. Rapport ligne par ligne
+    counts = {}
+    for row in report:
+        counts[row["status"]] = counts.get(row["status"], 0) + 1
+        if row["status"] in ("error", "conflict"):
+            print(f"line {row['line']}: {row['mac']} {row['ip']}: {row['error']}", file=sys.stderr)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            for row in report:
+                f.write(json.dumps(row) + "\n")
+
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    prefix = "Dry run: " if args.dry_run else ""
+    print(f"{prefix}{len(report)} rows on {len(by_server)} server(s) in {elapsed:.2f}s: {summary or 'nothing to do'}")
+
+    if counts.get("error") or counts.get("conflict"):
+        sys.exit(1)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
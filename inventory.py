@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+inventory.py :
+Lecture et vérification des fichiers de réservations (CSV ou JSONL)
+utilisés par import-dhcp-clients.py et sync-dhcp.py
+Ne dépend que de la bibliothèque standard (et de validation.py, reservations.py)
+"""
+
+import csv
+import json
+
+from validation import validate_macs, validate_ips
+from reservations import ReservationTable
+
+
+def guess_format(path, fmt=None):
+    """
+    Format du fichier : celui demandé, sinon d'après l'extension
+    """
+    if fmt is not None:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".json")) else "csv"
+
+
+def read_rows(path, fmt):
+    """
+    Lit le fichier et retourne une liste de (numéro de ligne, mac, ip)
+    CSV : deux colonnes MAC,IP (ligne d'en-tête facultative)
+    JSONL : un objet {"mac": "...", "ip": "..."} par ligne
+    """
+    rows = []
+
+    with open(path, newline="") as f:
+        if fmt == "jsonl":
+            for number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    obj = json.loads(line)
+                    rows.append((number, str(obj.get("mac", "")), str(obj.get("ip", ""))))
+                except (ValueError, AttributeError):
+                    # Ligne illisible : elle sera rejetée à la validation
+                    rows.append((number, line, ""))
+        else:
+            for number, fields in enumerate(csv.reader(f), start=1):
+                if not fields or not "".join(fields).strip():
+                    continue
+                # Ligne d'en-tête (ex : "mac,ip")
+                if number == 1 and fields[0].strip().lower() == "mac":
+                    continue
+                mac = fields[0].strip()
+                ip = fields[1].strip() if len(fields) > 1 else ""
+                rows.append((number, mac, ip))
+
+    return rows
+
+
+def check_rows(rows):
+    """
+    Valide les lignes lues par read_rows
+    Retourne (rapport, valides) : une ligne de rapport par ligne du fichier
+    ({"line", "mac", "ip", "server"}, plus "status" et "error" si elle est
+    refusée) et les indices dans le rapport des lignes valides
+    Une MAC ou une IP déjà présente plus haut dans le fichier est refusée
+    """
+    # Les colonnes MAC et IP sont validées chacune en un seul appel
+    mac_ok, macs = validate_macs([mac for _, mac, _ in rows])
+    ip_ok, ips = validate_ips([ip for _, _, ip in rows])
+
+    report = []
+    valid = []
+    accepted = ReservationTable()  # lignes déjà acceptées (doublons dans le fichier)
+
+    for n, (number, mac_input, ip_input) in enumerate(rows):
+        row = {"line": number, "mac": mac_input, "ip": ip_input, "server": None}
+        report.append(row)
+
+        if not mac_ok[n]:
+            row["status"] = "error"
+            row["error"] = "bad MAC address"
+            continue
+        if not ip_ok[n]:
+            row["status"] = "error"
+            row["error"] = "bad IP address"
+            continue
+
+        mac, ip = macs[n], ips[n]
+        row["mac"], row["ip"] = mac, ip
+
+        if mac in accepted:
+            row["status"] = "error"
+            row["error"] = f"duplicate MAC (already imported with {accepted.ip_of(mac)})"
+            continue
+        if accepted.macs_of(ip):
+            row["status"] = "error"
+            row["error"] = f"duplicate IP (already imported for {accepted.macs_of(ip)[0]})"
+            continue
+        accepted.upsert(mac, ip)
+        valid.append(len(report) - 1)
+
+    return report, valid
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+journal-dhcp.py :
+Affiche le journal local des modifications (qui a changé quoi, quand,
+depuis où), le donne en JSONL à un miroir à partir d'un numéro, ou
+reconstruit l'état d'un serveur en le rejouant (CSV MAC,IP à passer à
+sync-dhcp.py pour remettre un serveur perdu en état)
+Le journal ne contient que les modifications faites par le superviseur
+depuis sa mise en place (attention : sync-dhcp.py supprime toutes les
+réservations absentes du CSV)
+Ne lit que des fichiers locaux : ni démon, ni connexion SSH
+"""
+
+import sys
+import json
+import time
+import argparse
+from os.path import dirname, abspath, join
+
+# 1. Déduire PROJECT_DIR
+PROJECT_DIR = dirname(dirname(abspath(__file__)))
+
+# 2. Ajouter src/ au PYTHONPATH
+SRC_DIR = join(PROJECT_DIR, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+# 3. Importer la configuration et le journal
+from config     import load_config, get_dhcp_server
+from validation import validate_mac
+from journal    import get_journal, ResyncRequired
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="journal-dhcp",
+        description="Show the local journal of DHCP reservation changes, "
+                    "or replay it to rebuild the reservations of a server.")
+    parser.add_argument("serveur", nargs="?",
+                        help="only this server IP or network (default: all servers)")
+    parser.add_argument("--since", type=int, default=0, metavar="SEQ",
+                        help="only entries after this sequence number")
+    parser.add_argument("--mac", help="only entries for this MAC address")
+    parser.add_argument("--json", action="store_true",
+                        help="one JSON entry per line (for mirrors and scripts)")
+    parser.add_argument("--replay", action="store_true",
+                        help="print the reservations of the server rebuilt from the journal "
+                             "(CSV MAC,IP, usable with sync-dhcp.py)")
+    parser.add_argument("--compact", action="store_true",
+                        help="keep only the last entry of each MAC of each server")
+    return parser.parse_args()
+
+
+def entry_line(entry):
+    """
+    Ligne affichée pour une entrée du journal
+    """
+    date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["time"]))
+    change = f"{entry['status']:<7} {entry['mac']} {entry['ip']}"
+    if entry["status"] == "updated":
+        change += f" (was {entry['previous']})"
+    return (f"#{entry['seq']:<6} {date}  {entry['server']:<15} {change}  "
+            f"by {entry['user']}@{entry['host']} ({entry['program']})  "
+            f"{entry['before'][:12]} -> {entry['sha256'][:12]}")
+
+
+def main():
+    args = parse_args()
+
+    config_path = join(PROJECT_DIR, "superviseur.yaml")
+    cfg = load_config(config_path, create=False)
+    journal = get_journal(cfg)
+
+    # 4. --compact : tout le journal, sans filtre
+    if args.compact:
+        before, after = journal.compact()
+        print(f"Compacted journal: {before} entries -> {after}")
+        return
+
+    # 5. Serveur : IP d'un serveur de la config, ou IP/réseau qu'il gère
+    server = None
+    if args.serveur:
+        if args.serveur in cfg["dhcp-servers"]:
+            server = args.serveur
+        else:
+            server_info = get_dhcp_server(args.serveur, cfg)
+            if server_info is None:
+                print("error: Unable to identify DHCP server", file=sys.stderr)
+                sys.exit(1)
+            server = server_info[0]
+
+    # 6. --replay : état du serveur d'après le journal
+    if args.replay:
+        if server is None or args.mac or args.since:
+            print("error: --replay needs a server, and no --mac or --since", file=sys.stderr)
+            sys.exit(1)
+        table, last, conflicts = journal.replay(server)
+        for entry in table.entries():
+            print(f"{entry['mac']},{entry['ip']}")
+        print(f"{len(table.entries())} reservation(s) from journal entries up to #{last}", file=sys.stderr)
+        # Une entrée refusée : le journal ne suffit pas à reconstruire le serveur
+        for entry in conflicts:
+            print(f"error: entry #{entry['seq']}: {entry['mac']} {entry['ip']}: "
+                  f"IP address already in use in the replayed table", file=sys.stderr)
+        if conflicts:
+            sys.exit(1)
+        return
+
+    mac = None
+    if args.mac:
+        try:
+            mac = validate_mac(args.mac)
+        except ValueError:
+            print("error: Invalid MAC address format", file=sys.stderr)
+            sys.exit(1)
+
+    # 7. Entrées dans l'ordre des numéros
+    try:
+        entries = journal.read(args.since, server, mac)
+    except ResyncRequired as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+    for entry in entries:
+        if args.json:
+            print(json.dumps(entry))
+        else:
+            print(entry_line(entry))
+
+
+if __name__ == "__main__":
+    main()
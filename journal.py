@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+journal.py :
+Journal local des modifications faites sur les serveurs DHCP
+Chaque ajout, mise à jour ou suppression est ajouté à la fin du journal
+(une ligne JSON) avec un numéro de séquence croissant, l'empreinte SHA-256
+du fichier du serveur avant et après le lot, la date, l'utilisateur, la
+machine et le script qui l'ont faite : c'est la trace de qui a changé quoi
+Un cache ou un miroir se met à jour en relisant le journal depuis le
+dernier numéro qu'il a vu (read()), et un serveur perdu peut être
+reconstruit en rejouant tout ce qui le concerne (replay())
+Le journal est découpé en segments : au-delà de SEGMENT_SIZE octets, le
+segment courant est fermé ; au-delà de KEEP_SEGMENTS segments fermés, les
+plus anciens sont compactés (seule la dernière entrée de chaque MAC de
+chaque serveur est gardée, suppressions comprises). Rejouer le journal
+depuis le début donne donc le même état, mais sans le détail des étapes ;
+un miroir dont le dernier numéro est dans la partie compactée a perdu des
+étapes intermédiaires : read() lève ResyncRequired, il doit tout relire
+Ne dépend que de la bibliothèque standard (et de reservations.py)
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import socket
+import getpass
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from config import get_state_dir
+from reservations import ReservationTable
+
+
+# Taille (en octets) à partir de laquelle le segment courant est fermé
+SEGMENT_SIZE = 4 * 1024 * 1024
+
+# Segments fermés gardés en entier (les plus anciens sont compactés)
+KEEP_SEGMENTS = 16
+
+# Statuts de l'agent qui modifient le fichier
+CHANGES = ("added", "updated", "deleted")
+
+# Fichiers du répertoire du journal
+CURRENT = "current.jsonl"
+COMPACTED = "compacted.jsonl"
+SEGMENT_PREFIX = "segment-"
+
+# Taille des blocs lus depuis la fin d'un fichier pour trouver la dernière entrée
+TAIL_BLOCK = 64 * 1024
+
+
+class ResyncRequired(Exception):
+    """
+    Les entrées qui suivent since ont été compactées : il faut repartir
+    de zéro (since=0) ; horizon est le dernier numéro compacté
+    """
+
+    def __init__(self, since, horizon):
+        super().__init__(f"entries after #{since} were compacted (up to #{horizon}): full resync required")
+        self.since = since
+        self.horizon = horizon
+
+
+def _user():
+    try:
+        return getpass.getuser()
+    except (KeyError, OSError):
+        # Conteneur sans entrée dans /etc/passwd
+        return str(os.getuid())
+
+
+def _entries(f, since=0):
+    """
+    Entrées d'un fichier ouvert, de numéro supérieur à since
+    Une ligne coupée (arrêt brutal pendant une écriture) et l'en-tête de
+    la partie compactée sont ignorés
+    """
+    for line in f:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if "seq" in entry and entry["seq"] > since:
+            yield entry
+
+
+def _last_entry(path):
+    """
+    Dernière entrée lisible d'un fichier (None s'il n'y en a pas)
+    Seule la fin du fichier est lue
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        end = f.seek(0, os.SEEK_END)
+        block = TAIL_BLOCK
+        while True:
+            start = max(0, end - block)
+            f.seek(start)
+            lines = f.read(end - start).split(b"\n")
+            # La première ligne du bloc peut être incomplète
+            for line in reversed(lines if start == 0 else lines[1:]):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if "seq" in entry:
+                    return entry
+            if start == 0:
+                return None
+            block *= 2
+
+
+def _op(entry):
+    """
+    Opération upsert/delete qui refait une entrée
+    """
+    if entry["op"] == "upsert":
+        return {"op": "upsert", "mac": entry["mac"], "ip": entry["ip"]}
+    return {"op": "delete", "mac": entry["mac"]}
+
+
+class Journal:
+    """
+    Journal des modifications, partagé entre les processus (verrou sur fichier)
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.current = os.path.join(directory, CURRENT)
+        self.compacted = os.path.join(directory, COMPACTED)
+        self._lock = threading.Lock()
+        # Qui écrit : gardé dans chaque entrée
+        self.origin = {"user": _user(), "host": socket.gethostname(),
+                       "program": os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else "python"}
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, open(os.path.join(self.directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _segments(self):
+        """
+        Segments fermés, du plus ancien au plus récent : [(premier numéro, chemin)]
+        """
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(".jsonl"):
+                try:
+                    first = int(name[len(SEGMENT_PREFIX):-len(".jsonl")])
+                except ValueError:
+                    continue
+                segments.append((first, os.path.join(self.directory, name)))
+        return sorted(segments)
+
+    def _last_seq(self):
+        paths = [self.current] + [path for _, path in reversed(self._segments())] + [self.compacted]
+        for path in paths:
+            entry = _last_entry(path)
+            if entry is not None:
+                return entry["seq"]
+        return 0
+
+    def _horizon(self):
+        """
+        Dernier numéro fusionné dans la partie compactée (0 si rien n'est compacté)
+        Il est dans l'en-tête du fichier : remplacé en même temps que les entrées
+        """
+        try:
+            with open(self.compacted, "rb") as f:
+                return json.loads(f.readline()).get("horizon", 0)
+        except (OSError, ValueError, AttributeError):
+            return 0
+
+    def last_seq(self):
+        """
+        Numéro de la dernière entrée (0 si le journal est vide)
+        """
+        with self._locked():
+            return self._last_seq()
+
+    def record(self, server, ops, response):
+        """
+        Ajoute les modifications d'un lot que l'agent vient d'appliquer
+        (opérations et réponse de l'agent, un résultat par opération)
+        Retourne les entrées écrites
+        """
+        changes = [(op, result) for op, result in zip(ops, response["results"])
+                   if result["status"] in CHANGES]
+        if not changes:
+            return []
+
+        with self._locked():
+            seq = self._last_seq()
+            now = round(time.time(), 3)
+            entries = []
+            for op, result in changes:
+                seq += 1
+                entry = {"seq": seq, "time": now, "server": server, "op": op["op"],
+                         "mac": op["mac"], "status": result["status"],
+                         # Suppression : l'adresse retirée
+                         "ip": op["ip"] if op["op"] == "upsert" else result.get("previous"),
+                         "previous": result.get("previous"),
+                         "before": response["before"], "sha256": response["fingerprint"]["sha256"]}
+                entry.update(self.origin)
+                entries.append(entry)
+            data = "".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries).encode()
+
+            with open(self.current, "a+b") as f:
+                # Ligne coupée par un arrêt brutal : la nouvelle entrée commence sur sa propre ligne
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        data = b"\n" + data
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+
+            if size >= SEGMENT_SIZE:
+                self._rotate()
+                segments = self._segments()
+                if len(segments) > KEEP_SEGMENTS:
+                    self._compact([path for _, path in segments[:-KEEP_SEGMENTS]])
+        return entries
+
+    def _rotate(self):
+        """
+        Ferme le segment courant (il garde le numéro de sa première entrée dans son nom)
+        """
+        try:
+            with open(self.current, "rb") as f:
+                first = next(_entries(f), None)
+        except FileNotFoundError:
+            return
+        if first is None:
+            return
+        name = f"{SEGMENT_PREFIX}{first['seq']:012d}.jsonl"
+        os.replace(self.current, os.path.join(self.directory, name))
+
+    def _compact(self, paths):
+        """
+        Fusionne des segments fermés dans la partie compactée
+        Retourne le nombre d'entrées (avant, après)
+        """
+        latest = {}
+        total = 0
+        horizon = self._horizon()
+        for path in [self.compacted] + paths:
+            try:
+                with open(path, "rb") as f:
+                    for entry in _entries(f):
+                        total += 1
+                        latest[(entry["server"], entry["mac"])] = entry
+                        horizon = max(horizon, entry["seq"])
+            except FileNotFoundError:
+                pass
+
+        entries = sorted(latest.values(), key=lambda entry: entry["seq"])
+        fd, tmp_path = tempfile.mkstemp(prefix=".journal.", dir=self.directory)
+        with os.fdopen(fd, "w") as f:
+            f.write(json.dumps({"horizon": horizon}) + "\n")
+            for entry in entries:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.compacted)
+        # Un arrêt ici laisse des entrées en double : read() ne les donne qu'une fois
+        for path in paths:
+            os.unlink(path)
+        return total, len(entries)
+
+    def compact(self, keep=0):
+        """
+        Compacte tout sauf les keep derniers segments fermés
+        (keep=0 : ferme aussi le segment courant et compacte tout)
+        Retourne le nombre d'entrées (avant, après)
+        """
+        with self._locked():
+            if keep == 0:
+                self._rotate()
+            segments = self._segments()
+            return self._compact([path for _, path in segments[:len(segments) - keep]])
+
+    def read(self, since=0, server=None, mac=None):
+        """
+        Entrées de numéro supérieur à since, dans l'ordre
+        (seulement celles d'un serveur ou d'une MAC si demandé)
+        Lève ResyncRequired si since est dans la partie compactée
+        """
+        # Fichiers ouverts sous verrou : une rotation ou un compactage pendant
+        # la lecture ne change plus ce qu'on lit
+        with self._locked():
+            horizon = self._horizon()
+            if 0 < since < horizon:
+                raise ResyncRequired(since, horizon)
+            files = [(0, self.compacted)] + self._segments() + [(None, self.current)]
+            handles = []
+            for i, (_, path) in enumerate(files):
+                # Le fichier suivant commence avant since : rien à lire dans celui-ci
+                following = files[i + 1][0] if i + 1 < len(files) else None
+                if following is not None and following <= since + 1:
+                    continue
+                try:
+                    handles.append(open(path, "rb"))
+                except FileNotFoundError:
+                    pass
+        return self._read(handles, since, server, mac)
+
+    def _read(self, handles, since, server, mac):
+        last = since
+        try:
+            for f in handles:
+                for entry in _entries(f, last):
+                    last = entry["seq"]
+                    if server is not None and entry["server"] != server:
+                        continue
+                    if mac is not None and entry["mac"] != mac:
+                        continue
+                    yield entry
+        finally:
+            for f in handles:
+                f.close()
+
+    def replay(self, server, since=0, table=None):
+        """
+        Rejoue les modifications d'un serveur sur une table (vide par défaut)
+        Retourne (table, numéro de la dernière entrée rejouée, entrées
+        refusées par la table : IP déjà prise par une autre MAC)
+        Lève ResyncRequired si since est dans la partie compactée
+        """
+        table = ReservationTable() if table is None else table
+        last = since
+        entries = list(self.read(since, server))
+        conflicts = []
+        for entry, result in zip(entries, table.apply([_op(entry) for entry in entries])):
+            if result["status"] == "conflict":
+                conflicts.append(entry)
+        if entries:
+            last = entries[-1]["seq"]
+        return table, last, conflicts
+
+
+# Un seul journal par répertoire dans le processus
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def get_journal(cfg):
+    """
+    Retourne le journal des modifications du répertoire d'état de la configuration
+    """
+    directory = os.path.join(get_state_dir(cfg), "journal")
+    with _journals_lock:
+        if directory not in _journals:
+            _journals[directory] = Journal(directory)
+        return _journals[directory]
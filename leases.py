@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+leases.py :
+Baux DHCP en cours (fichier dnsmasq.leases de chaque serveur) et
+rapprochement avec les réservations
+Une ligne par bail : "expiration mac ip nom client-id" (expiration 0 : bail
+permanent, nom "*" : inconnu). Les lignes IPv6 et "duid" sont ignorées
+Ne dépend que de la bibliothèque standard
+"""
+
+import time
+from collections import namedtuple
+
+
+Lease = namedtuple("Lease", "expiry mac ip hostname client_id")
+
+
+def parse_leases(text, now=None):
+    """
+    Lit le contenu d'un fichier de baux et donne les baux IPv4 encore valables
+    (un bail expiré peut rester dans le fichier jusqu'à la prochaine écriture de dnsmasq)
+    """
+    now = time.time() if now is None else now
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 4 or "." not in fields[2]:
+            continue
+        try:
+            expiry = int(fields[0])
+        except ValueError:
+            continue
+        if expiry and expiry < now:
+            continue
+        hostname = None if fields[3] == "*" else fields[3]
+        client_id = fields[4] if len(fields) > 4 and fields[4] != "*" else None
+        yield Lease(expiry, fields[1].lower(), fields[2], hostname, client_id)
+
+
+def expiry_text(lease):
+    """
+    Date de fin d'un bail, pour l'affichage
+    """
+    if not lease.expiry:
+        return "never"
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(lease.expiry))
+
+
+class LeaseTable:
+    """
+    Baux en cours d'un serveur, indexés par MAC et par IP
+    (une MAC peut avoir plusieurs baux, une IP un seul)
+    """
+
+    def __init__(self, leases=()):
+        self.leases = []
+        self._by_mac = {}
+        self._by_ip = {}
+        for lease in leases:
+            self.leases.append(lease)
+            self._by_mac.setdefault(lease.mac, []).append(lease)
+            self._by_ip[lease.ip] = lease
+
+    @classmethod
+    def from_text(cls, text, now=None):
+        return cls(parse_leases(text, now))
+
+    def __len__(self):
+        return len(self.leases)
+
+    def leases_of(self, mac):
+        """
+        Baux d'une MAC ([] si elle n'en a aucun)
+        """
+        return self._by_mac.get(mac, [])
+
+    def lease_at(self, ip):
+        """
+        Bail d'une IP (None si elle n'est pas louée)
+        """
+        return self._by_ip.get(ip)
+
+    def lease_for(self, mac, ip):
+        """
+        Pour une réservation mac -> ip : le bail de la MAC sur cette IP,
+        sinon son premier bail sur une autre IP, sinon None
+        """
+        leases = self._by_mac.get(mac)
+        if not leases:
+            return None
+        for lease in leases:
+            if lease.ip == ip:
+                return lease
+        return leases[0]
+
+    def conflicts(self, table):
+        """
+        Compare les baux aux réservations d'une table (CompactTable)
+        Retourne (autre_ip, ip_prise) :
+        autre_ip : [(mac, ip réservée, bail)] MAC réservée louée sur une autre IP
+        ip_prise : [(ip réservée, bail)] IP réservée louée à une MAC qui ne l'a pas réservée
+        """
+        other_ip = []
+        taken = []
+        seen = set()
+        for mac, ip in table.pairs():
+            lease = self.lease_for(mac, ip)
+            if lease is not None and lease.ip != ip:
+                other_ip.append((mac, ip, lease))
+
+            lease = self._by_ip.get(ip)
+            if lease is not None and lease.mac != mac and ip not in seen:
+                # Ligne partagée : le bail peut appartenir à une autre MAC de la ligne
+                if lease.mac not in table.macs_of(ip):
+                    taken.append((ip, lease))
+                seen.add(ip)
+        return other_ip, taken
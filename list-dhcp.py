@@ -3,7 +3,8 @@
 
 import sys
 import getpass
-from os.path import dirname, abspath, join, expanduser
+import argparse
+from os.path import dirname, abspath, join
 
 # 1. Déduire PROJECT_DIR
 PROJECT_DIR = dirname(dirname(abspath(__file__)))
@@ -13,65 +14,52 @@ SRC_DIR = join(PROJECT_DIR, "src")
 if SRC_DIR not in sys.path:
     sys.path.insert(0, SRC_DIR)
 
-# 3. Importer config et dhcp
-from config import load_config, get_dhcp_server
-from dhcp   import dhcp_list
+# 3. Importer le client du démon
+from client import daemon_request, print_events
+import metrics
 
-def print_usage():
-    print("Usage: list-dhcp [serveur]")
-    print("If no argument, lists all servers. Else, lists only for the given server.")
-    sys.exit(1)
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="list-dhcp",
+        description="If no argument, lists all servers. Else, lists only for the given server.")
+    parser.add_argument("serveur", nargs="?", help="server IP or network")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="number of servers queried at the same time (default: 8)")
+    parser.add_argument("-t", "--timeout", type=float,
+                        help="seconds before giving up on a server (default: 30)")
+    parser.add_argument("--offline", action="store_true",
+                        help="show the last known reservations without connecting")
+    parser.add_argument("--leases", action="store_true",
+                        help="show the active lease of each reserved MAC")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each phase and print a summary (runs without the daemon)")
+    return parser.parse_args()
 
 def main():
     # 4. Gérer l’argument optionnel
-    target_arg = None
-    if len(sys.argv) == 2:
-        target_arg = sys.argv[1]
-    elif len(sys.argv) > 2:
-        print_usage()
+    args = parse_args()
+    if args.profile:
+        metrics.enable()
+    params = {"target": args.serveur, "jobs": args.jobs, "timeout": args.timeout,
+              "offline": args.offline, "leases": args.leases}
 
-    # 5. Charger le YAML
+    # 5. Passer par le démon s'il tourne, sinon tout faire ici
     config_path = join(PROJECT_DIR, "superviseur.yaml")
-    try:
-        cfg = load_config(config_path, create=False)
-    except SystemExit:
-        sys.exit(1)
+    events = daemon_request("list", params, config_path)
 
-    # 6. Construire la liste des serveurs à lister
-    servers_to_list = []
+    if events is None:
+        from service import Supervisor
 
-    if target_arg:
-        srv_info = get_dhcp_server(target_arg, cfg)
-        if srv_info is None:
-            if target_arg in cfg["dhcp-servers"]:
-                servers_to_list.append(target_arg)
-            else:
-                print("cannot identify DHCP server", file=sys.stderr)
-                sys.exit(1)
-        else:
-            servers_to_list.append(srv_info[0])
-    else:
-        servers_to_list = list(cfg["dhcp-servers"].keys())
+        # 6. La passphrase n'est demandée qu'une fois (sauf si ssh-agent ou clé non chiffrée)
+        supervisor = Supervisor(
+            config_path,
+            ask_passphrase=lambda: getpass.getpass(prompt="Passphrase for SSH key (enter if none): "))
 
-    # 7. Demander la passphrase SSH une seule fois
-    passphrase = getpass.getpass(prompt="Passphrase for SSH key (enter if none): ")
-    key_file   = expanduser("~/.ssh/dhcp_superv_key")
+        # 7. Serveurs interrogés en parallèle, affichés dans l'ordre de la config
+        events = supervisor.run("list", params)
 
-    # 8. Pour chaque serveur, récupérer et afficher les réservations
-    for srv in servers_to_list:
-        print(f"{srv}:")
-        try:
-            entries = dhcp_list(server=srv, cfg=cfg, key_filename=key_file, passphrase=passphrase)
-        except Exception as e:
-            print(f"Error connecting to {srv}: {e}", file=sys.stderr)
-            continue
-
-        max_mac_len = max((len(e["mac"]) for e in entries), default=0)
-        for e in entries:
-            m = e["mac"]
-            i = e["ip"]
-            print(f"{m.ljust(max_mac_len)}    {i}")
-        print()
+    # 8. Échecs partiels : les autres serveurs sont quand même affichés
+    sys.exit(print_events(events))
 
 if __name__ == "__main__":
     main()
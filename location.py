@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+location.py :
+Index local MAC -> serveur, pour savoir directement où se trouve une réservation
+Ce n'est qu'une indication : avant de supprimer, on vérifie sur le serveur
+que la réservation est toujours celle enregistrée ici
+"""
+
+import os
+import json
+import time
+import fcntl
+import tempfile
+import threading
+
+from config import get_state_dir
+
+
+class LocationIndex:
+    """
+    Index MAC -> {"server": ..., "ip": ..., "seen": date} stocké en JSON
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = self._read()
+
+    def _read(self):
+        """
+        Lit le fichier de l'index (vide s'il n'existe pas ou est illisible)
+        """
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _update(self, change):
+        """
+        Applique une modification et l'enregistre sur disque
+        Le fichier est relu sous verrou : on ne perd pas les modifications
+        faites entre-temps par un autre processus
+        """
+        with self._lock, open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            entries = self._read()
+            change(entries)
+
+            directory = os.path.dirname(self.path)
+            fd, tmp_path = tempfile.mkstemp(prefix=".location.", dir=directory)
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+
+            self._entries = entries
+
+    def lookup(self, mac):
+        """
+        Retourne (serveur, ip) connus pour la MAC, ou None
+        """
+        entry = self._entries.get(mac.lower())
+        if entry is None:
+            return None
+        return entry["server"], entry["ip"]
+
+    def record(self, server, entries):
+        """
+        Enregistre des réservations [{"mac": ..., "ip": ...}] vues sur un serveur
+        """
+        now = int(time.time())
+
+        def change(index):
+            for entry in entries:
+                index[entry["mac"]] = {"server": server, "ip": entry["ip"], "seen": now}
+
+        self._update(change)
+
+    def record_server(self, server, entries):
+        """
+        Remplace tout ce qu'on sait d'un serveur par sa liste complète
+        """
+        now = int(time.time())
+
+        def change(index):
+            for mac in [mac for mac, entry in index.items() if entry["server"] == server]:
+                del index[mac]
+            for entry in entries:
+                index[entry["mac"]] = {"server": server, "ip": entry["ip"], "seen": now}
+
+        self._update(change)
+
+    def forget(self, mac, server=None):
+        """
+        Oublie la MAC (seulement si elle est rattachée à server, s'il est fourni)
+        """
+        def change(index):
+            entry = index.get(mac.lower())
+            if entry is not None and server in (None, entry["server"]):
+                del index[mac.lower()]
+
+        self._update(change)
+
+
+# Un seul index par fichier dans le processus
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_location_index(cfg):
+    """
+    Retourne l'index des MACs du répertoire d'état de la configuration
+    """
+    path = os.path.join(get_state_dir(cfg), "locations.json")
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = LocationIndex(path)
+        return _indexes[path]
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+metrics.py :
+Mesure du temps passé dans chaque phase d'une opération (lecture de la
+configuration, déchiffrement de la clé, connexion SSH, appel de l'agent,
+écriture du fichier et redémarrage de dnsmasq sur le serveur...) et
+compteurs (sessions, commandes, octets), avec la classe des erreurs
+Activé par SUPERVISEUR_PROFILE=1 ou l'option --profile des scripts :
+résumé sur stderr à la fin du processus, et export JSON ou Prometheus
+(fichier texte) si SUPERVISEUR_PROFILE_OUTPUT donne un chemin
+Désactivé, span() et count() ne coûtent qu'un test
+Ne dépend que de la bibliothèque standard
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import tempfile
+import threading
+
+
+# Variables d'environnement
+PROFILE_ENV = "SUPERVISEUR_PROFILE"
+OUTPUT_ENV = "SUPERVISEUR_PROFILE_OUTPUT"
+
+# Préfixe des métriques Prometheus
+PROMETHEUS_PREFIX = "superviseur_dhcp"
+
+_enabled = False
+_lock = threading.Lock()
+# nom -> [nombre, durée totale, durée maximale, {classe d'erreur: nombre}]
+_spans = {}
+# nom -> valeur
+_counters = {}
+_reporting = False
+
+
+class _NoSpan:
+    """
+    Mesure désactivée : ne fait rien
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # GeneratorExit, KeyboardInterrupt... ne sont pas des erreurs de l'opération
+        if exc_type is not None and not issubclass(exc_type, Exception):
+            exc_type = None
+        record(self.name, time.perf_counter() - self.start, exc_type)
+        return False
+
+
+def enabled():
+    return _enabled
+
+
+def enable(report=True):
+    """
+    Active les mesures ; avec report=True, le résumé est affiché (et
+    exporté si SUPERVISEUR_PROFILE_OUTPUT est défini) à la fin du processus
+    """
+    global _enabled, _reporting
+    _enabled = True
+    if report and not _reporting:
+        _reporting = True
+        atexit.register(_report_at_exit)
+
+
+def span(name):
+    """
+    Mesure la durée d'un bloc : with metrics.span("ssh.connect"): ...
+    Une exception qui sort du bloc est comptée par classe
+    """
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(name)
+
+
+def record(name, duration, error=None):
+    """
+    Ajoute une durée mesurée ailleurs (ex : renvoyée par l'agent)
+    """
+    if not _enabled:
+        return
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            stats = _spans[name] = [0, 0.0, 0.0, {}]
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+        if error is not None:
+            errors = stats[3]
+            errors[error.__name__] = errors.get(error.__name__, 0) + 1
+
+
+def count(name, value=1):
+    """
+    Incrémente un compteur (connexions, commandes, octets...)
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def snapshot():
+    """
+    Retourne {"spans": {nom: {"count", "total", "max", "errors"}}, "counters": {nom: valeur}}
+    """
+    with _lock:
+        spans = {name: {"count": n, "total": total, "max": longest, "errors": dict(errors)}
+                 for name, (n, total, longest, errors) in _spans.items()}
+        return {"spans": spans, "counters": dict(_counters)}
+
+
+def summary_lines(data=None):
+    """
+    Tableau des mesures (phases les plus longues en premier)
+    """
+    data = snapshot() if data is None else data
+    spans = sorted(data["spans"].items(), key=lambda item: -item[1]["total"])
+    width = max([len(name) for name in data["spans"]] + [len(name) for name in data["counters"]] + [5])
+
+    yield f"{'phase'.ljust(width)}  {'count':>7}  {'total':>10}  {'mean':>10}  {'max':>10}  errors"
+    for name, stats in spans:
+        errors = ", ".join(f"{cls} x{n}" for cls, n in sorted(stats["errors"].items()))
+        yield (f"{name.ljust(width)}  {stats['count']:>7}  {stats['total'] * 1000:>8.1f}ms  "
+               f"{stats['total'] / stats['count'] * 1000:>8.1f}ms  {stats['max'] * 1000:>8.1f}ms  {errors}")
+    for name, value in sorted(data["counters"].items()):
+        yield f"{name.ljust(width)}  {value:>7}"
+
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_text(data=None):
+    """
+    Mesures au format texte de Prometheus (collecteur textfile de node_exporter)
+    """
+    data = snapshot() if data is None else data
+    p = PROMETHEUS_PREFIX
+    lines = [f"# TYPE {p}_span_seconds_total counter",
+             f"# TYPE {p}_span_count_total counter",
+             f"# TYPE {p}_span_seconds_max gauge",
+             f"# TYPE {p}_span_errors_total counter"]
+    for name, stats in sorted(data["spans"].items()):
+        label = f'span="{name}"'
+        lines.append(f"{p}_span_seconds_total{{{label}}} {stats['total']:.6f}")
+        lines.append(f"{p}_span_count_total{{{label}}} {stats['count']}")
+        lines.append(f"{p}_span_seconds_max{{{label}}} {stats['max']:.6f}")
+        for cls, n in sorted(stats["errors"].items()):
+            lines.append(f'{p}_span_errors_total{{{label},error="{cls}"}} {n}')
+    for name, value in sorted(data["counters"].items()):
+        metric = f"{p}_{_metric_name(name)}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def export(path, data=None):
+    """
+    Écrit les mesures dans un fichier : JSON si le nom finit par .json,
+    sinon texte Prometheus (écriture atomique, lisible à tout moment par le collecteur)
+    """
+    data = snapshot() if data is None else data
+    if path.endswith(".json"):
+        text = json.dumps(data, indent=2) + "\n"
+    else:
+        text = prometheus_text(data)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".metrics.", dir=directory)
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def _report_at_exit():
+    data = snapshot()
+    if not data["spans"] and not data["counters"]:
+        return
+    print("", file=sys.stderr)
+    for line in summary_lines(data):
+        print(line, file=sys.stderr)
+
+    output = os.environ.get(OUTPUT_ENV)
+    if output:
+        try:
+            export(output, data)
+        except OSError as e:
+            print(f"error: cannot write metrics to {output}: {e}", file=sys.stderr)
+
+
+# SUPERVISEUR_PROFILE=1 : actif dès l'import, dans tous les processus (scripts et démon)
+if os.environ.get(PROFILE_ENV):
+    enable()
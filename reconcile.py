@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+reconcile.py :
+Calcul de l'écart entre l'état désiré (un inventaire MAC -> IP) et la
+table de réservations d'un serveur, et des opérations qui le comblent
+Seules les réservations par MAC sont gérées : les lignes par client-id
+ou par nom ne sont ni comptées ni supprimées
+"""
+
+from reservations import mac_to_int
+
+
+def _is_mac(owner):
+    try:
+        mac_to_int(owner)
+    except ValueError:
+        return False
+    return True
+
+
+def plan_changes(table, desired):
+    """
+    Compare la table d'un serveur (CompactTable) aux réservations désirées
+    ({mac: ip}) et retourne le plus petit ensemble de changements :
+    {"add": [(mac, ip)], "update": [(mac, ips actuelles, ip)], "delete": [(mac, ips actuelles)]}
+    Une MAC réservée sur plusieurs lignes est mise à jour même si sa première
+    IP est la bonne (l'agent ne lui laisse qu'une ligne)
+    """
+    current = {}
+    for owner, ip in table.pairs():
+        if owner in current:
+            current[owner].append(ip)
+        elif _is_mac(owner):
+            current[owner] = [ip]
+
+    changes = {"add": [], "update": [], "delete": []}
+    for mac, ip in desired.items():
+        ips = current.get(mac)
+        if ips is None:
+            changes["add"].append((mac, ip))
+        elif ips != [ip]:
+            changes["update"].append((mac, ips, ip))
+
+    for mac, ips in current.items():
+        if mac not in desired:
+            changes["delete"].append((mac, ips))
+
+    return changes
+
+
+def count_changes(changes):
+    return sum(len(items) for items in changes.values())
+
+
+def change_ops(changes):
+    """
+    Opérations de l'agent (un seul lot) qui appliquent les changements
+    Les suppressions passent d'abord ; une MAC qui prend l'IP d'une autre
+    MAC déplacée attend que celle-ci soit partie. Dans un échange (A prend
+    l'IP de B et B celle de A), une des MAC est supprimée puis réajoutée
+    Les suppressions vérifient l'IP attendue : une réservation modifiée
+    entre le plan et l'écriture n'est pas supprimée (statut "mismatch")
+    """
+    ops = [{"op": "delete", "mac": mac, "ip": ips[0]} for mac, ips in changes["delete"]]
+
+    pending = dict(changes["add"])
+    held = {}      # MAC déplacée -> ses IPs actuelles
+    holder = {}    # IP actuelle -> MAC déplacée qui doit d'abord la libérer
+    for mac, ips, ip in changes["update"]:
+        pending[mac] = ip
+        held[mac] = ips
+        for old_ip in ips:
+            holder[old_ip] = mac
+
+    def free(mac):
+        for old_ip in held.pop(mac, ()):
+            if holder.get(old_ip) == mac:
+                del holder[old_ip]
+
+    state = {}     # MAC -> 1 (en attente d'une autre MAC) ou 2 (opération émise)
+    for start in pending:
+        stack = [start]
+        while stack:
+            mac = stack[-1]
+            if state.get(mac) == 2:
+                stack.pop()
+                continue
+            state[mac] = 1
+
+            blocker = holder.get(pending[mac])
+            if blocker is not None and blocker != mac:
+                if state.get(blocker) == 1:
+                    # Cycle : la MAC bloquante libère ses adresses et sera réajoutée
+                    ops.append({"op": "delete", "mac": blocker, "ip": held[blocker][0]})
+                    free(blocker)
+                else:
+                    stack.append(blocker)
+                continue
+
+            ops.append({"op": "upsert", "mac": mac, "ip": pending[mac]})
+            free(mac)
+            state[mac] = 2
+            stack.pop()
+
+    return ops
+
+
+def plan_lines(server, changes):
+    """
+    Lignes du plan d'un serveur (+ ajout, ~ mise à jour, - suppression)
+    """
+    if not count_changes(changes):
+        yield f"{server}: in sync"
+        return
+
+    yield (f"{server}: {len(changes['add'])} to add, {len(changes['update'])} to update, "
+           f"{len(changes['delete'])} to delete")
+    for mac, ip in changes["add"]:
+        yield f"  + {mac} {ip}"
+    for mac, ips, ip in changes["update"]:
+        yield f"  ~ {mac} {', '.join(ips)} -> {ip}"
+    for mac, ips in changes["delete"]:
+        yield f"  - {mac} {', '.join(ips)}"
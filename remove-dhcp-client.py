@@ -3,7 +3,7 @@
 
 import sys
 import getpass
-from os.path import dirname, abspath, join, expanduser
+from os.path import dirname, abspath, join
 
 # 1. Déduire PROJECT_DIR
 PROJECT_DIR = dirname(dirname(abspath(__file__)))
@@ -13,18 +13,23 @@ SRC_DIR = join(PROJECT_DIR, "src")
 if SRC_DIR not in sys.path:
     sys.path.insert(0, SRC_DIR)
 
-# 3. Importer validation, config et dhcp
+# 3. Importer validation et le client du démon
 from validation import validate_mac
-from config     import load_config
-from dhcp       import mac_exists, dhcp_remove
+from client     import daemon_request, print_events
+import metrics
 
 def print_usage():
-    print("Usage: remove-dhcp-client <MAC>")
+    print("Usage: remove-dhcp-client [--profile] <MAC>")
     print("Example: remove-dhcp-client 00:1a:2b:3c:4d:5e")
     sys.exit(1)
 
 def main():
-    # 4. Vérifier qu’on a exactement 1 argument (la MAC)
+    # 4. --profile : chaque phase est mesurée dans ce processus (sans le démon)
+    if "--profile" in sys.argv:
+        sys.argv.remove("--profile")
+        metrics.enable()
+
+    # Vérifier qu’on a exactement 1 argument (la MAC)
     if len(sys.argv) != 2:
         print_usage()
 
@@ -37,54 +42,24 @@ def main():
         print(f"error: {e}", file=sys.stderr)
         sys.exit(1)
 
-    # 6. Charger le YAML
+    # 6. Passer par le démon s'il tourne, sinon tout faire ici
     config_path = join(PROJECT_DIR, "superviseur.yaml")
-    try:
-        cfg = load_config(config_path, create=False)
-    except SystemExit:
-        sys.exit(1)
+    params = {"mac": mac}
+    events = daemon_request("remove", params, config_path)
 
-    # 7. Trouver le serveur qui possède cette MAC (on ne fait pas encore appel à mac_exists)
-    #    pour ne pas déclencher SSH avant de demander la passphrase.
-    target_server = None
-    for server_ip in cfg.get("dhcp-servers", {}).keys():
-        # on va juste tester la présence potentielle, mais l'appel SSH est ici
-        pass
-    # Pour déterminer le serveur, on devra demander la passphrase tout de suite.
+    if events is None:
+        from service import Supervisor
 
-    # 8. Demander la passphrase (pour SSH) une seule fois
-    passphrase = getpass.getpass(prompt="Passphrase for SSH key (enter if none): ")
-    key_file   = expanduser("~/.ssh/dhcp_superv_key")
+        # 7. La passphrase n'est demandée qu'une fois (sauf si ssh-agent ou clé non chiffrée)
+        supervisor = Supervisor(
+            config_path,
+            ask_passphrase=lambda: getpass.getpass(prompt="Passphrase for SSH key (enter if none): "))
 
-    # 9. Maintenant qu'on a la passphrase, rechercher le serveur avec mac_exists
-    for server_ip in cfg.get("dhcp-servers", {}).keys():
-        try:
-            if mac_exists(server_ip=server_ip, mac=mac, cfg=cfg,
-                          key_filename=key_file, passphrase=passphrase):
-                target_server = server_ip
-                break
-        except Exception as e:
-            # ignore les erreurs de connexion, on essaie le suivant
-            continue
+        # 8. L'index local indique peut-être directement le serveur ;
+        #    sinon tous les serveurs sont interrogés en parallèle
+        events = supervisor.run("remove", params)
 
-    if target_server is None:
-        print("MAC address not found", file=sys.stderr)
-        sys.exit(1)
-
-    # 10. Appeler dhcp_remove pour supprimer la MAC sur target_server
-    success = dhcp_remove(
-        mac=mac,
-        server=target_server,
-        cfg=cfg,
-        key_filename=key_file,
-        passphrase=passphrase
-    )
-
-    if success:
-        print(f"Removed DHCP reservation for {mac} on {target_server}")
-        sys.exit(0)
-    else:
-        sys.exit(1)
+    sys.exit(print_events(events))
 
 if __name__ == "__main__":
     main()
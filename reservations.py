@@ -0,0 +1,1041 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+reservations.py :
+Lecture de la syntaxe dnsmasq (dhcp-host complet) et table des
+réservations DHCP avec index MAC et IP
+Utilisée côté superviseur (cache, vérifications) et côté serveur par
+dhcp-agent.py : ce module ne dépend que de la bibliothèque standard
+ReservationTable sert à modifier un fichier ; CompactTable garde en lecture
+seule des millions de réservations en quelques dizaines de Mo
+"""
+
+import re
+import sys
+import json
+import socket
+import struct
+import operator
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import compress, islice
+
+
+# === SYNTAXE DNSMASQ ===
+
+# dhcp-host=[<MAC>...][,id:<client-id>|*][,set:<tag>][,tag:<tag>][,<IPv4>][,[<IPv6>]]
+#           [,<nom>][,<durée du bail>][,ignore]
+# Chaque champ est reconnu à sa forme ; un champ qui ne ressemble à rien de
+# connu est gardé tel quel ("extra") pour que la ligne soit réécrite sans perte
+_IPV4_FIELD = re.compile(r"(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])"
+                         r"(?:\.(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])){3}")
+# MAC avec type matériel facultatif (1-...) et jokers (*)
+_HWADDR_FIELD = re.compile(r"(?:[0-9]{1,3}-)?[0-9a-f*]{1,2}(?::[0-9a-f*]{1,2})+")
+_LEASE_FIELD = re.compile(r"infinite|[0-9]+[smhdw]?")
+_HOSTNAME_FIELD = re.compile(r"[a-z0-9_][a-z0-9_.-]*", re.IGNORECASE)
+
+# Cas le plus courant, reconnu d'un coup : dhcp-host=MAC,IP
+_SIMPLE_HOST = re.compile(r"dhcp-host=([0-9a-f]{2}(?::[0-9a-f]{2}){5}),(%s)" % _IPV4_FIELD.pattern)
+
+_SIMPLE_KINDS = ["mac", "ip"]
+
+# Commentaire en fin de ligne : # précédé d'un blanc
+_TRAILING_COMMENT = re.compile(r"\s#")
+
+
+def _field_kind(field):
+    """
+    Nature d'un champ de dhcp-host
+    """
+    lower = field.lower()
+    if lower.startswith("id:"):
+        return "id"
+    if lower.startswith(("set:", "net:")):
+        return "set"
+    if lower.startswith("tag:"):
+        return "tag"
+    if lower == "ignore":
+        return "ignore"
+    if field.startswith("[") and field.endswith("]"):
+        return "ipv6"
+    if _IPV4_FIELD.fullmatch(field):
+        return "ip"
+    if _HWADDR_FIELD.fullmatch(lower):
+        return "mac"
+    if _LEASE_FIELD.fullmatch(lower):
+        return "lease"
+    if _HOSTNAME_FIELD.fullmatch(field):
+        return "hostname"
+    return "extra"
+
+
+def _normal_hwaddr(field):
+    """
+    MAC d'un champ, en minuscules, sans le type matériel Ethernet (1-)
+    """
+    mac = field.lower()
+    if mac.startswith("1-"):
+        return mac[2:]
+    return mac
+
+
+class HostRecord:
+    """
+    Une ligne dhcp-host analysée
+    fields garde tous les champs dans l'ordre du fichier, kinds leur nature ;
+    les attributs (macs, ip, hostname...) en sont déduits
+    """
+
+    __slots__ = ("fields", "kinds", "comment")
+
+    def __init__(self, fields, comment=""):
+        self.fields = fields
+        self.kinds = [_field_kind(field) for field in fields]
+        self.comment = comment
+
+    @classmethod
+    def reservation(cls, mac, ip):
+        """
+        Ligne dhcp-host=MAC,IP
+        """
+        record = cls.__new__(cls)
+        record.fields = [mac, ip]
+        record.kinds = ["mac", "ip"]
+        record.comment = ""
+        return record
+
+    def _simple(self):
+        # dhcp-host=MAC,IP : pas besoin de parcourir les champs
+        return self.kinds == _SIMPLE_KINDS
+
+    def _all(self, kind):
+        return [field for field, k in zip(self.fields, self.kinds) if k == kind]
+
+    def _first(self, kind):
+        for field, k in zip(self.fields, self.kinds):
+            if k == kind:
+                return field
+        return None
+
+    @property
+    def macs(self):
+        if self._simple():
+            return [self.fields[0]]
+        return [_normal_hwaddr(field) for field in self._all("mac")]
+
+    @property
+    def ip(self):
+        if self._simple():
+            return self.fields[1]
+        return self._first("ip")
+
+    @property
+    def ipv6(self):
+        return [field[1:-1] for field in self._all("ipv6")]
+
+    @property
+    def client_id(self):
+        field = self._first("id")
+        return None if field is None else field[3:]
+
+    @property
+    def hostname(self):
+        return self._first("hostname")
+
+    @property
+    def lease(self):
+        return self._first("lease")
+
+    @property
+    def set_tags(self):
+        return [field[4:] for field in self._all("set")]
+
+    @property
+    def match_tags(self):
+        return [field[4:] for field in self._all("tag")]
+
+    @property
+    def ignore(self):
+        return "ignore" in self.kinds
+
+    @property
+    def extra(self):
+        return self._all("extra")
+
+    def owners(self):
+        """
+        À qui la ligne réserve son IP : les MACs, sinon le client-id (id:...),
+        sinon le nom
+        """
+        macs = self.macs
+        if macs:
+            return macs
+        for kind in ("id", "hostname"):
+            field = self._first(kind)
+            if field is not None:
+                return [field.lower() if kind == "id" else field]
+        return []
+
+    def reservations(self):
+        """
+        Donne (propriétaire, ip) pour chaque propriétaire si la ligne réserve une IPv4
+        """
+        if self._simple():
+            yield self.fields[0], self.fields[1]
+            return
+        ip = self.ip
+        if ip is not None and not self.ignore:
+            for owner in self.owners():
+                yield owner, ip
+
+    def set_ip(self, ip):
+        """
+        Remplace l'IPv4 de la ligne (ou l'ajoute après les MACs, client-id et tags)
+        """
+        if "ip" in self.kinds:
+            self.fields[self.kinds.index("ip")] = ip
+            return
+        position = 0
+        for number, kind in enumerate(self.kinds):
+            if kind in ("mac", "id", "set", "tag"):
+                position = number + 1
+        self.fields.insert(position, ip)
+        self.kinds.insert(position, "ip")
+
+    def remove_mac(self, mac):
+        """
+        Retire une MAC de la ligne
+        """
+        for number, (field, kind) in enumerate(zip(self.fields, self.kinds)):
+            if kind == "mac" and _normal_hwaddr(field) == mac:
+                del self.fields[number]
+                del self.kinds[number]
+                return
+
+    def render(self):
+        line = "dhcp-host=" + ",".join(self.fields)
+        if self.comment:
+            line += " " + self.comment
+        return line
+
+
+def parse_config_line(line):
+    """
+    Découpe une ligne de configuration dnsmasq en (option, valeur, commentaire)
+    Retourne None pour une ligne vide ou un commentaire
+    """
+    text = line.strip()
+    if not text or text.startswith("#"):
+        return None
+
+    comment = ""
+    match = _TRAILING_COMMENT.search(text)
+    if match is not None:
+        text, comment = text[:match.start()].rstrip(), text[match.start():].strip()
+
+    option, _, value = text.partition("=")
+    return option.strip(), value.strip(), comment
+
+
+def iter_config(lines, include=None, _parents=()):
+    """
+    Parcourt des lignes de configuration dnsmasq au fil de l'eau (mémoire constante)
+    Donne (ligne, HostRecord) pour chaque dhcp-host et (ligne, None) pour les autres
+    Avec include (fonction chemin -> lignes), les fichiers conf-file=... sont
+    parcourus à la suite de la ligne qui les inclut
+    """
+    for line in lines:
+        line = line.rstrip("\r\n")
+        simple = _SIMPLE_HOST.fullmatch(line)
+        if simple is not None:
+            yield line, HostRecord.reservation(simple[1], simple[2])
+            continue
+
+        parsed = parse_config_line(line)
+        if parsed is None:
+            yield line, None
+            continue
+
+        option, value, comment = parsed
+        if option == "dhcp-host":
+            yield line, HostRecord([field.strip() for field in value.split(",")], comment)
+            continue
+
+        yield line, None
+        if option == "conf-file" and include is not None:
+            if value in _parents:
+                raise ValueError(f"include loop on {value}")
+            yield from iter_config(include(value), include, _parents + (value,))
+
+
+def iter_host_records(lines, include=None):
+    """
+    Donne les lignes dhcp-host (HostRecord) de la configuration
+    """
+    for _, record in iter_config(lines, include):
+        if record is not None:
+            yield record
+
+
+def iter_reservations(lines, include=None):
+    """
+    Donne (propriétaire, ip) pour chaque réservation IPv4 de la configuration
+    """
+    for record in iter_host_records(lines, include):
+        yield from record.reservations()
+
+
+class ReservationTable:
+    """
+    Réservations dans l'ordre du fichier, indexées par MAC et par IP
+    Les lignes qui ne sont pas des dhcp-host (commentaires, autres options)
+    sont gardées pour pouvoir réécrire le fichier à l'identique
+    Une ligne peut réserver une IP pour plusieurs MACs (ou pour un client-id
+    ou un nom, faute de MAC) : chaque propriétaire compte comme une réservation
+    """
+
+    def __init__(self):
+        # Chaque case contient une ligne dhcp-host (HostRecord), une autre
+        # ligne du fichier (str) ou None si elle a été supprimée
+        self._slots = []
+        # Texte d'origine de chaque ligne dhcp-host lue (None si modifiée),
+        # pour ne pas réécrire différemment les lignes auxquelles on ne touche pas
+        self._raw = []
+        # propriétaire -> numéros de case, ip -> numéros de case (ordre du fichier)
+        self._by_mac = {}
+        self._by_ip = {}
+        self.changed = False
+        # True si une modification touche une ligne à plusieurs MACs ou sans IP :
+        # la rejouer sur la seule liste des réservations ne donne pas le même ordre
+        self.reshaped = False
+
+    @classmethod
+    def from_lines(cls, lines):
+        """
+        Construit la table à partir des lignes du fichier (lues au fil de l'eau)
+        """
+        table = cls()
+        for line, record in iter_config(lines):
+            if record is None:
+                table._slots.append(line)
+                table._raw.append(None)
+            else:
+                table._append(record, line)
+        return table
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        Construit la table à partir d'une liste [{"mac": ..., "ip": ...}]
+        """
+        table = cls()
+        for entry in entries:
+            table._append(HostRecord.reservation(entry["mac"], entry["ip"]))
+        return table
+
+    def _append(self, record, raw=None):
+        number = len(self._slots)
+        self._slots.append(record)
+        self._raw.append(raw)
+        if record.kinds == _SIMPLE_KINDS:
+            # Cas courant : dernière case, les index restent triés sans rien chercher
+            self._by_mac.setdefault(record.fields[0], []).append(number)
+            self._by_ip.setdefault(record.fields[1], []).append(number)
+        else:
+            self._index(number)
+
+    def _index(self, number):
+        record = self._slots[number]
+        for owner in record.owners():
+            insort(self._by_mac.setdefault(owner, []), number)
+        ip = record.ip
+        if ip is not None and not record.ignore:
+            insort(self._by_ip.setdefault(ip, []), number)
+
+    def _unindex(self, number):
+        record = self._slots[number]
+        keys = [(self._by_mac, owner) for owner in record.owners()]
+        if record.ip is not None and not record.ignore:
+            keys.append((self._by_ip, record.ip))
+        for index, key in keys:
+            numbers = index[key]
+            numbers.remove(number)
+            if not numbers:
+                del index[key]
+
+    def _drop_mac(self, number, mac):
+        """
+        Retire une MAC d'une ligne (la ligne disparaît si c'était sa seule MAC)
+        """
+        record = self._slots[number]
+        self._unindex(number)
+        self._raw[number] = None
+        if len(record.macs) <= 1:
+            self._slots[number] = None
+            return
+        record.remove_mac(mac)
+        self._index(number)
+
+    # === LECTURE ===
+
+    def __len__(self):
+        return sum(1 for _ in self.pairs())
+
+    def __contains__(self, mac):
+        return self.ip_of(mac) is not None
+
+    def records(self):
+        """
+        Donne les lignes dhcp-host (HostRecord), dans l'ordre du fichier
+        """
+        for slot in self._slots:
+            if isinstance(slot, HostRecord):
+                yield slot
+
+    def pairs(self):
+        """
+        Donne (mac, ip) pour chaque réservation, dans l'ordre du fichier
+        """
+        for record in self.records():
+            yield from record.reservations()
+
+    def entries(self):
+        """
+        Retourne toutes les réservations, dans l'ordre du fichier
+        """
+        return [{"mac": mac, "ip": ip} for mac, ip in self.pairs()]
+
+    def ip_of(self, mac):
+        """
+        Retourne l'IP réservée pour la MAC (ou None)
+        En cas de doublon, la première ligne fait foi
+        """
+        for number in self._by_mac.get(mac, ()):
+            record = self._slots[number]
+            if record.ip is not None and not record.ignore:
+                return record.ip
+        return None
+
+    def macs_of(self, ip):
+        """
+        Retourne les MACs qui ont une réservation sur l'IP
+        """
+        return [owner for number in self._by_ip.get(ip, ()) for owner in self._slots[number].owners()]
+
+    def other_owner(self, ip, mac):
+        """
+        Retourne une autre MAC qui utilise déjà l'IP (ou None)
+        """
+        for owner in self.macs_of(ip):
+            if owner != mac:
+                return owner
+        return None
+
+    def duplicate_macs(self):
+        """
+        Retourne {mac: [ips]} pour les MACs qui ont plusieurs réservations
+        """
+        duplicates = {}
+        for mac, numbers in self._by_mac.items():
+            ips = [ip for ip in (self._slots[n].ip for n in numbers if not self._slots[n].ignore)
+                   if ip is not None]
+            if len(ips) > 1:
+                duplicates[mac] = ips
+        return duplicates
+
+    def duplicate_ips(self):
+        """
+        Retourne {ip: [macs]} pour les IPs réservées pour plusieurs MACs
+        (y compris les MACs d'une même ligne : dnsmasq donne l'IP à la
+        première qui la demande)
+        """
+        duplicates = {}
+        for ip in self._by_ip:
+            macs = self.macs_of(ip)
+            if len(macs) > 1:
+                duplicates[ip] = macs
+        return duplicates
+
+    # === MODIFICATIONS ===
+
+    def upsert(self, mac, ip):
+        """
+        Ajoute ou met à jour la réservation de la MAC
+        Refuse si l'IP est déjà utilisée par une autre MAC
+        Une mise à jour garde la place et les autres champs (nom, bail, tags...)
+        de la première ligne et retire la MAC des autres lignes
+        """
+        owner = self.other_owner(ip, mac)
+        if owner is not None:
+            return {"status": "conflict", "owner": owner}
+
+        numbers = list(self._by_mac.get(mac, ()))
+        old_ip = self.ip_of(mac)
+        if old_ip == ip and len(numbers) == 1:
+            return {"status": "unchanged"}
+
+        if not numbers:
+            self._append(HostRecord.reservation(mac, ip))
+        else:
+            first = numbers[0]
+            for number in numbers[1:]:
+                self._drop_mac(number, mac)
+
+            record = self._slots[first]
+            if record.ip == ip and not record.ignore:
+                pass
+            elif len(record.macs) == 1 and not record.ignore:
+                # Ligne de cette seule MAC : on ne change que l'IP
+                if record.ip is None:
+                    self.reshaped = True
+                self._unindex(first)
+                record.set_ip(ip)
+                self._raw[first] = None
+                self._index(first)
+            else:
+                # Ligne partagée avec d'autres MACs : la MAC part sur sa propre ligne
+                self._drop_mac(first, mac)
+                self._append(HostRecord.reservation(mac, ip))
+                self.reshaped = True
+
+        self.changed = True
+        return {"status": "added" if old_ip is None else "updated", "previous": old_ip}
+
+    def delete(self, mac, expected_ip=None):
+        """
+        Retire la MAC de toutes ses lignes
+        Si expected_ip est fourni, ne supprime que si la MAC a bien cette IP
+        """
+        old_ip = self.ip_of(mac)
+        if old_ip is None:
+            return {"status": "not_found"}
+        if expected_ip is not None and old_ip != expected_ip:
+            return {"status": "mismatch", "current": old_ip}
+
+        for number in list(self._by_mac[mac]):
+            self._drop_mac(number, mac)
+        self.changed = True
+        return {"status": "deleted", "previous": old_ip}
+
+    def apply(self, ops):
+        """
+        Applique des opérations upsert/delete (format de dhcp-agent.py)
+        et retourne un résultat par opération
+        """
+        results = []
+        for op in ops:
+            if op["op"] == "upsert":
+                results.append(self.upsert(op["mac"], op["ip"]))
+            elif op["op"] == "delete":
+                results.append(self.delete(op["mac"], op.get("ip")))
+            else:
+                results.append({})
+        return results
+
+    def render_lines(self):
+        """
+        Donne les lignes du fichier correspondant à la table
+        """
+        for slot, raw in zip(self._slots, self._raw):
+            if raw is not None:
+                yield raw + "\n"
+            elif isinstance(slot, HostRecord):
+                yield slot.render() + "\n"
+            elif slot is not None:
+                yield slot + "\n"
+
+    def render(self):
+        """
+        Retourne le contenu du fichier correspondant à la table
+        """
+        return "".join(self.render_lines())
+
+
+# === STOCKAGE COMPACT ===
+
+_NORMAL_MAC_RE = re.compile(r"[0-9a-f]{2}(?::[0-9a-f]{2}){5}")
+
+# Valeur des MACs qui ne tiennent pas sur 48 bits (ligne gardée en texte)
+_NO_MAC = 0xFFFFFFFFFFFFFFFF
+
+# En-tête du format binaire : signature, nombre de lignes, taille du JSON des lignes irrégulières
+_HEADER = struct.Struct("<4sQQ")
+_MAGIC = b"RSV1"
+
+
+def mac_to_int(mac):
+    """
+    Convertit une MAC xx:xx:xx:xx:xx:xx (minuscules) en entier sur 48 bits
+    Lève ValueError pour toute autre forme
+    """
+    if _NORMAL_MAC_RE.fullmatch(mac) is None:
+        raise ValueError(f"bad MAC address {mac!r}")
+    return int(mac.replace(":", ""), 16)
+
+
+def int_to_mac(value):
+    """
+    Convertit un entier sur 48 bits en MAC xx:xx:xx:xx:xx:xx
+    """
+    h = f"{value:012x}"
+    return f"{h[0:2]}:{h[2:4]}:{h[4:6]}:{h[6:8]}:{h[8:10]}:{h[10:12]}"
+
+
+def ip_to_int(ip):
+    """
+    Convertit une IPv4 canonique en entier sur 32 bits
+    Lève ValueError pour toute autre forme
+    """
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except (OSError, TypeError):
+        raise ValueError(f"bad IP address {ip!r}")
+
+
+def int_to_ip(value):
+    """
+    Convertit un entier sur 32 bits en IPv4
+    """
+    return socket.inet_ntoa(value.to_bytes(4, "big"))
+
+
+def _little_endian(values):
+    """
+    Copie d'un tableau dans l'ordre d'octets du format binaire (petit-boutiste)
+    """
+    values = array(values.typecode, values)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class CompactTable:
+    """
+    Réservations en lecture seule, dans l'ordre du fichier, rangées dans
+    deux tableaux parallèles : MAC sur 48 bits (array "Q") et IPv4 sur 32 bits
+    (array "I"), soit 12 octets par réservation au lieu de plusieurs centaines
+    pour une liste de dictionnaires
+    Les index triés (recherche dichotomique, doublons) ne sont construits
+    qu'à la première utilisation, et les chaînes qu'à l'affichage
+    """
+
+    def __init__(self):
+        self.macs = array("Q")
+        self.ips = array("I")
+        # Lignes qui ne se convertissent pas en entiers : numéro -> (mac, ip) en texte
+        self._irregular = {}
+        # (clés triées, numéros de ligne correspondants), construits à la demande
+        self._mac_index = None
+        self._ip_index = None
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        Construit la table à partir d'une liste [{"mac": ..., "ip": ...}]
+        """
+        return cls.from_pairs((entry["mac"], entry["ip"]) for entry in entries)
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """
+        Construit la table à partir de couples (mac, ip), par exemple ceux
+        de iter_reservations() (lus au fil de l'eau)
+        """
+        table = cls()
+        macs, ips = table.macs, table.ips
+        for number, (mac_text, ip_text) in enumerate(pairs):
+            try:
+                mac = mac_to_int(mac_text)
+                ip = ip_to_int(ip_text)
+            except ValueError:
+                table._irregular[number] = (mac_text, ip_text)
+                mac, ip = _NO_MAC, 0
+            macs.append(mac)
+            ips.append(ip)
+        return table
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Relit une table écrite par to_bytes()
+        Lève ValueError si les données ne sont pas dans ce format
+        """
+        if len(data) < _HEADER.size:
+            raise ValueError("truncated reservation table")
+        magic, count, extra_size = _HEADER.unpack_from(data)
+        macs_end = _HEADER.size + 8 * count
+        ips_end = macs_end + 4 * count
+        if magic != _MAGIC or len(data) != ips_end + extra_size:
+            raise ValueError("not a reservation table")
+
+        table = cls()
+        table.macs.frombytes(data[_HEADER.size:macs_end])
+        table.ips.frombytes(data[macs_end:ips_end])
+        if sys.byteorder != "little":
+            table.macs.byteswap()
+            table.ips.byteswap()
+        if extra_size:
+            irregular = json.loads(data[ips_end:].decode())
+            table._irregular = {int(number): tuple(entry) for number, entry in irregular.items()}
+        return table
+
+    def to_bytes(self):
+        """
+        Format binaire de la table (pour le cache local)
+        """
+        extra = json.dumps(self._irregular).encode() if self._irregular else b""
+        return b"".join([_HEADER.pack(_MAGIC, len(self.macs), len(extra)),
+                         _little_endian(self.macs).tobytes(),
+                         _little_endian(self.ips).tobytes(),
+                         extra])
+
+    # === LECTURE ===
+
+    def __len__(self):
+        return len(self.macs)
+
+    def __contains__(self, mac):
+        return bool(self._mac_rows(mac))
+
+    def pairs(self):
+        """
+        Donne (mac, ip) en texte, dans l'ordre du fichier (conversion au fil de l'eau)
+        """
+        # Octets gros-boutistes : une MAC est alors 6 octets (bytes.hex), une IP 4 (inet_ntoa)
+        macs, ips = array("Q", self.macs), array("I", self.ips)
+        if sys.byteorder == "little":
+            macs.byteswap()
+            ips.byteswap()
+        macs, ips = macs.tobytes(), ips.tobytes()
+
+        irregular = self._irregular
+        ntoa = socket.inet_ntoa
+        for number in range(len(self.macs)):
+            if number in irregular:
+                yield irregular[number]
+            else:
+                yield macs[8 * number + 2:8 * number + 8].hex(":"), ntoa(ips[4 * number:4 * number + 4])
+
+    def entries(self):
+        """
+        Retourne toutes les réservations [{"mac": ..., "ip": ...}], dans l'ordre du fichier
+        """
+        return [{"mac": mac, "ip": ip} for mac, ip in self.pairs()]
+
+    def mac_width(self):
+        """
+        Largeur de la plus longue MAC (pour aligner l'affichage)
+        """
+        width = max((len(mac) for mac, _ in self._irregular.values()), default=0)
+        if len(self.macs) > len(self._irregular):
+            width = max(width, 17)
+        return width
+
+    def ip_numbers(self):
+        """
+        IPs réservées, en entiers (dont celles des lignes irrégulières qui se lisent)
+        """
+        if not self._irregular:
+            return self.ips
+        numbers = [ip for number, ip in enumerate(self.ips) if number not in self._irregular]
+        for _, ip in self._irregular.values():
+            try:
+                numbers.append(ip_to_int(ip))
+            except ValueError:
+                pass
+        return numbers
+
+    def _row(self, number):
+        if number in self._irregular:
+            return self._irregular[number]
+        return int_to_mac(self.macs[number]), int_to_ip(self.ips[number])
+
+    def _sorted_index(self, values):
+        """
+        Index trié d'une colonne : (clés triées, numéros de ligne)
+        Le tri est stable : à clé égale, les lignes restent dans l'ordre du fichier
+        """
+        regular = [n for n in range(len(values)) if n not in self._irregular] \
+            if self._irregular else range(len(values))
+        order = array("I", sorted(regular, key=values.__getitem__))
+        keys = array(values.typecode, map(values.__getitem__, order))
+        return keys, order
+
+    def _lookup(self, index, key):
+        keys, order = index
+        lo = bisect_left(keys, key)
+        hi = bisect_right(keys, key, lo)
+        return list(order[lo:hi])
+
+    def _mac_rows(self, mac):
+        """
+        Numéros des lignes de la MAC, dans l'ordre du fichier
+        """
+        rows = [n for n, (m, _) in self._irregular.items() if m == mac]
+        try:
+            key = mac_to_int(mac)
+        except ValueError:
+            return rows
+        if self._mac_index is None:
+            self._mac_index = self._sorted_index(self.macs)
+        return sorted(rows + self._lookup(self._mac_index, key))
+
+    def _ip_rows(self, ip):
+        rows = [n for n, (_, i) in self._irregular.items() if i == ip]
+        try:
+            key = ip_to_int(ip)
+        except ValueError:
+            return rows
+        if self._ip_index is None:
+            self._ip_index = self._sorted_index(self.ips)
+        return sorted(rows + self._lookup(self._ip_index, key))
+
+    def ip_of(self, mac):
+        """
+        Retourne l'IP réservée pour la MAC (ou None)
+        En cas de doublon, la première ligne fait foi
+        """
+        rows = self._mac_rows(mac)
+        return self._row(rows[0])[1] if rows else None
+
+    def macs_of(self, ip):
+        """
+        Retourne les MACs qui ont une réservation sur l'IP
+        """
+        return [self._row(n)[0] for n in self._ip_rows(ip)]
+
+    def _duplicates(self, values, index_name, column):
+        """
+        Regroupe les lignes de même valeur : {valeur: [numéros de ligne]}
+        pour les valeurs présentes sur plusieurs lignes, dans l'ordre des valeurs
+        """
+        if getattr(self, index_name) is None:
+            setattr(self, index_name, self._sorted_index(values))
+        keys, order = getattr(self, index_name)
+
+        # Positions où la clé est égale à la précédente : comparaison faite en C
+        same = compress(range(1, len(keys)), map(operator.eq, keys, islice(keys, 1, None)))
+
+        groups = {}
+        for position in same:
+            rows = groups.setdefault(keys[position], [order[position - 1]])
+            rows.append(order[position])
+
+        # Clés -> texte, puis lignes irrégulières (peu nombreuses) regroupées par texte
+        convert = int_to_mac if column == 0 else int_to_ip
+        duplicates = {convert(key): rows for key, rows in groups.items()}
+        if self._irregular:
+            by_text = {}
+            for number, row in self._irregular.items():
+                by_text.setdefault(row[column], []).append(number)
+            for text, numbers in by_text.items():
+                rows = self._mac_rows(text) if column == 0 else self._ip_rows(text)
+                if len(rows) > 1:
+                    duplicates[text] = rows
+        return duplicates
+
+    def duplicate_macs(self):
+        """
+        Retourne {mac: [ips]} pour les MACs qui ont plusieurs lignes
+        """
+        return {mac: [self._row(n)[1] for n in rows]
+                for mac, rows in self._duplicates(self.macs, "_mac_index", 0).items()}
+
+    def duplicate_ips(self):
+        """
+        Retourne {ip: [macs]} pour les IPs réservées par plusieurs lignes
+        """
+        return {ip: [self._row(n)[0] for n in rows]
+                for ip, rows in self._duplicates(self.ips, "_ip_index", 1).items()}
+
+
+# === RÉPERTOIRE dhcp-hostsdir ===
+
+# Dans un fichier de dhcp-hostsdir, chaque ligne est la valeur d'un
+# dhcp-host, sans "dhcp-host=" : dnsmasq lit les fichiers ajoutés ou modifiés
+# (inotify) sans redémarrer, mais ne retire une ligne qu'après un SIGHUP
+_HOST_PREFIX = "dhcp-host="
+
+# Fichier des lignes sans MAC (client-id ou nom seulement)
+SHARD_OTHER = "hosts-other.conf"
+
+
+def shard_name(owner):
+    """
+    Fichier du répertoire où va une nouvelle réservation : un par dernier
+    octet de la MAC (les premiers octets sont ceux du constructeur, souvent
+    les mêmes pour tout un parc)
+    """
+    if _NORMAL_MAC_RE.fullmatch(owner):
+        return f"hosts-{owner[-2:]}.conf"
+    return SHARD_OTHER
+
+
+def hostsfile_lines(lines):
+    """
+    Convertit les lignes d'un fichier de dhcp-hostsdir en lignes de configuration
+    (dhcp-host=...), chacune terminée par un retour à la ligne
+    """
+    for line in lines:
+        text = line.strip()
+        if text and not text.startswith("#"):
+            yield _HOST_PREFIX + text + "\n"
+        else:
+            yield line.rstrip("\r\n") + "\n"
+
+
+def hostsfile_render(lines):
+    """
+    Inverse de hostsfile_lines() : lignes d'un fichier de dhcp-hostsdir
+    """
+    for line in lines:
+        if line.startswith(_HOST_PREFIX):
+            yield line[len(_HOST_PREFIX):]
+        else:
+            yield line
+
+
+class ShardedTable:
+    """
+    Réservations réparties dans les fichiers d'un répertoire dhcp-hostsdir,
+    une ReservationTable par fichier, avec la même interface que ReservationTable
+    Les vérifications (IP déjà utilisée...) portent sur tout le répertoire
+    Une nouvelle réservation va dans le fichier de sa MAC (shard_name), une
+    réservation existante reste dans le sien ; l'ordre des réservations est
+    celui des fichiers (triés par nom) puis des lignes
+    Cet ordre n'a pas de sens pour dnsmasq (une MAC n'est que dans un
+    fichier) : une réservation ajoutée au milieu de la liste ne rend pas la
+    table "reshaped", le cache du superviseur garde les mêmes réservations
+    dans l'ordre où il les a ajoutées
+    """
+
+    def __init__(self, shards=None):
+        self.shards = dict(sorted((shards or {}).items()))
+        self._reshaped = False
+
+    @classmethod
+    def from_files(cls, files):
+        """
+        Construit la table à partir de {nom du fichier: lignes du fichier}
+        """
+        return cls({name: ReservationTable.from_lines(hostsfile_lines(lines))
+                    for name, lines in files.items()})
+
+    @property
+    def changed(self):
+        return any(table.changed for table in self.shards.values())
+
+    @property
+    def reshaped(self):
+        return self._reshaped or any(table.reshaped for table in self.shards.values())
+
+    def changed_shards(self):
+        """
+        Noms des fichiers à réécrire
+        """
+        return [name for name, table in self.shards.items() if table.changed]
+
+    def render_shard(self, name):
+        """
+        Retourne le contenu d'un fichier du répertoire
+        """
+        return "".join(hostsfile_render(self.shards[name].render_lines()))
+
+    def _holders(self, mac):
+        return [table for table in self.shards.values() if mac in table._by_mac]
+
+    # === LECTURE ===
+
+    def __len__(self):
+        return sum(len(table) for table in self.shards.values())
+
+    def __contains__(self, mac):
+        return self.ip_of(mac) is not None
+
+    def records(self):
+        for table in self.shards.values():
+            yield from table.records()
+
+    def pairs(self):
+        for table in self.shards.values():
+            yield from table.pairs()
+
+    def entries(self):
+        return [{"mac": mac, "ip": ip} for mac, ip in self.pairs()]
+
+    def ip_of(self, mac):
+        for table in self._holders(mac):
+            ip = table.ip_of(mac)
+            if ip is not None:
+                return ip
+        return None
+
+    def macs_of(self, ip):
+        return [mac for table in self.shards.values() for mac in table.macs_of(ip)]
+
+    def other_owner(self, ip, mac):
+        for owner in self.macs_of(ip):
+            if owner != mac:
+                return owner
+        return None
+
+    # === MODIFICATIONS ===
+
+    def upsert(self, mac, ip):
+        """
+        Comme ReservationTable.upsert(), sur tout le répertoire
+        """
+        owner = self.other_owner(ip, mac)
+        if owner is not None:
+            return {"status": "conflict", "owner": owner}
+
+        holders = self._holders(mac)
+        if not holders:
+            name = shard_name(mac)
+            if name not in self.shards:
+                self.shards[name] = ReservationTable()
+                self.shards = dict(sorted(self.shards.items()))
+            return self.shards[name].upsert(mac, ip)
+
+        # La première ligne de la MAC fait foi, elle est retirée des autres fichiers
+        old_ip = self.ip_of(mac)
+        for table in holders[1:]:
+            for number in list(table._by_mac[mac]):
+                table._drop_mac(number, mac)
+            table.changed = True
+            self._reshaped = True
+
+        result = holders[0].upsert(mac, ip)
+        if result["status"] == "unchanged" and len(holders) == 1:
+            return result
+        return {"status": "added" if old_ip is None else "updated", "previous": old_ip}
+
+    def delete(self, mac, expected_ip=None):
+        """
+        Comme ReservationTable.delete(), sur tout le répertoire
+        """
+        old_ip = self.ip_of(mac)
+        if old_ip is None:
+            return {"status": "not_found"}
+        if expected_ip is not None and old_ip != expected_ip:
+            return {"status": "mismatch", "current": old_ip}
+
+        for table in self._holders(mac):
+            for number in list(table._by_mac[mac]):
+                table._drop_mac(number, mac)
+            table.changed = True
+        return {"status": "deleted", "previous": old_ip}
+
+    # Même boucle que pour un seul fichier (upsert et delete ci-dessus)
+    apply = ReservationTable.apply
+
+    def render_lines(self):
+        """
+        Lignes de configuration (dhcp-host=...) de tous les fichiers, dans l'ordre
+        """
+        for table in self.shards.values():
+            yield from table.render_lines()
+
+    def render(self):
+        return "".join(self.render_lines())
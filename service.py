@@ -0,0 +1,695 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+service.py :
+Opérations du superviseur (ajout, suppression, liste, vérification,
+synchronisation) communes au mode direct des scripts et au démon (superviseur-daemon.py)
+Les opérations retournent des dictionnaires ; run() les traduit en
+lignes à afficher, exactement comme les scripts le faisaient
+"""
+
+import os
+import threading
+
+from config import (compile_config, config_error_lines, get_dhcp_server, get_dhcp_servers,
+                    nested_network_warnings)
+from dhcp import (add_reservation, remove_reservation, write_reservations, replace_reservations,
+                  get_reservations, get_leases, find_mac_server, fan_out, needs_passphrase, key_in_agent,
+                  load_private_key, AgentError)
+from cache import get_cache
+from location import get_location_index
+from allocation import build_allocator
+from reconcile import plan_changes, change_ops, count_changes, plan_lines
+from leases import expiry_text
+import metrics
+
+
+# Clé SSH du superviseur
+KEY_FILE = "~/.ssh/dhcp_superv_key"
+
+# Nombre maximal d'essais quand les adresses attribuées sont prises entre-temps
+MAX_ALLOCATION_ROUNDS = 5
+
+
+def _error_message(error, action):
+    """
+    Message d'erreur affiché pour une exception levée pendant une opération
+    """
+    if isinstance(error, AgentError):
+        return f"error: {action}: {error}"
+    return f"Erreur connexion: {error}"
+
+
+def _reload_message(response):
+    """
+    Quand et comment la modification est devenue active dans dnsmasq
+    (None si rien n'a changé)
+    """
+    mode = response.get("reload")
+    if not response["changed"] or not response["reloaded"] or mode is None:
+        return None
+    if mode == "inotify":
+        return "Active now (read by dnsmasq without reload)"
+    how = "restart" if mode == "restart" else "SIGHUP"
+    text = f"Active after {response['reload_wait']:.1f}s (dnsmasq {how}"
+    if response.get("coalesced", 1) > 1:
+        text += f", shared by {response['coalesced']} changes"
+    return text + ")"
+
+
+class Supervisor:
+    """
+    État partagé entre les opérations : configuration, clé SSH déchiffrée
+    (les sessions SSH et les tables en cache sont gardées par dhcp.py et cache.py)
+    """
+
+    def __init__(self, config_path, key_filename=KEY_FILE, ask_passphrase=None):
+        self.config_path = config_path
+        self.key_filename = os.path.expanduser(key_filename)
+        # Fonction qui demande la passphrase (None : jamais de question)
+        self._ask_passphrase = ask_passphrase
+        self._passphrase = None
+        self._unlocked = False
+        self._key_lock = threading.Lock()
+        # Configuration et (date, taille) du YAML correspondant
+        self._cfg = None
+        self._stamp = None
+        self._cfg_lock = threading.Lock()
+        # serveur -> SubnetAllocator (attribution automatique d'adresses)
+        self._allocators = {}
+        self._allocators_lock = threading.Lock()
+
+    def config(self):
+        """
+        Retourne la configuration, relue seulement si le YAML a changé
+        Lève ConfigError ou OSError si elle est illisible
+        """
+        st = os.stat(self.config_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._cfg_lock:
+            if self._cfg is None or self._stamp != stamp:
+                self._cfg = compile_config(self.config_path)
+                self._stamp = stamp
+            return self._cfg
+
+    def passphrase(self):
+        """
+        Retourne la passphrase de la clé, demandée au plus une fois
+        (None si la clé est dans le ssh-agent ou n'est pas chiffrée)
+        """
+        with self._key_lock:
+            if not self._unlocked:
+                if self._ask_passphrase is not None and needs_passphrase(self.key_filename):
+                    self._passphrase = self._ask_passphrase() or None
+                self._unlocked = True
+            return self._passphrase
+
+    def unlock(self):
+        """
+        Déchiffre la clé tout de suite (au démarrage du démon)
+        Lève SSHException si la passphrase est fausse
+        """
+        passphrase = self.passphrase()
+        if os.path.exists(self.key_filename) and not key_in_agent(self.key_filename):
+            load_private_key(self.key_filename, passphrase)
+
+    def servers_for(self, target, allow_server_ip=False):
+        """
+        Retourne les serveurs concernés par une IP ou un réseau (tous si target est vide)
+        ou None si aucun serveur ne correspond
+        Avec allow_server_ip=True, l'IP d'un serveur de la config est aussi acceptée
+        """
+        cfg = self.config()
+        if not target:
+            return list(cfg["dhcp-servers"].keys())
+
+        server_info = get_dhcp_server(target, cfg)
+        if server_info is not None:
+            return [server_info[0]]
+        if allow_server_ip and target in cfg["dhcp-servers"]:
+            return [target]
+        return None
+
+    # === OPÉRATIONS ===
+
+    def add(self, mac, ip, server=None):
+        """
+        Ajoute ou met à jour la réservation mac -> ip
+        Retourne {"ok", "mac", "ip", "server", "status", "error"}
+        et "live" (quand la modification est devenue active) en cas de succès
+        """
+        result = {"ok": False, "mac": mac, "ip": ip, "server": server, "status": None, "error": None}
+        cfg = self.config()
+
+        if server is None:
+            server_info = get_dhcp_server(ip, cfg)
+            if server_info is None:
+                result["error"] = "Unable to identify DHCP server"
+                return result
+            server = result["server"] = server_info[0]
+
+        try:
+            response = add_reservation(mac, ip, server, cfg, self.key_filename, self.passphrase())
+        except Exception as e:
+            result["error"] = _error_message(e, f"Erreur lors de l'ajout de {mac}")
+            return result
+
+        outcome = response["results"][0]
+        result["status"] = outcome["status"]
+        result["previous"] = outcome.get("previous")
+        if outcome["status"] == "conflict":
+            result["owner"] = outcome["owner"]
+            result["error"] = "error: IP address already in use."
+        elif response["changed"] and not response["reloaded"]:
+            result["error"] = "error: Impossible de redémarrer dnsmasq"
+        else:
+            result["ok"] = True
+            result["live"] = _reload_message(response)
+        return result
+
+    def remove(self, mac):
+        """
+        Supprime la réservation d'une MAC, où qu'elle soit
+        Retourne {"ok", "mac", "ip", "server", "status", "error"}
+        et "live" (quand la modification est devenue active) en cas de succès
+        """
+        result = {"ok": False, "mac": mac, "ip": None, "server": None, "status": None, "error": None}
+        cfg = self.config()
+        servers = list(cfg["dhcp-servers"].keys())
+        passphrase = self.passphrase()
+
+        # L'index local sait peut-être déjà où se trouve la MAC
+        # La suppression ne se fait que si le serveur a toujours la même IP pour cette MAC
+        response = None
+        hint = get_location_index(cfg).lookup(mac)
+        if hint is not None and hint[0] in servers:
+            try:
+                response = remove_reservation(mac, hint[0], cfg, expected_ip=hint[1],
+                                              key_filename=self.key_filename, passphrase=passphrase)
+                result["server"] = hint[0]
+                if response["results"][0]["status"] != "deleted":
+                    response = None
+            except Exception:
+                # serveur injoignable : on cherche ailleurs
+                response = None
+
+        # Sinon, interroger tous les serveurs en parallèle (arrêt au premier trouvé)
+        if response is None:
+            hit = find_mac_server(mac, servers, cfg, key_filename=self.key_filename,
+                                  passphrase=passphrase, jobs=cfg.get("jobs", 8),
+                                  timeout=cfg.get("ssh_timeout", 30))
+            if hit is None:
+                result["server"] = None
+                result["status"] = "not_found"
+                result["error"] = "MAC address not found"
+                return result
+
+            result["server"] = hit[0]
+            try:
+                response = remove_reservation(mac, hit[0], cfg, expected_ip=hit[1],
+                                              key_filename=self.key_filename, passphrase=passphrase)
+            except Exception as e:
+                result["error"] = _error_message(e, f"Erreur lors de la suppression de {mac}")
+                return result
+
+        outcome = response["results"][0]
+        result["status"] = outcome["status"]
+        if outcome["status"] == "not_found":
+            result["error"] = "MAC address not found"
+        elif outcome["status"] == "mismatch":
+            result["error"] = f"error: {mac} is now reserved for {outcome['current']}"
+        elif not response["reloaded"]:
+            result["ip"] = outcome["previous"]
+            result["error"] = "error: Impossible de redémarrer dnsmasq"
+        else:
+            result["ip"] = outcome["previous"]
+            result["ok"] = True
+            result["live"] = _reload_message(response)
+        return result
+
+    def allocator(self, server):
+        """
+        Retourne (SubnetAllocator, CompactTable) du réseau d'un serveur
+        La table est revérifiée auprès du serveur ; l'occupation n'est
+        reconstruite que si elle a changé autrement que par nos attributions
+        Lève une exception si le serveur est injoignable
+        """
+        cfg = self.config()
+        table, _ = get_reservations(server, cfg, self.key_filename, self.passphrase())
+        meta, _ = get_cache(cfg).get_table(server)
+        sha256 = meta["fingerprint"]["sha256"] if meta is not None else None
+
+        with self._allocators_lock:
+            allocator = self._allocators.get(server)
+            if (allocator is None or allocator.sha256 is None or allocator.sha256 != sha256
+                    or allocator.network != cfg["dhcp-servers"][server]):
+                fresh = build_allocator(cfg, server, table)
+                fresh.sha256 = sha256
+                if allocator is not None:
+                    # Adresses données à une attribution pas encore terminée
+                    fresh.hold(allocator.pending)
+                allocator = self._allocators[server] = fresh
+        return allocator, table
+
+    def _allocated(self, server, allocator):
+        """
+        Après nos propres écritures, le cache local a suivi : l'occupation reste valable
+        """
+        meta, _ = get_cache(self.config()).get_table(server)
+        with self._allocators_lock:
+            allocator.sha256 = meta["fingerprint"]["sha256"] if meta is not None else None
+
+    def allocate(self, macs, target, write=None):
+        """
+        Réserve une adresse libre du réseau target (réseau de dhcp-servers
+        ou IP de son serveur) pour chaque MAC ; une MAC qui a déjà une
+        adresse dans ce réseau la garde
+        write(serveur, opérations) envoie les opérations à l'agent
+        (write_reservations par défaut)
+        Retourne une liste de {"ok", "mac", "ip", "server", "status", "error"}
+        """
+        results = [{"ok": False, "mac": mac, "ip": None, "server": None, "status": None, "error": None}
+                   for mac in macs]
+        servers = self.servers_for(target, allow_server_ip=True) if target else None
+        if not servers:
+            for result in results:
+                result["error"] = "Unable to identify DHCP server"
+            return results
+
+        server = servers[0]
+        network = self.config()["dhcp-servers"][server]
+        if write is None:
+            def write(server, ops):
+                return write_reservations(ops, server, self.config(), self.key_filename, self.passphrase())
+
+        try:
+            allocator, table = self.allocator(server)
+        except Exception as e:
+            for result in results:
+                result.update(server=server, error=_error_message(e, f"Erreur lors de la lecture de {server}"))
+            return results
+
+        pending = []
+        for result in results:
+            result["server"] = server
+            ip = table.ip_of(result["mac"])
+            if ip is not None and ip in allocator:
+                result.update(ok=True, ip=ip, status="unchanged")
+            else:
+                pending.append(result)
+
+        for _ in range(MAX_ALLOCATION_ROUNDS):
+            if not pending:
+                break
+
+            ips = allocator.take(len(pending))
+            if len(ips) < len(pending):
+                allocator.release(ips)
+                for result in pending:
+                    result["error"] = f"error: no free address left in {network}"
+                return results
+
+            ops = [{"op": "upsert", "mac": result["mac"], "ip": ip} for result, ip in zip(pending, ips)]
+            try:
+                response = write(server, ops)
+            except Exception as e:
+                allocator.release(ips)
+                for result in pending:
+                    result["error"] = _error_message(e, f"Erreur lors de l'ajout de {result['mac']}")
+                return results
+
+            # Adresse prise entre-temps par un autre client : elle reste
+            # marquée, et la MAC recevra la suivante
+            allocator.confirm(ips)
+            self._allocated(server, allocator)
+            retry = []
+            for result, ip, outcome in zip(pending, ips, response["results"]):
+                result["status"] = outcome["status"]
+                if outcome["status"] == "conflict":
+                    retry.append(result)
+                    continue
+                result["ip"] = ip
+                if response["changed"] and not response["reloaded"]:
+                    result["error"] = "error: Impossible de redémarrer dnsmasq"
+                else:
+                    result["ok"] = True
+            pending = retry
+
+        for result in pending:
+            result["error"] = "error: IP address already in use."
+        return results
+
+    def tables(self, servers, offline=False, jobs=None, timeout=None, leases=False):
+        """
+        Lit les réservations de plusieurs serveurs en parallèle
+        Générateur : donne (serveur, table, état, erreur) dans l'ordre de servers
+        Avec leases=True, les baux en cours sont lus aussi : état["leases"] (LeaseTable)
+        """
+        cfg = self.config()
+        jobs = jobs or cfg.get("jobs", 8)
+        timeout = timeout or cfg.get("ssh_timeout", 30)
+        # Le même délai s'applique à la connexion et à la commande
+        cfg = dict(cfg, ssh_timeout=timeout, ssh_command_timeout=timeout)
+        passphrase = None if offline else self.passphrase()
+
+        def fetch(server):
+            # Le serveur ne renvoie la liste que si elle a changé depuis la dernière fois
+            table, state = get_reservations(server, cfg, key_filename=self.key_filename,
+                                            passphrase=passphrase, offline=offline)
+            if leases:
+                # Et seulement la fin du fichier des baux
+                state["leases"], _ = get_leases(server, cfg, key_filename=self.key_filename,
+                                                passphrase=passphrase, offline=offline)
+            return table, state
+
+        for server, fetched, error in fan_out(servers, fetch, jobs=jobs, timeout=timeout):
+            if error is not None:
+                yield server, None, None, error
+            else:
+                yield server, fetched[0], fetched[1], None
+
+    def write_many(self, ops_by_server, jobs=None, whole_file=False):
+        """
+        Envoie un lot d'opérations à chaque serveur en parallèle
+        (une écriture et un redémarrage par serveur)
+        Avec whole_file=True, chaque fichier est reconstruit ici et envoyé
+        en entier (replace_reservations)
+        Générateur : donne (serveur, réponse de l'agent, erreur) dans l'ordre
+        """
+        cfg = self.config()
+        jobs = jobs or cfg.get("jobs", 8)
+        passphrase = self.passphrase()
+        writer = replace_reservations if whole_file else write_reservations
+
+        def write(server):
+            return writer(ops_by_server[server], server, cfg, self.key_filename, passphrase)
+
+        yield from fan_out(list(ops_by_server), write, jobs=jobs)
+
+    # === AFFICHAGE (scripts en ligne de commande) ===
+
+    def run(self, command, params):
+        """
+        Exécute une commande des scripts et donne ce qu'il faut afficher :
+        {"out": ligne}, {"err": ligne}, puis {"exit": code de sortie}
+        """
+        try:
+            self.config()
+        except Exception as e:
+            for line in config_error_lines(self.config_path, e):
+                yield {"err": line}
+            yield {"exit": 1}
+            return
+
+        handler = getattr(self, f"_run_{command}", None)
+        if handler is None:
+            yield {"err": f"error: unknown command {command}"}
+            yield {"exit": 1}
+            return
+
+        try:
+            with metrics.span(f"command.{command}"):
+                yield from handler(**params)
+        except Exception as e:
+            yield {"err": f"error: {e}"}
+            yield {"exit": 1}
+
+    def _run_add(self, mac, ip=None, network=None):
+        if ip is None:
+            yield from self._run_allocate(mac, network)
+            return
+
+        server_info = get_dhcp_server(ip, self.config())
+        if server_info is None:
+            yield {"err": "Unable to identify DHCP server"}
+            yield {"exit": 1}
+            return
+
+        server = server_info[0]
+        yield {"out": "Connecting to DHCP server..."}
+        self.passphrase()
+        yield {"out": f"Adding DHCP reservation on server {server}..."}
+
+        result = self.add(mac, ip, server)
+        if not result["ok"]:
+            yield {"err": result["error"]}
+            yield {"exit": 1}
+            return
+
+        if result["status"] == "updated":
+            # La MAC avait déjà une adresse (peut-être changée par quelqu'un d'autre entre-temps)
+            yield {"out": f"Success: Updated DHCP reservation {mac} → {ip} on server {server} "
+                          f"(was {result['previous']})"}
+        else:
+            yield {"out": f"Success: Added DHCP reservation {mac} → {ip} on server {server}"}
+        if result["live"]:
+            yield {"out": result["live"]}
+        yield {"exit": 0}
+
+    def _run_allocate(self, mac, network):
+        servers = self.servers_for(network, allow_server_ip=True) if network else None
+        if not servers:
+            yield {"err": "Unable to identify DHCP server"}
+            yield {"exit": 1}
+            return
+
+        server = servers[0]
+        yield {"out": "Connecting to DHCP server..."}
+        self.passphrase()
+        yield {"out": f"Allocating a free address in {self.config()['dhcp-servers'][server]} "
+                      f"on server {server}..."}
+
+        result = self.allocate([mac], server)[0]
+        if not result["ok"]:
+            yield {"err": result["error"]}
+            yield {"exit": 1}
+            return
+
+        if result["status"] == "unchanged":
+            yield {"out": f"{mac} already has DHCP reservation {result['ip']} on server {server}"}
+        else:
+            yield {"out": f"Success: Added DHCP reservation {mac} → {result['ip']} on server {server}"}
+        yield {"exit": 0}
+
+    def _run_remove(self, mac):
+        result = self.remove(mac)
+        if not result["ok"]:
+            yield {"err": result["error"]}
+            yield {"exit": 1}
+            return
+
+        yield {"out": f"Removed DHCP reservation for {mac} on {result['server']}"}
+        if result["live"]:
+            yield {"out": result["live"]}
+        yield {"exit": 0}
+
+    def _run_list(self, target=None, jobs=None, timeout=None, offline=False, leases=False):
+        servers = self.servers_for(target, allow_server_ip=True)
+        if servers is None:
+            yield {"err": "cannot identify DHCP server"}
+            yield {"exit": 1}
+            return
+
+        failed = []
+        for server, table, state, error in self.tables(servers, offline, jobs, timeout, leases):
+            if error is not None:
+                yield {"out": f"{server}:"}
+                yield {"err": f"Error connecting to {server}: {error}"}
+                failed.append(server)
+                yield {"out": ""}
+                continue
+
+            if state["stale"]:
+                yield {"out": f"{server}: (cached {int(state['age'] // 60)} min ago, may be stale)"}
+            else:
+                yield {"out": f"{server}:"}
+
+            # Les chaînes ne sont créées qu'au fur et à mesure de l'affichage
+            max_mac_len = table.mac_width()
+            if leases:
+                # Colonne du bail de chaque MAC réservée
+                lease_table = state["leases"]
+                for mac, ip in table.pairs():
+                    yield {"out": f"{mac.ljust(max_mac_len)}    {ip.ljust(15)}    "
+                                  f"{_lease_column(lease_table.lease_for(mac, ip), ip)}"}
+            else:
+                for mac, ip in table.pairs():
+                    yield {"out": f"{mac.ljust(max_mac_len)}    {ip}"}
+            yield {"out": ""}
+
+        # Échecs partiels : les autres serveurs ont quand même été affichés
+        if failed:
+            yield {"err": f"{len(failed)} server(s) failed: {', '.join(failed)}"}
+            yield {"exit": 1}
+            return
+        yield {"exit": 0}
+
+    def _run_check(self, target=None, jobs=None, timeout=None, offline=False, leases=False):
+        servers = self.servers_for(target)
+        if servers is None:
+            yield {"err": "cannot identify DHCP server"}
+            yield {"exit": 1}
+            return
+
+        # Réseaux imbriqués dans la config : les adresses communes vont au plus petit
+        for line in nested_network_warnings(self.config()):
+            yield {"out": line}
+
+        failed = []
+        for server, table, state, error in self.tables(servers, offline, jobs, timeout, leases):
+            yield {"out": f"\nChecking server: {server}"}
+
+            if error is not None:
+                yield {"err": f"Error connecting to {server}: {error}"}
+                failed.append(server)
+                continue
+
+            if state["stale"]:
+                yield {"out": f"(cached {int(state['age'] // 60)} min ago, may be stale)"}
+
+            yield from _duplicate_lines(table)
+            if leases:
+                yield from _lease_lines(table, state["leases"])
+
+        if failed:
+            yield {"err": f"\n{len(failed)} server(s) could not be checked: {', '.join(failed)}"}
+            yield {"exit": 1}
+            return
+        yield {"exit": 0}
+
+    def _run_sync(self, entries, target=None, dry_run=False, jobs=None, timeout=None, whole_file=False):
+        servers = self.servers_for(target, allow_server_ip=True)
+        if servers is None:
+            yield {"err": "cannot identify DHCP server"}
+            yield {"exit": 1}
+            return
+
+        # État désiré de chaque serveur (les réseaux hors de target sont ignorés)
+        desired = {server: {} for server in servers}
+        unknown = 0
+        for (mac, ip), server_info in zip(entries, get_dhcp_servers([ip for _, ip in entries], self.config())):
+            if server_info is None:
+                yield {"err": f"{mac} {ip}: unable to identify DHCP server"}
+                unknown += 1
+            elif server_info[0] in desired:
+                desired[server_info[0]][mac] = ip
+        if unknown:
+            yield {"err": f"{unknown} reservation(s) outside every network: nothing changed"}
+            yield {"exit": 1}
+            return
+
+        # 1. Plan : une lecture par serveur, en parallèle
+        plans = {}
+        totals = {"add": 0, "update": 0, "delete": 0}
+        failed = []
+        for server, table, state, error in self.tables(servers, False, jobs, timeout):
+            if error is not None:
+                yield {"err": f"Error connecting to {server}: {error}"}
+                failed.append(server)
+                continue
+
+            changes = plan_changes(table, desired[server])
+            for line in plan_lines(server, changes):
+                yield {"out": line}
+            if count_changes(changes):
+                plans[server] = change_ops(changes)
+                for kind in totals:
+                    totals[kind] += len(changes[kind])
+
+        summary = (f"{totals['add']} to add, {totals['update']} to update, {totals['delete']} to delete "
+                   f"on {len(plans)} server(s)")
+        if dry_run or not plans:
+            yield {"out": f"Dry run: {summary}" if dry_run else "Everything is in sync."}
+        else:
+            # 2. Application : un seul lot par serveur
+            yield {"out": f"Applying: {summary}..."}
+            for server, response, error in self.write_many(plans, jobs, whole_file):
+                if error is not None:
+                    yield {"err": _error_message(error, f"Erreur lors de l'écriture sur {server}")}
+                    failed.append(server)
+                    continue
+
+                refused = 0
+                for op, outcome in zip(plans[server], response["results"]):
+                    if outcome["status"] == "conflict":
+                        yield {"err": f"{server}: {op['mac']} {op['ip']}: IP address already in use "
+                                      f"by {outcome['owner']}"}
+                        refused += 1
+                    elif outcome["status"] == "mismatch":
+                        yield {"err": f"{server}: {op['mac']} not deleted: changed to {outcome['current']}"}
+                        refused += 1
+
+                if response["changed"] and not response["reloaded"]:
+                    yield {"err": f"{server}: error: Impossible de redémarrer dnsmasq"}
+                    failed.append(server)
+                elif refused:
+                    failed.append(server)
+                else:
+                    yield {"out": f"{server}: applied"}
+
+        if failed:
+            yield {"err": f"{len(failed)} server(s) failed: {', '.join(failed)}"}
+            yield {"exit": 1}
+            return
+        yield {"exit": 0}
+
+
+def _duplicate_lines(table):
+    """
+    Lignes du rapport des doublons MAC et IP d'une table de réservations
+    """
+    # Une MAC est en doublon si elle a plus d'une ligne
+    duplicate_macs = table.duplicate_macs()
+    if duplicate_macs:
+        yield {"out": "duplicate MAC addresses:"}
+        for mac, ip_list in duplicate_macs.items():
+            for ip in ip_list:
+                yield {"out": f"dhcp-host={mac},{ip}"}
+    else:
+        yield {"out": "No duplicate MAC addresses."}
+
+    # Une IP est en doublon si elle a plus d'une MAC
+    duplicate_ips = table.duplicate_ips()
+    if duplicate_ips:
+        yield {"out": "duplicate IP addresses:"}
+        for ip, mac_list in duplicate_ips.items():
+            for mac in mac_list:
+                yield {"out": f"dhcp-host={mac},{ip}"}
+    else:
+        yield {"out": "No duplicate IP addresses."}
+
+
+def _lease_column(lease, ip):
+    """
+    Colonne "bail" de list-dhcp pour une réservation
+    """
+    if lease is None:
+        return "-"
+    if lease.ip != ip:
+        return f"leased as {lease.ip} (expires {expiry_text(lease)})"
+    return f"leased (expires {expiry_text(lease)})"
+
+
+def _lease_lines(table, lease_table):
+    """
+    Lignes du rapport des baux qui contredisent les réservations
+    """
+    other_ip, taken = lease_table.conflicts(table)
+
+    # MAC réservée mais louée sur une autre IP (bail dynamique ou ancienne réservation)
+    if other_ip:
+        yield {"out": "reserved MAC addresses leased with another IP:"}
+        for mac, ip, lease in other_ip:
+            yield {"out": f"{mac}: reserved {ip}, leased {lease.ip} (expires {expiry_text(lease)})"}
+    else:
+        yield {"out": "No reserved MAC address leased with another IP."}
+
+    # IP réservée mais louée à une autre MAC
+    if taken:
+        yield {"out": "reserved IP addresses leased to another MAC:"}
+        for ip, lease in taken:
+            yield {"out": f"{ip}: reserved for {', '.join(table.macs_of(ip))}, leased to {lease.mac} "
+                          f"(expires {expiry_text(lease)})"}
+    else:
+        yield {"out": "No reserved IP address leased to another MAC."}
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+superviseur-daemon.py :
+Démon du superviseur DHCP
+Garde en mémoire la configuration, la clé SSH déchiffrée, les sessions SSH
+ouvertes et les tables de réservations ; les scripts lui envoient leurs
+commandes par une socket Unix au lieu de tout refaire à chaque appel
+Avec --http, il sert aussi l'API HTTP/JSON (api.py)
+"""
+
+import os
+import sys
+import json
+import stat
+import socket
+import signal
+import asyncio
+import getpass
+import argparse
+import ipaddress
+from os.path import dirname, abspath, join, realpath
+
+# 1. Déduire PROJECT_DIR
+PROJECT_DIR = dirname(dirname(abspath(__file__)))
+
+# 2. Ajouter src/ au PYTHONPATH
+SRC_DIR = join(PROJECT_DIR, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+# 3. Importer le service et le client
+from client  import socket_path
+from config  import config_error_lines
+from service import Supervisor
+from api     import Api
+from dhcp    import get_session, fan_out
+from paramiko.ssh_exception import SSHException
+import metrics
+
+
+# Commandes acceptées (celles des scripts)
+COMMANDS = ("add", "remove", "list", "check", "sync")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="superviseur-daemon",
+        description="Keep the supervisor state in memory and serve the CLI scripts over a Unix socket")
+    parser.add_argument("--socket", help=f"socket path (default: {socket_path()})")
+    parser.add_argument("--http", metavar="[HOST:]PORT",
+                        help="also serve the HTTP/JSON API on this address (default host: 127.0.0.1)")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each phase (summary on exit, GET /metrics with --http)")
+    return parser.parse_args()
+
+
+def parse_address(address):
+    """
+    Découpe [HOST:]PORT en (host, port) ; lève ValueError si invalide
+    """
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def prepare_socket(path):
+    """
+    Prépare l'emplacement de la socket (répertoire accessible au seul utilisateur)
+    Retourne False si un autre démon répond déjà sur cette socket
+    """
+    directory = dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    os.chmod(directory, stat.S_IRWXU)
+
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            return False
+        except OSError:
+            # Socket abandonnée par un démon arrêté brutalement
+            os.unlink(path)
+        finally:
+            probe.close()
+    return True
+
+
+async def handle(reader, writer, supervisor):
+    """
+    Traite une commande : une ligne JSON en entrée, une ligne JSON par
+    ligne à afficher en sortie
+    """
+    loop = asyncio.get_running_loop()
+    events = None
+    try:
+        try:
+            request = json.loads(await reader.readline())
+            command = request["command"]
+            params = request.get("params") or {}
+            same_config = realpath(request.get("config", "")) == realpath(supervisor.config_path)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return
+
+        # Autre configuration ou commande inconnue : le client passe en mode direct
+        if not same_config or command not in COMMANDS or not isinstance(params, dict):
+            writer.write(json.dumps({"accepted": False}).encode() + b"\n")
+            return
+        writer.write(json.dumps({"accepted": True}).encode() + b"\n")
+
+        # Les opérations sont bloquantes (SSH) : elles tournent dans des threads,
+        # et chaque ligne est envoyée dès qu'elle est prête
+        events = supervisor.run(command, params)
+        end = object()
+        while True:
+            event = await loop.run_in_executor(None, next, events, end)
+            if event is end:
+                break
+            writer.write(json.dumps(event).encode() + b"\n")
+            await writer.drain()
+
+    except (ConnectionError, OSError):
+        # Client parti en cours de route
+        pass
+    finally:
+        if events is not None:
+            try:
+                events.close()
+            except ValueError:
+                # Arrêt du démon pendant une opération : le thread finira seul
+                pass
+        writer.close()
+
+
+def warm_up(supervisor):
+    """
+    Ouvre tout de suite une session SSH vers chaque serveur
+    (les serveurs injoignables seront réessayés à la première commande)
+    """
+    cfg = supervisor.config()
+    servers = list(cfg["dhcp-servers"].keys())
+
+    def connect(server):
+        get_session(server, cfg, supervisor.key_filename, supervisor.passphrase())
+
+    for server, _, error in fan_out(servers, connect, jobs=cfg.get("jobs", 8),
+                                    timeout=cfg.get("ssh_timeout", 30)):
+        if error is not None:
+            print(f"Warning: cannot connect to {server}: {error}", file=sys.stderr)
+
+
+async def serve(supervisor, path, http=None):
+    loop = asyncio.get_running_loop()
+    server = await asyncio.start_unix_server(lambda r, w: handle(r, w, supervisor), path=path)
+    # Seul l'utilisateur du démon peut lui parler (il a accès à la clé SSH)
+    os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+
+    http_server = None
+    if http is not None:
+        api = Api(supervisor)
+        http_server = await asyncio.start_server(api.handle, http[0], http[1], backlog=1024)
+        print(f"HTTP API listening on {http[0]}:{http[1]}")
+
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    loop.run_in_executor(None, warm_up, supervisor)
+    print(f"Supervisor daemon listening on {path}")
+
+    async with server:
+        await stop.wait()
+    if http_server is not None:
+        http_server.close()
+        await http_server.wait_closed()
+
+
+def main():
+    args = parse_args()
+    path = os.path.expanduser(args.socket) if args.socket else socket_path()
+    if args.profile:
+        metrics.enable()
+
+    # 4. Charger le YAML (relu automatiquement s'il change ensuite)
+    config_path = join(PROJECT_DIR, "superviseur.yaml")
+    supervisor = Supervisor(
+        config_path,
+        ask_passphrase=lambda: getpass.getpass(prompt="Passphrase for SSH key (enter if none): "))
+    try:
+        supervisor.config()
+    except Exception as e:
+        for line in config_error_lines(config_path, e):
+            print(line, file=sys.stderr)
+        sys.exit(1)
+
+    # 5. Déchiffrer la clé une fois pour toutes
+    try:
+        supervisor.unlock()
+    except SSHException as e:
+        print(f"Erreur clé SSH: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    # 6. L'API HTTP n'écoute ailleurs que sur la machine locale qu'avec un jeton
+    http = None
+    if args.http:
+        try:
+            http = parse_address(args.http)
+            loopback = http[0] == "localhost" or ipaddress.ip_address(http[0]).is_loopback
+        except ValueError:
+            print(f"error: bad HTTP address {args.http}", file=sys.stderr)
+            sys.exit(1)
+        if not loopback and supervisor.config().get("api_token") is None:
+            print("error: set api_token in superviseur.yaml to serve the API on a public address",
+                  file=sys.stderr)
+            sys.exit(1)
+
+    if not prepare_socket(path):
+        print(f"error: a daemon is already listening on {path}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        asyncio.run(serve(supervisor, path, http))
+    finally:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+sync-dhcp.py :
+Aligne les serveurs DHCP sur un état désiré (fichier CSV ou JSONL MAC,IP)
+Affiche pour chaque serveur les ajouts, mises à jour et suppressions
+nécessaires, puis envoie un seul lot par serveur (une écriture et un
+redémarrage de dnsmasq). Des serveurs déjà à jour ne coûtent qu'une lecture
+"""
+
+import sys
+import getpass
+import argparse
+from os.path import dirname, abspath, join
+
+# 1. Déduire PROJECT_DIR
+PROJECT_DIR = dirname(dirname(abspath(__file__)))
+
+# 2. Ajouter src/ au PYTHONPATH
+SRC_DIR = join(PROJECT_DIR, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+# 3. Importer inventory et le client du démon
+from inventory import guess_format, read_rows, check_rows
+from client    import daemon_request, print_events
+import metrics
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="sync-dhcp",
+        description="Make the DHCP servers match a desired-state file (CSV MAC,IP or JSONL). "
+                    "Reservations missing from the file are removed.")
+    parser.add_argument("file", help="CSV or JSONL file with every wanted reservation")
+    parser.add_argument("serveur", nargs="?",
+                        help="only synchronize this server IP or network (default: all servers)")
+    parser.add_argument("--format", choices=["csv", "jsonl"],
+                        help="file format (default: guessed from the extension)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="show the plan without modifying anything")
+    parser.add_argument("--whole-file", action="store_true",
+                        help="rebuild each server file here and upload it in one piece "
+                             "(checked by dnsmasq, previous version kept as hosts.conf~)")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="number of servers handled at the same time (default: 8)")
+    parser.add_argument("-t", "--timeout", type=float,
+                        help="seconds before giving up on reading a server (default: 30)")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each phase and print a summary (runs without the daemon)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.profile:
+        metrics.enable()
+
+    # 4. Lire et valider l'état désiré : une seule ligne fausse et rien n'est fait
+    # (sinon les réservations de cette ligne seraient supprimées)
+    try:
+        rows = read_rows(args.file, guess_format(args.file, args.format))
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    report, valid = check_rows(rows)
+    if len(valid) != len(report):
+        for row in report:
+            if row.get("status") == "error":
+                print(f"line {row['line']}: {row['mac']} {row['ip']}: {row['error']}", file=sys.stderr)
+        print(f"{len(report) - len(valid)} invalid row(s): nothing changed", file=sys.stderr)
+        sys.exit(1)
+
+    params = {"entries": [[report[i]["mac"], report[i]["ip"]] for i in valid],
+              "target": args.serveur, "dry_run": args.dry_run, "whole_file": args.whole_file,
+              "jobs": args.jobs, "timeout": args.timeout}
+
+    # 5. Passer par le démon s'il tourne, sinon tout faire ici
+    config_path = join(PROJECT_DIR, "superviseur.yaml")
+    events = daemon_request("sync", params, config_path)
+
+    if events is None:
+        from service import Supervisor
+
+        # 6. La passphrase n'est demandée qu'une fois (sauf si ssh-agent ou clé non chiffrée)
+        supervisor = Supervisor(
+            config_path,
+            ask_passphrase=lambda: getpass.getpass(prompt="Passphrase for SSH key (enter if none): "))
+        events = supervisor.run("sync", params)
+
+    # 7. Plan puis résultat de chaque serveur
+    sys.exit(print_events(events))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_agent_hosts_dir.py :
+Remplacement d'un répertoire dhcp-hostsdir : quel que soit le moment
+d'un arrêt, aucune IP n'est réservée dans deux fichiers à la fois
+"""
+
+import os
+import sys
+import importlib.util
+from collections import Counter
+from os.path import dirname, abspath, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+spec = importlib.util.spec_from_file_location("dhcp_agent", join(ROOT, "dhcp-agent.py"))
+agent = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(agent)
+
+A = "02:00:00:00:00:0a"
+B = "02:00:00:00:00:0b"
+C = "02:00:00:00:00:0c"
+
+
+def duplicated_ips(path):
+    ips = Counter()
+    for name in agent.hosts_dir_files(path):
+        with open(join(path, name)) as f:
+            ips.update(agent._shard_ips(f.readlines()))
+    return [ip for ip, n in ips.items() if n > 1]
+
+
+def watch_writes(monkeypatch, path):
+    """
+    Vérifie le répertoire après chaque écriture ou suppression de fichier
+    """
+    states = []
+    write_hosts, unlink = agent.write_hosts, os.unlink
+
+    def checked_write(*args, **kwargs):
+        write_hosts(*args, **kwargs)
+        states.append(duplicated_ips(path))
+
+    def checked_unlink(file_path):
+        unlink(file_path)
+        if os.path.dirname(file_path) == str(path):
+            states.append(duplicated_ips(path))
+
+    monkeypatch.setattr(agent, "write_hosts", checked_write)
+    monkeypatch.setattr(agent.os, "unlink", checked_unlink)
+    return states
+
+
+def test_moved_ips_are_released_first(tmp_path, monkeypatch):
+    path = tmp_path / "hosts.d"
+    # A et B échangent leurs adresses, C prend celle d'une MAC supprimée
+    agent.replace_hosts_dir(str(path), f"dhcp-host={A},10.0.0.1\ndhcp-host={B},10.0.0.2\n"
+                                       f"dhcp-host=02:00:00:00:01:0c,10.0.0.3\n")
+    states = watch_writes(monkeypatch, path)
+
+    agent.replace_hosts_dir(str(path), f"dhcp-host={A},10.0.0.2\ndhcp-host={B},10.0.0.1\n"
+                                       f"dhcp-host={C},10.0.0.3\n")
+
+    assert states and all(not duplicated for duplicated in states)
+    table, _ = agent.read_hosts_dir(str(path))
+    assert {mac: table.ip_of(mac) for mac in (A, B, C)} == {A: "10.0.0.2", B: "10.0.0.1", C: "10.0.0.3"}
+    assert table.ip_of("02:00:00:00:01:0c") is None
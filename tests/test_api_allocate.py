@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_api_allocate.py :
+Plus d'attributions simultanées que de threads de l'API : aucune ne doit
+rester bloquée en attendant la file d'écriture de son serveur
+"""
+
+import sys
+import time
+import asyncio
+import threading
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import api
+
+
+SERVER = "10.20.1.5"
+
+
+class FakeSupervisor:
+    """
+    Juste ce qu'Api utilise : allocate() écrit par write(), comme Supervisor.allocate
+    """
+    key_filename = None
+
+    def __init__(self):
+        self._next = 10
+        self._lock = threading.Lock()
+
+    def config(self):
+        return {"dhcp-servers": {SERVER: "10.20.1.0/24"}}
+
+    def passphrase(self):
+        return None
+
+    def servers_for(self, target, allow_server_ip=False):
+        return [SERVER]
+
+    def allocate(self, macs, target, write=None):
+        with self._lock:
+            ips = [f"10.20.{self._next // 250 + 1}.{self._next % 250}" for _ in macs]
+            self._next += 1
+        response = write(SERVER, [{"op": "upsert", "mac": mac, "ip": ip} for mac, ip in zip(macs, ips)])
+        return [{"ok": outcome["status"] == "added", "mac": mac, "ip": ip}
+                for mac, ip, outcome in zip(macs, ips, response["results"])]
+
+
+def fake_write(ops, server, cfg, key_filename=None, passphrase=None):
+    # Assez lent pour que toutes les attributions attendent la file en même temps
+    time.sleep(0.05)
+    return {"results": [{"status": "added"} for _ in ops], "changed": True, "reloaded": True}
+
+
+def test_allocate_beyond_pool_size(monkeypatch):
+    monkeypatch.setattr(api, "write_reservations", fake_write)
+
+    async def run():
+        service = api.Api(FakeSupervisor())
+        count = service.executor._max_workers * 2 + 5
+        requests = [service.allocate({"macs": [f"02:00:00:00:{n // 256:02x}:{n % 256:02x}"],
+                                      "network": "10.20.1.0/24"})
+                    for n in range(count)]
+        return await asyncio.wait_for(asyncio.gather(*requests), timeout=30)
+
+    responses = asyncio.run(run())
+    assert all(status == 200 and payload["ok"] for status, payload in responses)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_api_errors.py :
+Une erreur inattendue pendant une requête (configuration devenue
+invalide...) donne une réponse JSON 500, pas une connexion coupée
+"""
+
+import sys
+import json
+import asyncio
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import api
+from config import ConfigError
+
+
+class BrokenSupervisor:
+    """
+    Configuration lisible au démarrage de l'API, puis cassée
+    """
+    key_filename = None
+    broken = False
+
+    def config(self):
+        if self.broken:
+            raise ConfigError(["user: missing"])
+        return {"dhcp-servers": {"10.20.1.5": "10.20.1.0/24"}}
+
+
+async def request(service, target):
+    server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: test\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(), timeout=10)
+        writer.close()
+    head, _, body = data.partition(b"\r\n\r\n")
+    return head.split(b"\r\n")[0], json.loads(body)
+
+
+def test_broken_config_gives_json_500():
+    supervisor = BrokenSupervisor()
+    service = api.Api(supervisor)
+    supervisor.broken = True
+
+    for target in ("/health", "/journal?since=0"):
+        status_line, payload = asyncio.run(request(service, target))
+        assert status_line == b"HTTP/1.1 500 Internal Server Error"
+        assert payload["ok"] is False and "user: missing" in payload["error"]
+
+
+def test_unreadable_journal_gives_json_500(tmp_path, monkeypatch):
+    supervisor = BrokenSupervisor()
+    service = api.Api(supervisor)
+
+    def broken_journal(cfg):
+        raise PermissionError(13, "Permission denied", str(tmp_path / "journal"))
+
+    monkeypatch.setattr(api, "get_journal", broken_journal)
+    status_line, payload = asyncio.run(request(service, "/journal?since=0"))
+    assert status_line == b"HTTP/1.1 500 Internal Server Error"
+    assert payload["ok"] is False
+    assert payload["error"].startswith("cannot read change journal") and "Permission denied" in payload["error"]
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_journal.py :
+Relecture du journal après compactage : depuis le début, l'état est le
+même ; depuis un numéro compacté, il faut tout relire
+"""
+
+import sys
+from os.path import dirname, abspath
+
+import pytest
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from journal import Journal, ResyncRequired
+from reservations import ReservationTable
+
+
+SERVER = "10.0.0.5"
+A = "02:00:00:00:00:0a"
+B = "02:00:00:00:00:0b"
+
+# seq1 A -> .1, seq2 A -> .2, seq3 B -> .1, seq4 A -> .3
+HISTORY = [(A, "10.0.0.1"), (A, "10.0.0.2"), (B, "10.0.0.1"), (A, "10.0.0.3")]
+
+
+def record(journal, mac, ip):
+    ops = [{"op": "upsert", "mac": mac, "ip": ip}]
+    response = {"results": [{"status": "added", "previous": None}],
+                "before": "0" * 64, "fingerprint": {"sha256": "1" * 64}}
+    journal.record(SERVER, ops, response)
+
+
+def state(table):
+    return {entry["mac"]: entry["ip"] for entry in table.entries()}
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = Journal(str(tmp_path))
+    for mac, ip in HISTORY:
+        record(journal, mac, ip)
+    return journal
+
+
+def mirror_after_first_entry():
+    table = ReservationTable()
+    table.apply([{"op": "upsert", "mac": A, "ip": "10.0.0.1"}])
+    return table
+
+
+def test_incremental_replay_without_compaction(journal):
+    table, last, conflicts = journal.replay(SERVER, 1, mirror_after_first_entry())
+    assert state(table) == {A: "10.0.0.3", B: "10.0.0.1"}
+    assert last == 4 and conflicts == []
+
+
+def test_incremental_replay_inside_compacted_range(journal):
+    journal.compact()
+    with pytest.raises(ResyncRequired) as error:
+        journal.replay(SERVER, 1, mirror_after_first_entry())
+    assert error.value.horizon == 4
+    with pytest.raises(ResyncRequired):
+        journal.read(3)
+
+
+def test_full_replay_after_compaction(journal):
+    journal.compact()
+    table, last, conflicts = journal.replay(SERVER)
+    assert state(table) == {A: "10.0.0.3", B: "10.0.0.1"}
+    assert last == 4 and conflicts == []
+
+
+def test_incremental_replay_after_horizon(journal):
+    journal.compact()
+    record(journal, B, "10.0.0.4")
+    table = ReservationTable()
+    table.apply([{"op": "upsert", "mac": A, "ip": "10.0.0.3"}, {"op": "upsert", "mac": B, "ip": "10.0.0.1"}])
+    table, last, conflicts = journal.replay(SERVER, 4, table)
+    assert state(table) == {A: "10.0.0.3", B: "10.0.0.4"}
+    assert last == 5 and conflicts == []
+    # L'en-tête de la partie compactée ne compte pas comme une entrée
+    assert journal.last_seq() == 5
+    assert [entry["seq"] for entry in journal.read()] == [3, 4, 5]
+
+
+def test_replay_reports_conflicts(journal):
+    table = ReservationTable()
+    table.apply([{"op": "upsert", "mac": "02:00:00:00:00:0c", "ip": "10.0.0.3"}])
+    _, _, conflicts = journal.replay(SERVER, 0, table)
+    assert [entry["seq"] for entry in conflicts] == [4]
@@ -4,38 +4,86 @@
 """
 validation.py simplifié :
 Validation des adresses MAC et IP
+Une adresse à la fois (validate_mac, validate_ip) ou des colonnes
+entières d'un coup (validate_macs, validate_ips) pour les imports
 """
 
-from ipaddress import IPv4Address
+import re
+
+
+# Formes acceptées pour une MAC (après passage en minuscules) :
+#   00:1a:2b:3c:4d:5e   (forme normale)
+#   00-1a-2b-3c-4d-5e
+#   001a.2b3c.4d5e      (notation Cisco)
+#   001a2b3c4d5e        (hexadécimal seul)
+# Une MAC est réduite à sa "forme" : chaque chiffre hexadécimal devient x,
+# les séparateurs restent, tout autre caractère devient ?
+MAC_NORMAL_SHAPE = b"xx:xx:xx:xx:xx:xx"
+MAC_SHAPES = {MAC_NORMAL_SHAPE, b"xx-xx-xx-xx-xx-xx", b"xxxx.xxxx.xxxx", b"xxxxxxxxxxxx"}
+
+_MAC_CLASSES = bytearray(b"?" * 256)
+for _char in b"0123456789abcdef":
+    _MAC_CLASSES[_char] = ord("x")
+for _char in b":-.\n":
+    _MAC_CLASSES[_char] = _char
+_MAC_CLASSES = bytes(_MAC_CLASSES)
+
+# Séparateurs supprimés avant de remettre la MAC en forme normale
+_MAC_SEPARATORS = str.maketrans("", "", ":-.")
+
+# IPv4 en notation décimale pointée, sans zéro en tête (forme canonique),
+# utilisable pour DHCP : ni loopback (127/8), ni multicast (224/4), ni réservée
+# (240/4), ni lien local (169.254/16), ni 0.0.0.0
+_OCTET = r"(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])"
+_IP = (r"(?!127\.|22[4-9]\.|2[3-5][0-9]\.|169\.254\.|0\.0\.0\.0(?![0-9.]))"
+       rf"{_OCTET}(?:\.{_OCTET}){{3}}")
+IP_RE = re.compile(_IP)
+
+# Validation d'une colonne d'IPs : une ligne par valeur, et un seul passage
+# de l'expression régulière sur tout le texte. findall() donne, pour chaque
+# ligne, l'IP si elle est valide ou "" sinon
+_IP_LINES = re.compile(rf"^(?:({_IP})|.*)$", re.MULTILINE)
+
+
+def _mac_shape(mac):
+    """
+    Forme d'une MAC en minuscules (voir MAC_SHAPES)
+    """
+    return mac.encode("ascii", "replace").translate(_MAC_CLASSES)
+
+
+def _normalize_mac(mac):
+    """
+    Met en forme normale une MAC valide en minuscules
+    """
+    digits = mac.translate(_MAC_SEPARATORS)
+    return ":".join([digits[0:2], digits[2:4], digits[4:6], digits[6:8], digits[8:10], digits[10:12]])
+
+
+def _column(values):
+    """
+    Réunit une colonne en un seul texte (une ligne par valeur)
+    Retourne None si une valeur contient elle-même un saut de ligne
+    """
+    text = "\n".join(map(str.strip, values))
+    if text.count("\n") != len(values) - 1:
+        return None
+    return text
 
 
 def validate_mac(mac_str):
     """
-    Vérifie que l'adresse MAC est valide (format xx:xx:xx:xx:xx:xx)
-    Retourne la MAC en minuscules si valide, sinon lève ValueError
-    """
-    # Convertir en minuscules
-    mac = mac_str.lower()
-    
-    # Séparer les parties
-    parts = mac.split(':')
-    
-    # Vérifier qu'on a exactement 6 parties
-    if len(parts) != 6:
+    Vérifie que l'adresse MAC est valide (xx:xx:xx:xx:xx:xx, xx-xx-..., xxxx.xxxx.xxxx
+    ou 12 chiffres hexadécimaux)
+    Retourne la MAC au format xx:xx:xx:xx:xx:xx en minuscules si valide, sinon lève ValueError
+    """
+    mac = mac_str.strip().lower()
+    shape = _mac_shape(mac)
+    if shape not in MAC_SHAPES:
         raise ValueError("bad MAC address")
-    
-    # Vérifier chaque partie
-    for part in parts:
-        # Chaque partie doit avoir exactement 2 caractères
-        if len(part) != 2:
-            raise ValueError("bad MAC address")
-        
-        # Vérifier que ce sont des caractères hexadécimaux
-        for char in part:
-            if char not in '0123456789abcdef':
-                raise ValueError("bad MAC address")
-    
-    return mac
+    if shape == MAC_NORMAL_SHAPE:
+        return mac
+    return _normalize_mac(mac)
 
 
 def validate_ip(ip_str):
@@ -43,21 +91,62 @@ def validate_ip(ip_str):
     Vérifie que l'IP est valide et utilisable pour DHCP
     Retourne l'IP si valide, sinon lève ValueError
     """
-    try:
-        # Parser l'adresse IP
-        ip = IPv4Address(ip_str)
-        
-        # Vérifier que ce n'est pas une adresse spéciale
-        if (ip.is_multicast or      # 224.0.0.0 - 239.255.255.255
-            ip.is_unspecified or    # 0.0.0.0
-            ip.is_reserved or       # Réservée IETF
-            ip.is_loopback or       # 127.0.0.0/8
-            ip.is_link_local):      # 169.254.0.0/16
-            raise ValueError("bad IP address")
-        
-        # L'IP est valide
-        return ip_str
-        
-    except:
-        # Erreur de parsing ou IP invalide
+    ip = ip_str.strip()
+    if IP_RE.fullmatch(ip) is None:
         raise ValueError("bad IP address")
+    return ip
+
+
+def validate_macs(values):
+    """
+    Valide une colonne entière de MACs
+    Retourne (masque, valeurs) : masque[i] est True si values[i] est valide,
+    valeurs[i] est alors la MAC normalisée (None sinon)
+    """
+    if not values:
+        return [], []
+
+    text = _column(values)
+    if text is None:
+        # Cas rare : on revient à la validation une par une
+        return _one_by_one(validate_mac, values)
+
+    # Une seule traduction d'octets pour toute la colonne
+    lowered = text.lower()
+    shapes = _mac_shape(lowered).split(b"\n")
+    macs = lowered.split("\n")
+    if len(shapes) != len(macs):
+        return _one_by_one(validate_mac, values)
+
+    mask = list(map(MAC_SHAPES.__contains__, shapes))
+    normalized = [mac if shape == MAC_NORMAL_SHAPE else _normalize_mac(mac) if valid else None
+                  for mac, shape, valid in zip(macs, shapes, mask)]
+    return mask, normalized
+
+
+def validate_ips(values):
+    """
+    Valide une colonne entière d'IPs
+    Retourne (masque, valeurs) : masque[i] est True si values[i] est valide,
+    valeurs[i] est alors l'IP canonique (None sinon)
+    """
+    if not values:
+        return [], []
+
+    text = _column(values)
+    if text is None:
+        return _one_by_one(validate_ip, values)
+
+    found = _IP_LINES.findall(text)
+    mask = list(map(bool, found))
+    return mask, [ip or None for ip in found]
+
+
+def _one_by_one(validate, values):
+    normalized = []
+    for value in values:
+        try:
+            normalized.append(validate(value))
+        except ValueError:
+            normalized.append(None)
+    return [value is not None for value in normalized], normalized